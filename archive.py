@@ -0,0 +1,29 @@
+# TableMessageのレコードをファイルに書き出す・ファイルから読み込むコマンド
+# 書き出し：python archive.py export ./archive/20260101 --format parquet --segments 8
+#   （中断した場合は、同じディレクトリを指定して再度実行すると続きから書き出す）
+# 読み込み：python archive.py import ./archive/20260101
+#   （同じidのレコードは上書きする。開発環境のテーブルにレコードを投入するために使用する）
+import argparse
+
+from models.app_config import AppConfig
+from models.message_archive import MessageArchive
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_export = subparsers.add_parser("export", help="テーブルのレコードを全件ファイルに書き出す")
+    parser_export.add_argument("directory", help="書き出し先のディレクトリ")
+    parser_export.add_argument("--format", choices=["jsonl", "parquet"], default=None, help="書き出す形式")
+    parser_export.add_argument("--segments", type=int, default=None, help="並列にスキャンするセグメント数")
+    parser_import = subparsers.add_parser("import", help="書き出したファイルをテーブルに読み込む")
+    parser_import.add_argument("directory", help="読み込むファイルのディレクトリ")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        archive = MessageArchive.from_config(
+            AppConfig.get()["archive"], args.directory, args.format, args.segments
+        )
+        print(archive.export(lambda count: print(f"{count} records", flush=True)))
+    else:
+        print(MessageArchive.from_config(AppConfig.get()["archive"], args.directory).import_files())
@@ -0,0 +1,115 @@
+# /sendFirstMessageを一斉に送信し、同時実行数の制限の有無で以下を比較する（非同期サーバーで計測する）
+# ・ChatGPTのAPIに同時に送信されたリクエストの最大数と、503で断られたリクエストの件数
+# ・同時に送信した/getLastSourceCodeのレイテンシ（生成の待ち行列に並ばないこと）
+# 実行方法：python -m benchmarks.bench_admission --burst 60 --max-concurrency 8 --max-queue 16
+import time
+import asyncio
+import aiohttp
+import argparse
+import urllib.request
+
+from benchmarks.bench_endpoints import MESSAGES_SEED
+from benchmarks.harness import (
+    FakeOpenAiServer,
+    AppServer,
+    get_free_port,
+    start_dynamodb,
+    write_config,
+    seed_records,
+    percentile
+)
+
+
+# /sendFirstMessageを一斉に送信し、その間/getLastSourceCodeを送信し続ける
+async def run_burst(url: str, user_id: str, burst: int) -> dict[str, any]:
+    latencies: list[float] = []
+    latencies_last: list[float] = []
+    statuses: dict[int, int] = {}
+    retry_after: set[str] = set()
+    is_running = True
+
+    async def send(session: aiohttp.ClientSession, index: int) -> None:
+        start = time.perf_counter()
+
+        # 返答がキャッシュされないよう、リクエストごとに内容を変える
+        async with session.post(
+            f"{url}/sendFirstMessage", data={"content": f"回転する立方体{index}"}
+        ) as response:
+            await response.read()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            elif "Retry-After" in response.headers:
+                retry_after.add(response.headers["Retry-After"])
+
+    async def get_last(session: aiohttp.ClientSession) -> None:
+        while is_running:
+            start = time.perf_counter()
+
+            async with session.get(f"{url}/getLastSourceCode?userId={user_id}") as response:
+                await response.read()
+
+            latencies_last.append(time.perf_counter() - start)
+            await asyncio.sleep(0.05)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        task_last = asyncio.ensure_future(get_last(session))
+        await asyncio.gather(*[send(session, i) for i in range(burst)])
+        is_running = False
+        await task_last
+
+    return {
+        "statuses": statuses,
+        "retryAfter": sorted(retry_after),
+        "p95": percentile(latencies, 95),
+        "lastP50": percentile(latencies_last, 50) * 1000,
+        "lastP95": percentile(latencies_last, 95) * 1000
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--burst", type=int, default=60, help="一斉に送信する/sendFirstMessageの件数")
+    parser.add_argument("--latency", type=float, default=1.0, help="ChatGPTの返答までの時間（秒）")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="同時に実行できる件数")
+    parser.add_argument("--max-queue", type=int, default=16, help="枠が空くのを待てる件数")
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAiServer(latency=args.latency).start()
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+
+    print(f"burst: {args.burst}, latency of fake OpenAI: {args.latency}s")
+    print(
+        f"{'admission':>10} {'200':>5} {'503':>5} {'retryAfter':>11} {'upstream max':>13} "
+        f"{'p95[s]':>7} {'last p50[ms]':>13} {'last p95[ms]':>13}"
+    )
+
+    for backend in ("off", "memory", "dynamodb"):
+        port = get_free_port()
+        overrides = {"admission": {
+            "enabled": backend != "off",
+            "backend": "memory" if backend == "off" else backend,
+            "maxConcurrency": args.max_concurrency,
+            "maxQueue": args.max_queue,
+            "queueTimeout": args.latency * 4
+        }}
+        path_config = write_config(dynamodb_host, port, overrides)
+
+        with AppServer("main_async.py", path_config, fake_openai.api_base, port) as server:
+            urllib.request.urlopen(f"{server.url}/createTable").read()
+            user_id = seed_records(path_config, 1, MESSAGES_SEED)[0]
+            fake_openai.max_in_flight = 0
+            result = asyncio.run(run_burst(server.url, user_id, args.burst))
+
+        print(
+            f"{backend:>10} {result['statuses'].get(200, 0):>5} {result['statuses'].get(503, 0):>5} "
+            f"{','.join(result['retryAfter']) or '-':>11} {fake_openai.max_in_flight:>13} "
+            f"{result['p95']:>7.2f} {result['lastP50']:>13.1f} {result['lastP95']:>13.1f}"
+        )
+
+    fake_openai.stop()
@@ -0,0 +1,67 @@
+# TableMessageのレコードの書き出し（セグメント数ごと）と読み込みの速度を、1件ずつのやりとりの追加と比較する
+# ・seed：seed_records（user_idごとにinsert_records）でレコードを投入する
+# ・export：並列スキャンでjsonl（gzip）に書き出す
+# ・import：書き出したファイルをバッチ書き込みで読み込む（テーブルを空にしてから）
+# motoのサーバーはセグメントに分割せずに全件を返すため、セグメント数の比較にはDynamoDB Localを使用する
+# 実行方法：python -m benchmarks.bench_archive --users 1000 --segments 1 4 8 --dynamodb-host http://localhost:8000
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from benchmarks.bench_endpoints import MESSAGES_SEED
+from benchmarks.harness import get_free_port, start_dynamodb, write_config, seed_records
+
+
+# 処理時間を計測して1行で表示する
+def report(name: str, count: int, elapsed: float, count_expected: int) -> None:
+    note = "" if count == count_expected else f"  (expected {count_expected})"
+    print(f"{name:<12} {count:>8} records {elapsed:>8.2f}s {count / elapsed:>10.1f} records/s{note}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000, help="投入するuser_idの件数")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 4, 8], help="書き出しのセグメント数")
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    args = parser.parse_args()
+
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+    directory = tempfile.mkdtemp()
+    path_config = write_config(dynamodb_host, get_free_port(), {"archive": {"directory": directory}})
+    os.environ["APP_CONFIG_FILE"] = path_config
+
+    for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(key, "benchmark")
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+    from models.app_config import AppConfig
+    from models.message_archive import MessageArchive
+    from models.table_message import TableMessage
+    from models.table_counter import TableCounter
+
+    for table in (TableMessage, TableCounter):
+        if not table.exists():
+            table.create_table(wait=True)
+
+    count_expected = args.users * len(MESSAGES_SEED)
+    start = time.perf_counter()
+    seed_records(path_config, args.users, MESSAGES_SEED)
+    report("seed", count_expected, time.perf_counter() - start, count_expected)
+
+    for segments in args.segments:
+        path = os.path.join(directory, f"segments{segments}")
+        archive = MessageArchive.from_config(AppConfig.get()["archive"], path, "jsonl", segments)
+        start = time.perf_counter()
+        result = archive.export()
+        report(f"export x{segments}", result["count"], time.perf_counter() - start, count_expected)
+
+    # 最後に書き出したファイルを、空にしたテーブルに読み込む
+    TableMessage.delete_all_records()
+    start = time.perf_counter()
+    result = archive.import_files()
+    report("import", result["count"], time.perf_counter() - start, count_expected)
+
+    shutil.rmtree(directory)
@@ -0,0 +1,104 @@
+# スレッドのサーバー（main.py）と非同期サーバー（main_async.py）で、
+# /sendFirstMessageを同時に処理できる件数とメモリ使用量を比較する
+# 実行方法：python -m benchmarks.bench_async_serving --concurrency 50 200
+import time
+import asyncio
+import aiohttp
+import argparse
+import urllib.request
+
+from benchmarks.harness import (
+    FakeOpenAiServer,
+    AppServer,
+    get_free_port,
+    start_dynamodb,
+    write_config,
+    percentile
+)
+
+
+# 同時にリクエストを送信し、経過時間とサーバーのスレッド数の最大値を計測する
+async def run_load(server: AppServer, concurrency: int) -> dict[str, float]:
+    url = server.url
+    latencies: list[float] = []
+    errors = 0
+    max_threads = 0
+    is_running = True
+
+    # 0.1秒ごとにサーバーのスレッド数を取得する
+    async def monitor() -> None:
+        nonlocal max_threads
+
+        while is_running:
+            max_threads = max(max_threads, server.get_process_stats()["threads"])
+            await asyncio.sleep(0.1)
+
+    async def request(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+
+        async with session.post(f"{url}/sendFirstMessage", data={"content": "回転する立方体"}) as response:
+            await response.read()
+
+            if response.status != 200:
+                errors += 1
+
+        latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        task_monitor = asyncio.ensure_future(monitor())
+        start = time.perf_counter()
+        await asyncio.gather(*[request(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        is_running = False
+        await task_monitor
+
+    return {
+        "elapsed": elapsed,
+        "throughput": concurrency / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "errors": errors,
+        "threads": max_threads
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--latency", type=float, default=2.0, help="ChatGPTの返答までの時間（秒）")
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAiServer(latency=args.latency).start()
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+
+    print(f"latency of fake OpenAI: {args.latency}s")
+    print(
+        f"{'mode':>8} {'concurrency':>12} {'elapsed[s]':>11} {'req/s':>8} "
+        f"{'p50[s]':>8} {'p95[s]':>8} {'errors':>7} {'maxRSS[MB]':>11} {'threads':>8}"
+    )
+
+    for mode, script in [("threaded", "main.py"), ("async", "main_async.py")]:
+        # main.pyのポートは固定のため、両方とも5050で起動する
+        port = 5050 if mode == "threaded" else get_free_port()
+        path_config = write_config(dynamodb_host, port)
+
+        for concurrency in args.concurrency:
+            with AppServer(script, path_config, fake_openai.api_base, port) as server:
+                # テーブルを作成し、1件送信して初期化を済ませてから計測する
+                urllib.request.urlopen(f"{server.url}/createTable").read()
+                asyncio.run(run_load(server, 1))
+                result = asyncio.run(run_load(server, concurrency))
+                stats = server.get_process_stats()
+
+            print(
+                f"{mode:>8} {concurrency:>12} {result['elapsed']:>11.2f} "
+                f"{result['throughput']:>8.1f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+                f"{result['errors']:>7} {stats['maxRssMb']:>11.1f} {result['threads']:>8}"
+            )
+
+    fake_openai.stop()
@@ -0,0 +1,133 @@
+# コールドスタートにかかる時間を計測する
+# ・mainモジュールのimportにかかる時間（時間のかかるモジュールの上位も表示する）
+# ・プロセスの起動から最初のレスポンスまでの時間と、最初・2回目のDynamoDBへのアクセスを伴うリクエストの時間
+#   （起動時の事前準備prewarmの有無で比較する）
+# 実行方法：python -m benchmarks.bench_cold_start --repeat 5
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+from benchmarks.harness import (
+    PATH_ROOT,
+    FakeOpenAiServer,
+    AppServer,
+    get_free_port,
+    start_dynamodb,
+    write_config
+)
+
+
+# importにかかる時間（秒）を計測するスクリプト
+SCRIPT_IMPORT = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+# mainモジュールのimportにかかる時間（秒）を計測する
+def measure_import(env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT_IMPORT],
+        cwd=PATH_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+
+    return float(output.strip().splitlines()[-1])
+
+
+# -X importtimeの結果から、mainが直接importしているモジュールのうち累積時間の長いものを取得する
+def find_slow_imports(env: dict, count: int = 10) -> list[tuple[str, float]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PATH_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    modules = []
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 階層が1つ下のモジュールのみを対象とする（インデントが1段のもの）
+        if name.startswith("   ") and not name.startswith("     "):
+            modules.append((name.strip(), int(cumulative) / 1000))
+
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:count]
+
+
+# 経過時間（秒）を計測しながらリクエストを送信する
+def request_elapsed(url: str) -> float:
+    start = time.perf_counter()
+    urllib.request.urlopen(url).read()
+
+    return time.perf_counter() - start
+
+
+# アプリを起動し、最初のレスポンスまでの時間と、最初・2回目のDynamoDBへのアクセスの時間（秒）を計測する
+def measure_start(script: str, path_config: str, api_base: str, port: int) -> dict[str, float]:
+    start = time.perf_counter()
+
+    with AppServer(script, path_config, api_base, port) as server:
+        elapsed_listen = time.perf_counter() - start
+        request_elapsed(f"{server.url}/")
+        elapsed_first = time.perf_counter() - start
+        elapsed_db_first = request_elapsed(f"{server.url}/countUserId")
+        elapsed_db_second = request_elapsed(f"{server.url}/countUserId")
+
+    return {
+        "listen": elapsed_listen,
+        "firstResponse": elapsed_first,
+        "dbFirst": elapsed_db_first,
+        "dbSecond": elapsed_db_second
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="計測を繰り返す回数（中央値を表示する）")
+    parser.add_argument("--script", default="main.py", choices=["main.py", "main_async.py"])
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAiServer(latency=0.0).start()
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+    # main.pyのポートは固定のため、5050で起動する
+    port = 5050 if args.script == "main.py" else get_free_port()
+    paths_config = {
+        prewarm: write_config(dynamodb_host, port, {"prewarm": {"production": prewarm}})
+        for prewarm in (False, True)
+    }
+
+    # テーブルを作成しておく（事前準備でテーブルの情報を取得できるようにする）
+    with AppServer(args.script, paths_config[False], fake_openai.api_base, port) as server:
+        urllib.request.urlopen(f"{server.url}/createTable").read()
+
+    env = AppServer(args.script, paths_config[False], fake_openai.api_base, port).env
+    times_import = [measure_import(env) for _ in range(args.repeat)]
+
+    print(f"import main: median {statistics.median(times_import) * 1000:.1f}ms (repeat {args.repeat})")
+    print("slowest imports from main (cumulative):")
+
+    for name, elapsed in find_slow_imports(env):
+        print(f"  {name:<32} {elapsed:>8.1f}ms")
+
+    print(
+        f"\n{'prewarm':>8} {'listen[ms]':>11} {'1st response[ms]':>17} "
+        f"{'1st DynamoDB[ms]':>17} {'2nd DynamoDB[ms]':>17}"
+    )
+
+    for prewarm, path_config in paths_config.items():
+        results = [
+            measure_start(args.script, path_config, fake_openai.api_base, port)
+            for _ in range(args.repeat)
+        ]
+        median = {
+            key: statistics.median(result[key] for result in results) * 1000
+            for key in results[0]
+        }
+
+        print(
+            f"{str(prewarm):>8} {median['listen']:>11.1f} {median['firstResponse']:>17.1f} "
+            f"{median['dbFirst']:>17.1f} {median['dbSecond']:>17.1f}"
+        )
+
+    fake_openai.stop()
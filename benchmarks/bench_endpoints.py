@@ -0,0 +1,193 @@
+# ChatGPTのAPI、DynamoDB、URLの確認先をローカルの代替に置き換えて、
+# 主要なエンドポイントのレイテンシ（p50/p95/p99）とスループットをテーブルの件数ごとに計測する
+# 実行方法：python -m benchmarks.bench_endpoints --sizes 100 1000 10000
+# CIで使用する場合：--outputで結果を保存し、次回以降は--baselineで比較する（p95が許容範囲を超えて悪化した場合は終了コード1）
+import sys
+import json
+import time
+import asyncio
+import aiohttp
+import argparse
+import itertools
+import urllib.request
+
+from benchmarks.harness import (
+    REPLY_DEFAULT,
+    FakeOpenAiServer,
+    UrlServer,
+    AppServer,
+    get_free_port,
+    make_replies,
+    start_dynamodb,
+    write_config,
+    seed_records,
+    percentile
+)
+
+
+# 投入するuser_idごとのやりとり（アプリが保存するものと同じく、システムのメッセージから始める）
+MESSAGES_SEED = [
+    {"role": "system", "content": "`Three.js`を使って完全なjavascriptのコードを書いてください。"},
+    {"role": "user", "content": "回転する立方体を表示してください。"},
+    {"role": "assistant", "content": REPLY_DEFAULT},
+    {"role": "user", "content": "立方体の色を赤にしてください。"},
+    {"role": "assistant", "content": REPLY_DEFAULT}
+]
+
+
+# シナリオ（名前、メソッド、パス、user_idを使用するか）
+SCENARIOS = [
+    ("sendFirstMessage", "POST", "/sendFirstMessage", False),
+    ("sendMessage", "POST", "/sendMessage", True),
+    ("getLastSourceCode", "GET", "/getLastSourceCode", True),
+    ("countUserId", "GET", "/countUserId", False),
+    ("countUserId?mode=exact", "GET", "/countUserId?mode=exact", False)
+]
+
+
+# シナリオのリクエストを同時実行数を保って送信し、レイテンシとスループットを計測する
+async def run_scenario(
+    url: str,
+    scenario: tuple[str, str, str, bool],
+    user_ids: list[str],
+    requests: int,
+    concurrency: int
+) -> dict[str, float]:
+    name, method, path, uses_user_id = scenario
+    latencies: list[float] = []
+    errors = 0
+    cycle_user_id = itertools.cycle(user_ids)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(session: aiohttp.ClientSession, user_id: str) -> None:
+        nonlocal errors
+
+        async with semaphore:
+            start = time.perf_counter()
+
+            if method == "POST":
+                data = {"content": "回転する立方体を表示してください。"}
+
+                if uses_user_id:
+                    data["userId"] = user_id
+
+                context = session.post(f"{url}{path}", data=data)
+            else:
+                params = {"userId": user_id} if uses_user_id else None
+                context = session.get(f"{url}{path}", params=params)
+
+            async with context as response:
+                await response.read()
+
+                if response.status != 200:
+                    errors += 1
+
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            request(session, next(cycle_user_id)) for _ in range(requests)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000
+    }
+
+
+# 前回の結果と比較し、p95が許容範囲を超えて悪化したシナリオを返す
+def find_regressions(
+    results: list[dict], baseline: list[dict], tolerance: float
+) -> list[str]:
+    baseline_p95 = {(item["size"], item["scenario"]): item["p95"] for item in baseline}
+    regressions = []
+
+    for item in results:
+        p95 = baseline_p95.get((item["size"], item["scenario"]))
+
+        if p95 and item["p95"] > p95 * (1 + tolerance):
+            regressions.append(
+                f"{item['scenario']} (size {item['size']}): p95 {p95:.1f}ms -> {item['p95']:.1f}ms"
+            )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="テーブルのレコード件数")
+    parser.add_argument("--requests", type=int, default=200, help="シナリオごとのリクエスト件数")
+    parser.add_argument("--concurrency", type=int, default=10, help="同時に送信するリクエストの件数")
+    parser.add_argument("--latency", type=float, default=0.05, help="ChatGPTの返答までの時間（秒）")
+    parser.add_argument("--script", default="main.py", choices=["main.py", "main_async.py"])
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    parser.add_argument("--output", default=None, help="結果を保存するjsonファイル")
+    parser.add_argument("--baseline", default=None, help="比較する前回の結果のjsonファイル")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p95の悪化を許容する割合")
+    args = parser.parse_args()
+
+    url_server = UrlServer().start()
+    fake_openai = FakeOpenAiServer(latency=args.latency, replies=make_replies(url_server.url)).start()
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+    # main.pyのポートは固定のため、5050で起動する
+    port = 5050 if args.script == "main.py" else get_free_port()
+    # 同じuser_idに繰り返し送信しても、送信回数の上限に達しないようにする
+    path_config = write_config(
+        dynamodb_host, port, {"chatGpt": {"sendingMessage": {"maxCount": 1000000}}}
+    )
+    results: list[dict] = []
+    user_ids: list[str] = []
+
+    print(f"script: {args.script}, latency of fake OpenAI: {args.latency}s, concurrency: {args.concurrency}")
+    print(
+        f"{'size':>7} {'scenario':>24} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50[ms]':>9} {'p95[ms]':>9} {'p99[ms]':>9}"
+    )
+
+    with AppServer(args.script, path_config, fake_openai.api_base, port) as server:
+        urllib.request.urlopen(f"{server.url}/createTable").read()
+
+        # テーブルの件数が少ない順に、差分のレコードを投入しながら計測する
+        for size in sorted(args.sizes):
+            count_user = max(0, size // len(MESSAGES_SEED) - len(user_ids))
+            user_ids += seed_records(path_config, count_user, MESSAGES_SEED)
+
+            for scenario in SCENARIOS:
+                result = asyncio.run(run_scenario(
+                    server.url, scenario, user_ids, args.requests, args.concurrency
+                ))
+                result["size"] = size
+                results.append(result)
+
+                print(
+                    f"{size:>7} {result['scenario']:>24} {result['requests']:>9} "
+                    f"{result['errors']:>7} {result['throughput']:>8.1f} "
+                    f"{result['p50']:>9.1f} {result['p95']:>9.1f} {result['p99']:>9.1f}"
+                )
+
+    fake_openai.stop()
+    url_server.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"script": args.script, "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = find_regressions(results, json.load(file)["results"], args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+
+        if regressions:
+            sys.exit(1)
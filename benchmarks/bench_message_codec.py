@@ -0,0 +1,127 @@
+# メッセージの保存形式（平文、zlib、zstd、差分）ごとに、保存したバイト数と書き込み・読み込みの時間を比較する
+# 大きめのシーンのソースコードを、1行ずつ変更しながら返答として保存したやりとりを使用する
+# 実行方法：python -m benchmarks.bench_message_codec --turns 50 --repeat 5
+import os
+import math
+import time
+import argparse
+import statistics
+
+from benchmarks.harness import (
+    REPLY_DEFAULT,
+    get_free_port,
+    start_dynamodb,
+    write_config
+)
+
+
+# 保存形式（名前、圧縮方式、差分で保存するかどうか）
+FORMATS = [
+    ("plain", "none", False),
+    ("zlib", "zlib", False),
+    ("zstd", "zstd", False),
+    ("zlib+delta", "zlib", True),
+    ("zstd+delta", "zstd", True)
+]
+
+
+# 返答のソースコードを作成する（objects個のオブジェクトを配置したシーンで、turn番目の変更を加える）
+def make_reply(objects: int, turn: int) -> str:
+    lines = REPLY_DEFAULT.splitlines()[:-1]
+
+    for i in range(objects):
+        # turnごとに1つのオブジェクトの色を変える
+        color = (i * 2654435761 + (turn if i == turn % objects else 0)) % 0xFFFFFF
+        lines.append(
+            f"const mesh{i} = new THREE.Mesh(new THREE.BoxGeometry({i % 5 + 1}, 1, 1), "
+            f"new THREE.MeshStandardMaterial({{ color: 0x{color:06x} }}));"
+        )
+        lines.append(f"mesh{i}.position.set({i % 10}, {i // 10}, 0);")
+        lines.append(f"scene.add(mesh{i});")
+
+    lines.append("```")
+
+    return "\n".join(lines)
+
+
+# 保存したレコードのcontentに関する列のバイト数の合計を取得する
+def count_bytes(items: list) -> int:
+    return sum(
+        len(item.content_encoded) if item.content_encoded else len(item.content.encode("utf-8"))
+        for item in items
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=50, help="1つのやりとりに含まれる返答の件数")
+    parser.add_argument("--objects", type=int, default=100, help="シーンに配置するオブジェクトの数")
+    parser.add_argument("--repeat", type=int, default=5, help="読み込みを繰り返す回数（中央値を表示する）")
+    parser.add_argument("--dynamodb-host", default=None, help="DynamoDB Localの接続先")
+    args = parser.parse_args()
+
+    dynamodb_host = start_dynamodb(args.dynamodb_host)
+    os.environ["APP_CONFIG_FILE"] = write_config(dynamodb_host, get_free_port())
+
+    for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(key, "benchmark")
+
+    from models import table_message
+    from models.table_counter import TableCounter
+    from models.message_codec import MessageCodec, zstandard
+
+    TableMessage = table_message.TableMessage
+
+    for table in (TableMessage, TableCounter):
+        if not table.exists():
+            table.create_table(wait=True)
+
+    messages = [
+        {"role": "system", "content": "`Three.js`を使って完全なjavascriptのコードを書いてください。"}
+    ]
+
+    for turn in range(args.turns):
+        messages.append({"role": "user", "content": f"{turn}番目のオブジェクトの色を変えてください。"})
+        messages.append({"role": "assistant", "content": make_reply(args.objects, turn)})
+
+    print(
+        f"turns: {args.turns}, reply size: {len(messages[-1]['content'])} chars, "
+        f"zstd: {'available' if zstandard else 'not installed (zlib is used)'}"
+    )
+    print(
+        f"{'format':>11} {'stored[KB]':>11} {'ratio':>7} {'read RCU':>9} "
+        f"{'write[ms]':>10} {'read[ms]':>9}"
+    )
+    bytes_plain = 0
+
+    for name, compression, delta in FORMATS:
+        table_message.CODEC = MessageCodec(compression, 512, delta, 0.5)
+        user_id = f"bench-codec-{name}-{time.time_ns()}"
+
+        # 1件ずつやりとりを保存する（アプリと同じく、前回の返答を差分の基準とする）
+        start = time.perf_counter()
+        base = TableMessage.insert_records(user_id, messages[:3])
+
+        for i in range(3, len(messages), 2):
+            base = TableMessage.insert_records(user_id, messages[i:i + 2], base)
+
+        elapsed_write = time.perf_counter() - start
+
+        # 読み込み時間を計測し、保存した内容と一致するか確認する
+        elapsed_read = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            records = TableMessage.select_records(user_id)
+            elapsed_read.append(time.perf_counter() - start)
+
+        assert [record["content"] for record in records] == [message["content"] for message in messages]
+
+        stored = count_bytes(list(TableMessage.user_id_index.query(user_id)))
+        bytes_plain = bytes_plain or stored
+
+        print(
+            f"{name:>11} {stored / 1024:>11.1f} {stored / bytes_plain:>7.2f} "
+            f"{math.ceil(stored / 4096):>9} {elapsed_write * 1000:>10.1f} "
+            f"{statistics.median(elapsed_read) * 1000:>9.1f}"
+        )
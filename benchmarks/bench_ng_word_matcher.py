@@ -0,0 +1,69 @@
+# NGワードの検索にかかる時間をルール数ごとに計測する
+# 実行方法：python -m benchmarks.bench_ng_word_matcher
+import random
+import string
+import timeit
+
+from models.ng_word_matcher import NgWordMatcher
+
+
+# ルール数
+RULE_COUNTS = [1, 10, 100, 1000]
+# 1回の計測で繰り返す回数
+NUMBER = 20
+
+
+# ランダムなNGワードのルールを作成する
+def make_words(count: int) -> list[dict[str, str]]:
+    words = [{"NG": "THREE.Geometry", "OK": "THREE.BufferGeometry"}]
+
+    while len(words) < count:
+        name = "".join(random.choices(string.ascii_letters, k=12))
+        words.append({"NG": f"THREE.{name}", "OK": f"THREE.{name}Ex"})
+
+    return words[:count]
+
+
+# 計測対象のソースコード（約20KB）を作成する
+def make_source_code() -> str:
+    lines = [
+        "const geometry = new THREE.BoxGeometry(1, 1, 1);",
+        "const material = new THREE.MeshStandardMaterial({ color: 0x00ff00 });",
+        "const mesh = new THREE.Mesh(geometry, material);",
+        "scene.add(mesh);",
+    ]
+
+    return "".join(random.choice(lines) for _ in range(400)) + "new THREE.Geometry();"
+
+
+# 1ルールずつ`in`で確認する（従来の方法）
+def check_naive(ng_words: list[str], source_code: str) -> list[str]:
+    return [ng_word for ng_word in ng_words if ng_word in source_code]
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    source_code = make_source_code()
+
+    print(f"source code: {len(source_code)} chars, {NUMBER} runs each")
+    print(f"{'rules':>6} {'naive [ms]':>12} {'matcher [ms]':>13} {'compile [ms]':>13}")
+
+    for count in RULE_COUNTS:
+        words = make_words(count)
+        ng_words = [word["NG"] for word in words]
+        time_compile = timeit.timeit(lambda: NgWordMatcher(words), number=1)
+        matcher = NgWordMatcher(words)
+
+        # 両方の方法で結果が一致することを確認する
+        assert matcher.check(source_code) == check_naive(ng_words, source_code)
+
+        time_naive = timeit.timeit(
+            lambda: check_naive(ng_words, source_code), number=NUMBER
+        )
+        time_matcher = timeit.timeit(
+            lambda: matcher.check(source_code), number=NUMBER
+        )
+        print(
+            f"{count:>6} {time_naive / NUMBER * 1000:>12.3f} "
+            f"{time_matcher / NUMBER * 1000:>13.3f} {time_compile * 1000:>13.3f}"
+        )
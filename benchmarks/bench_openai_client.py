@@ -0,0 +1,99 @@
+# ChatGPTのAPIへのリクエストを、ローカルのFakeOpenAiServerに対して送信し、OpenAiClientの設定ごとに比較する
+# ・plain：再送信なし（openaiモジュールを直接使用した場合に相当）
+# ・retry：429とRetry-Afterを返すサーバーに対して、再送信で成功する割合と時間
+# ・hedge：一部の応答が遅いサーバーに対して、追加のリクエストを送信した場合のp95、p99
+# ・timeout：応答が返らないサーバーに対して、全体の期限で打ち切られるまでの時間
+# 実行方法：python -m benchmarks.bench_openai_client --requests 200 --concurrency 8
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import FakeOpenAiServer, percentile
+
+
+# 同時にリクエストを送信し、成功したものと失敗したものの経過時間（秒）のリストを返す
+def run(client, count: int, concurrency: int) -> tuple[list[float], list[float]]:
+    messages = [{"role": "user", "content": "cube"}]
+
+    def request(_: int) -> tuple[bool, float]:
+        start = time.perf_counter()
+
+        try:
+            client.create("sk-benchmark", model="gpt-4o", temperature=1.0, messages=messages)
+        except Exception:
+            return False, time.perf_counter() - start
+
+        return True, time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(request, range(count)))
+
+    return (
+        [elapsed for is_ok, elapsed in results if is_ok],
+        [elapsed for is_ok, elapsed in results if not is_ok]
+    )
+
+
+# 結果を1行で表示する（elapsedは経過時間を集計するリスト）
+def report(
+    name: str, server: FakeOpenAiServer, count_ok: int, count_failed: int, elapsed: list[float]
+) -> None:
+    print(
+        f"{name:<10} {count_ok:>4} ok {count_failed:>4} failed "
+        f"p50 {percentile(elapsed, 50) * 1000:>8.1f}ms p95 {percentile(elapsed, 95) * 1000:>8.1f}ms "
+        f"p99 {percentile(elapsed, 99) * 1000:>8.1f}ms  upstream {server.count + server.count_error:>4} "
+        f"connections {len(server.connections):>3}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="シナリオごとのリクエストの件数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に送信するリクエストの数")
+    parser.add_argument("--latency", type=float, default=0.05, help="通常の応答時間（秒）")
+    args = parser.parse_args()
+
+    # openaiモジュールを読み込む前に、接続先をローカルのサーバーにする
+    servers = {
+        "retry": FakeOpenAiServer(latency=args.latency, error_rate=0.3, retry_after=0.05).start(),
+        "hedge": FakeOpenAiServer(latency=args.latency, slow_rate=0.05, slow_latency=1.0).start(),
+        "timeout": FakeOpenAiServer(latency=30.0).start()
+    }
+    os.environ["OPENAI_API_BASE"] = servers["retry"].api_base
+
+    import openai
+    from models.openai_client import OpenAiClient
+
+    hedge = {"enabled": True, "percentile": 0.9, "minSamples": 20, "window": 200}
+    scenarios = [
+        ("plain", "retry", OpenAiClient(max_retries=0)),
+        ("retry", "retry", OpenAiClient(max_retries=5, backoff_base=0.05)),
+        ("no hedge", "hedge", OpenAiClient()),
+        ("hedge", "hedge", OpenAiClient(hedge=hedge)),
+        ("timeout", "timeout", OpenAiClient(timeout=0.5, deadline=1.2, backoff_base=0.05))
+    ]
+
+    for name, server_name, client in scenarios:
+        server = servers[server_name]
+        openai.api_base = server.api_base
+        server.count = server.count_error = 0
+        server.connections.clear()
+
+        # 追加のリクエストは応答時間の記録が揃ってから送信されるため、事前に記録を溜める
+        if client.hedge["enabled"]:
+            run(client, hedge["minSamples"], args.concurrency)
+            server.count = server.count_error = 0
+
+        elapsed, elapsed_failed = run(
+            client, args.concurrency if name == "timeout" else args.requests, args.concurrency
+        )
+
+        # 期限で打ち切られる場合は、失敗までの時間を表示する
+        report(
+            name, server, len(elapsed), len(elapsed_failed),
+            elapsed_failed if name == "timeout" else elapsed
+        )
+
+    for server in servers.values():
+        server.stop()
@@ -0,0 +1,398 @@
+# ベンチマークで使用する共通の部品
+# ・ChatGPTのAPIを模したローカルサーバー（FakeOpenAiServer）
+# ・URLの確認先となるローカルサーバー（UrlServer）
+# ・DynamoDBの代替（DynamoDB Local、またはインストールされている場合はmotoのサーバー）
+# ・ベンチマーク用の設定ファイルとアプリのサーバーの起動、テーブルへのレコードの投入
+import os
+import sys
+import copy
+import json
+import time
+import random
+import logging
+import socket
+import asyncio
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+
+from models.file_access import FileAccess
+
+
+# リポジトリのルートディレクトリ
+PATH_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# ChatGPTの返答の初期値
+REPLY_DEFAULT = (
+    "```javascript\n"
+    "import * as THREE from 'three';\n"
+    "const scene = new THREE.Scene();\n"
+    "const camera = new THREE.PerspectiveCamera(75, 1, 0.1, 1000);\n"
+    "const renderer = new THREE.WebGLRenderer();\n"
+    "document.body.appendChild(renderer.domElement);\n"
+    "const mesh = new THREE.Mesh(new THREE.BoxGeometry(), new THREE.MeshNormalMaterial());\n"
+    "scene.add(mesh);\n"
+    "camera.position.z = 3;\n"
+    "renderer.setAnimationLoop(() => { mesh.rotation.y += 0.01; renderer.render(scene, camera); });\n"
+    "```"
+)
+
+
+# 空いているポート番号を取得する
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+
+        return sock.getsockname()[1]
+
+
+# ルールに違反する返答を含む、ChatGPTの返答の一覧を作成する
+# （url_baseにはUrlServerのURLを指定する。{n}はリクエストごとに連番に置き換えられ、URLの確認結果がキャッシュされないようにする）
+def make_replies(url_base: str) -> list[str]:
+    texture = (
+        "const texture = new THREE.TextureLoader().load('{url}');\n"
+        "mesh.material = new THREE.MeshBasicMaterial({{ map: texture }});\n"
+    )
+
+    return [
+        REPLY_DEFAULT,
+        # 有効なURLのテクスチャを使用する
+        REPLY_DEFAULT.replace(
+            "camera.position.z = 3;\n",
+            "camera.position.z = 3;\n" + texture.format(url=f"{url_base}/texture.png?n={{n}}")
+        ),
+        # NGワード（THREE.Geometry）を使用する
+        REPLY_DEFAULT.replace("new THREE.BoxGeometry()", "new THREE.Geometry()"),
+        # 使用できないモジュールをimportする
+        REPLY_DEFAULT.replace(
+            "import * as THREE from 'three';\n",
+            "import * as THREE from 'three';\nimport * as CANNON from 'cannon-es';\n"
+        ),
+        # 無効なURLのテクスチャを使用する
+        REPLY_DEFAULT.replace(
+            "camera.position.z = 3;\n",
+            "camera.position.z = 3;\n" + texture.format(url=f"{url_base}/missing.png?n={{n}}")
+        )
+    ]
+
+
+# 別スレッドのイベントループで動作するローカルサーバー
+class LocalServer:
+    def __init__(self) -> None:
+        self.port = get_free_port()
+        self.__loop = asyncio.new_event_loop()
+        self.__runner: web.AppRunner | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    # サーバーのアプリを作成する（継承先で実装する）
+    def make_app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def __start(self) -> None:
+        self.__runner = web.AppRunner(self.make_app())
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, "127.0.0.1", self.port).start()
+
+    # 別スレッドでサーバーを起動する
+    def start(self) -> "LocalServer":
+        threading.Thread(target=self.__loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.__start(), self.__loop).result()
+
+        return self
+
+    # サーバーを停止する
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.__runner.cleanup(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+
+# ChatGPTのAPI（chat completions）を模したローカルサーバー
+# （error_rateの割合でerror_status（429など）とRetry-Afterを返し、slow_rateの割合で返答までの時間をslow_latencyにする）
+class FakeOpenAiServer(LocalServer):
+    def __init__(
+        self,
+        latency: float = 1.0,
+        replies: list[str] | None = None,
+        error_rate: float = 0.0,
+        retry_after: float = 0.1,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+        seed: int = 0,
+        error_status: int = 429
+    ) -> None:
+        super().__init__()
+        # 返答までの時間（秒）
+        self.latency = latency
+        # 順番に返す返答（最後まで返したら先頭に戻る）
+        self.replies = replies or [REPLY_DEFAULT]
+        # エラーを返す割合と、Retry-Afterの秒数、ステータスコード
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.error_status = error_status
+        # 返答が遅くなる割合と、その場合の返答までの時間（秒）
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        # 次のリクエストから、必ずエラーを返す件数と、必ず返答を遅くする件数（テストで使用する）
+        self.error_next = 0
+        self.slow_next = 0
+        self.__random = random.Random(seed)
+        # 受け付けたリクエストの件数と、429を返した件数
+        self.count = 0
+        self.count_error = 0
+        # リクエストを受け付けた接続（接続元のポート）
+        self.connections: set[int] = set()
+        # 返答中のリクエストの件数と、その最大値
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    # ChatGPTのAPIのURL（環境変数OPENAI_API_BASEに設定する）
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}/v1"
+
+    # 返答を作成する
+    async def __handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.connections.add(request.transport.get_extra_info("peername")[1])
+
+        # 混雑している場合を模して、429などのエラーを返す
+        if self.error_next > 0 or self.__random.random() < self.error_rate:
+            self.error_next = max(0, self.error_next - 1)
+            self.count_error += 1
+
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": None}},
+                status=self.error_status,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+
+        reply = self.replies[self.count % len(self.replies)].replace("{n}", str(self.count))
+        self.count += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            if self.slow_next > 0:
+                self.slow_next -= 1
+                await asyncio.sleep(self.slow_latency)
+            else:
+                await asyncio.sleep(
+                    self.slow_latency if self.__random.random() < self.slow_rate else self.latency
+                )
+        finally:
+            self.in_flight -= 1
+
+        # ストリーミングの場合はServer-Sent Eventsで少しずつ返す
+        if body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+
+            for i in range(0, len(reply), 20):
+                chunk = {"choices": [{"index": 0, "delta": {"content": reply[i:i + 20]}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+            await response.write(b"data: [DONE]\n\n")
+
+            return response
+
+        return web.json_response({
+            "id": f"chatcmpl-{self.count}",
+            "object": "chat.completion",
+            "model": body.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": sum(len(m["content"]) for m in body["messages"]) // 3,
+                "completion_tokens": len(reply) // 3,
+                "total_tokens": (sum(len(m["content"]) for m in body["messages"]) + len(reply)) // 3
+            }
+        })
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.__handle)
+
+        return app
+
+
+# URLの確認先となるローカルサーバー（/missingで始まるパスは404、それ以外は200を返す）
+class UrlServer(LocalServer):
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        # 応答までの時間（秒）
+        self.latency = latency
+
+    async def __handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+
+        return web.Response(status=404 if request.path.startswith("/missing") else 200)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.__handle)
+
+        return app
+
+
+# DynamoDBの代替を用意し、接続先を返す（hostを指定した場合はそれを使用する）
+def start_dynamodb(host: str | None = None) -> str:
+    if host:
+        return host
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit(
+            "DynamoDB Localの接続先を--dynamodb-hostで指定するか、motoをインストールしてください。"
+        )
+
+    # motoのサーバーのアクセスログを出力しない
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = get_free_port()
+    ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False).start()
+
+    return f"http://127.0.0.1:{port}"
+
+
+# 設定の一部を上書きする（辞書は階層ごとに結合する）
+def merge_config(config: dict, overrides: dict) -> None:
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge_config(config[key], value)
+        else:
+            config[key] = value
+
+
+# ベンチマーク用の設定ファイルを一時ディレクトリに作成し、そのパスを返す
+def write_config(dynamodb_host: str, port: int, overrides: dict | None = None) -> str:
+    directory = tempfile.mkdtemp(prefix="bench_")
+    config = copy.deepcopy(FileAccess(os.path.join(PATH_ROOT, "appconfig.json")).read_json_file())
+    path_secret = os.path.join(directory, "secret.json")
+    path_config = os.path.join(directory, "appconfig.json")
+
+    # デバッグモードのリローダーで別プロセスが起動しないよう、本番環境の設定を使用する
+    config["environment"]["value"] = "production"
+    config["dynamoDb"]["host"] = dynamodb_host
+    config["filePath"]["secret"] = path_secret
+    config["asyncServer"]["port"] = port
+    # リクエスト頻度と同時実行数の制限で計測が妨げられないようにする
+    for environment in config["limit"]:
+        if environment not in ("comment", "storageUri"):
+            config["limit"][environment] = "1000000 per minute"
+
+    config["admission"]["enabled"] = False
+
+    merge_config(config, overrides or {})
+
+    FileAccess(path_secret).write_json_file({
+        "apiKey": {"openAi": "sk-benchmark"},
+        "password": {"database": "benchmark"}
+    })
+    FileAccess(path_config).write_json_file(config)
+
+    return path_config
+
+
+# アプリのサーバーをサブプロセスで起動する
+class AppServer:
+    def __init__(self, script: str, path_config: str, api_base: str, port: int = 5050) -> None:
+        self.script = script
+        self.port = port
+        self.env = dict(
+            os.environ,
+            APP_CONFIG_FILE=path_config,
+            OPENAI_API_BASE=api_base,
+            AWS_ACCESS_KEY_ID="benchmark",
+            AWS_SECRET_ACCESS_KEY="benchmark",
+            AWS_DEFAULT_REGION="ap-northeast-1",
+            PYTHONUNBUFFERED="1"
+        )
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    # 起動し、接続できるようになるまで待つ
+    def __enter__(self) -> "AppServer":
+        self.process = subprocess.Popen(
+            [sys.executable, self.script],
+            cwd=PATH_ROOT,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + 30
+
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+
+        self.process.kill()
+        raise RuntimeError(f"{self.script}を起動できませんでした。")
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+    # プロセスのメモリ使用量の最大値（MB）とスレッド数を取得する（Linuxのみ）
+    def get_process_stats(self) -> dict[str, float]:
+        stats = {"maxRssMb": 0.0, "threads": 0}
+
+        try:
+            with open(f"/proc/{self.process.pid}/status", encoding="utf-8") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        stats["maxRssMb"] = int(line.split()[1]) / 1024
+                    elif line.startswith("Threads:"):
+                        stats["threads"] = int(line.split()[1])
+        except FileNotFoundError:
+            pass
+
+        return stats
+
+
+# テーブルにuser_idごとのやりとりを投入し、投入したuser_idを返す
+# （テーブルはアプリの/createTableで作成しておく。設定ファイルは最初に呼び出したときのものが使用される）
+def seed_records(
+    path_config: str, count_user: int, messages: list[dict[str, str]], max_workers: int = 8
+) -> list[str]:
+    os.environ["APP_CONFIG_FILE"] = path_config
+
+    for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(key, "benchmark")
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+    from models.table_message import TableMessage
+
+    user_ids = [f"bench{time.time_ns()}{i:08d}" for i in range(count_user)]
+
+    def insert(user_id: str) -> None:
+        TableMessage.insert_records(user_id, messages)
+        TableMessage.register_user_id()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(insert, user_ids))
+
+    return user_ids
+
+
+# 経過時間のリストからパーセンタイル値を取得する
+def percentile(values: list[float], rate: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(rate / 100 * (len(values) - 1))))]
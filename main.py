@@ -1,24 +1,120 @@
-from flask import Flask, request, jsonify, Response
-from werkzeug.exceptions import NotFound, BadRequest, InternalServerError
-
+import os
+import re
+import time
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, Response, stream_with_context, g
+from typing import Callable, Iterator
+from werkzeug.exceptions import (
+    NotFound,
+    BadRequest,
+    InternalServerError,
+    ServiceUnavailable
+)
+
+from models.app_config import AppConfig
 from models.app_setting import AppSetting
 from models.utility import Utility
 from models.chat_gpt import ChatGpt
-from models.file_access import FileAccess
+from models.url_validator import UrlValidator
+from models.ng_word_matcher import NgWordMatcher
+from models.code_repairer import CodeRepairer
+from models.stream_validator import StreamValidator
+from models.generation_cache import GenerationCache
+from models.job_runner import JobRunner
+from models.admission_controller import AdmissionController
+from models.message_archive import MessageArchive
+from models.metrics import Metrics
+from models.table_message import TableMessage, FIELDS_RECORD
+from models.table_counter import TableCounter
+from models.table_cache import TableCache
+from models.table_job import TableJob
+from models.table_latest import TableLatest
+from models.conversation_session import ConversationSession
 
 
 # 共通変数（定数）の定義
-PATH_CONFIG_FILE = "./appconfig.json"
-APP_CONFIG = FileAccess(PATH_CONFIG_FILE).read_json_file()
-SECRET = FileAccess(APP_CONFIG["filePath"]["secret"]).read_json_file()
+# 設定ファイルとシークレットファイルは、AppConfigで1度だけ読み込む
+APP_CONFIG = AppConfig.get()
+SECRET = AppConfig.get_secret()
 RETRY_COUNT = APP_CONFIG["chatGpt"]["sendingMessage"]["retryCount"]
+# 返答の候補を複数生成する設定（modeが"off"の場合は1件のみ生成する）
+CANDIDATES = APP_CONFIG["chatGpt"]["sendingMessage"]["candidates"]
+# ChatGPTに送信する初期メッセージ
+PROMPT_SYSTEM = "`Three.js`を使って完全なjavascriptのコードを書いてください。"
+# ChatGPTに送信する最初のユーザーメッセージ（{content}にユーザーの入力が入る）
+PROMPT_USER_FIRST = (
+    "{content}`を描いてください。\n" +
+    "ただし、以下のコーディングルールを遵守してください。\n" +
+    "・import文から始めてください。\n" +
+    "・`html`の`body`には、何もタグが記述されていないと仮定する。\n" +
+    "・生成した`canvas`は`document.body`に追加する。"
+)
+# NGワードは起動時に1度だけ検索用の形式に変換する
+NG_WORD_MATCHER = NgWordMatcher(APP_CONFIG["chatGpt"]["receivingMessage"]["words"])
+# ルールに違反した返答をローカルで修正するためのインスタンス（無効な場合はNone）
+CODE_REPAIRER = CodeRepairer(
+    NG_WORD_MATCHER, APP_CONFIG["chatGpt"]["receivingMessage"]["importableModules"]
+) if APP_CONFIG["chatGpt"]["receivingMessage"]["autoRepair"] else None
+# 返答を受信しながらルールを確認し、違反が確定した時点で受信を打ち切る設定
+STREAM_ABORT = APP_CONFIG["chatGpt"]["receivingMessage"]["streamAbort"]
+# URLの確認結果をリクエストを跨いでキャッシュするため、インスタンスを共有する
+URL_VALIDATOR = UrlValidator(
+    APP_CONFIG["urlValidation"]["timeout"],
+    APP_CONFIG["urlValidation"]["deadline"],
+    APP_CONFIG["urlValidation"]["maxWorkers"],
+    APP_CONFIG["urlValidation"]["cacheTtl"],
+    APP_CONFIG["urlValidation"]["cacheSize"]
+)
+# 最初のメッセージに対するやりとりのキャッシュ
+GENERATION_CACHE = GenerationCache.from_config(APP_CONFIG["generationCache"])
+# ChatGPTとのやりとりをジョブとして実行するためのインスタンス
+JOB_RUNNER = JobRunner(
+    APP_CONFIG["job"]["maxWorkers"],
+    APP_CONFIG["job"]["maxQueue"],
+    APP_CONFIG["job"]["ttl"]
+)
+# ChatGPTにメッセージを送信するリクエストの同時実行数を制限するためのインスタンス（無効な場合はNone）
+ADMISSION = AdmissionController.from_config(
+    APP_CONFIG["admission"]
+) if APP_CONFIG["admission"]["enabled"] else None
+# 1件のリクエストで確保する枠の数（候補を同時に生成する場合は、同時に送信する件数分）
+ADMISSION_WEIGHT = CANDIDATES["count"] if CANDIDATES["mode"] == "concurrent" else 1
 
 # Flaskアプリのインスタンスを作成
 app = Flask(__name__)
 # アプリの初期設定
-AppSetting.set_config(app, PATH_CONFIG_FILE)
+AppSetting.set_config(app, APP_CONFIG)
 AppSetting.allow_cors(app)
-AppSetting.limit_request(app, PATH_CONFIG_FILE)
+# 非同期サーバーで処理するエンドポイントも、同じインスタンスでリクエストの頻度を制限する
+LIMITER = AppSetting.limit_request(app, APP_CONFIG)
+
+
+# リクエストの処理を開始したとき、処理時間の計測を開始する
+@app.before_request
+def start_metrics() -> None:
+    g.started_at = time.perf_counter()
+    Metrics.start_timings()
+
+
+# レスポンスを返すとき、処理時間を記録し、工程ごとの処理時間をヘッダーに追加する
+# （ストリーミングの場合は、最初のイベントを返すまでの処理時間となる）
+@app.after_request
+def record_metrics(response: Response) -> Response:
+    if "started_at" not in g:
+        return response
+
+    seconds = time.perf_counter() - g.started_at
+    endpoint = request.url_rule.rule if request.url_rule else "unknown"
+    Metrics.observe(
+        "http_request_seconds", seconds, endpoint=endpoint, status=response.status_code
+    )
+    Metrics.add_timing("total", seconds)
+    response.headers["Server-Timing"] = Metrics.get_server_timing()
+
+    return response
 
 
 # 接続テスト用
@@ -30,173 +126,299 @@ def index() -> str:
 # ChatGPTに最初のメッセージを送信する
 @app.route("/sendFirstMessage", methods=["POST"])
 def send_first_message() -> Response:
-    from models.table_message import TableMessage
+    # リクエストの受取り
+    content = request.form["content"]
+
+    # user_idとソースコードを返す
+    return jsonify(run_first_message(content, request.path))
+
 
+# ChatGPTに最初のメッセージを送信し、返答をServer-Sent Eventsで少しずつ返す
+@app.route("/sendFirstMessageStream", methods=["POST"])
+def send_first_message_stream() -> Response:
     # リクエストの受取り
     content = request.form["content"]
     # 日付+16桁ランダムな文字列をuser_idとする
     user_id = f"{Utility.get_date_str()}{Utility.generate_random_string(16)}"
-    # 設定ファイルからAPIキーを取得する
-    chat_gpt = ChatGpt(SECRET["apiKey"]["openAi"])
-    message_user = ""
-
-    # ChatGPTに送信する初期メッセージを設定する
-    chat_gpt.set_message_init(
-        "`Three.js`を使って完全なjavascriptのコードを書いてください。"
-    )
-    # ユーザーメッセージを作成する
-    message_user = (
-        f"{content}`を描いてください。\n" +
-        "ただし、以下のコーディングルールを遵守してください。\n" +
-        "・import文から始めてください。\n" +
-        "・`html`の`body`には、何もタグが記述されていないと仮定する。\n" +
-        "・生成した`canvas`は`document.body`に追加する。"
-    )
     # ChatGPTに送信するメッセージを設定する
-    chat_gpt.add_message_user(
-        message_user,
-        APP_CONFIG["chatGpt"]["sendingMessage"]["maxContentLength"]
-    )
-    # ChatGPTにメッセージを送信する
-    chat_gpt.send_message(1.0)
-
-    for i in range(RETRY_COUNT):
-        # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
-        # 追加のメッセージを作成する
-        message_user = make_additional_message(chat_gpt)
-
-        if message_user:
-            # ChatGPTに送信するメッセージを設定する
-            chat_gpt.add_message_user(message_user)
-            # ChatGPTにメッセージを送信する
-            chat_gpt.send_message(1.0)
+    chat_gpt = make_chat_gpt_first(content)
+
+    # キャッシュのキーを作成し、キャッシュからやりとりを取得する
+    cache_key = make_cache_key(content)
+    messages_cache = GENERATION_CACHE.get(cache_key)
+    # ChatGPTに送信する場合は、ストリームを開始する前に枠を確保する（確保できない場合はエラーを返す）
+    lease = None if messages_cache else acquire_admission(request.path)
+
+    def generate() -> Iterator[str]:
+        # キャッシュが存在する場合は、ChatGPTにメッセージを送信せず、返答をまとめて返す
+        if messages_cache:
+            set_reply_cached(chat_gpt, messages_cache)
+            yield Utility.format_sse(
+                "token", {"content": chat_gpt.get_content_assistant()}
+            )
         else:
-            break
+            # ChatGPTにメッセージを送信し、返答を少しずつ返す（修正を依頼できる場合は、違反が確定した時点で打ち切る）
+            yield from stream_message(chat_gpt, validator=make_stream_validator(RETRY_COUNT > 0))
+            # 最後の返答がルールを満たすかどうか（確認していない場合はNone）
+            is_valid = None
 
-    # ChatGPTとのやりとりをテーブルに保存する
-    TableMessage.insert_records(user_id, chat_gpt.messages)
+            for i in range(RETRY_COUNT):
+                # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                # 追加のメッセージを作成する
+                message_user = make_additional_message(chat_gpt)
+
+                if message_user:
+                    # 再送信することを通知する
+                    yield Utility.format_sse("retry", {"count": i + 1})
+                    # ChatGPTにメッセージを送信し、返答を少しずつ返す
+                    chat_gpt.add_message_user(message_user)
+                    yield from stream_message(
+                        chat_gpt, validator=make_stream_validator(i + 1 < RETRY_COUNT)
+                    )
+                else:
+                    is_valid = True
+                    break
+
+            # ルールを満たす返答が得られた場合は、キャッシュに保存する
+            set_cache(cache_key, chat_gpt, is_valid)
+
+        # user_idとソースコードを返す
+        yield Utility.format_sse("done", save_first_message(user_id, chat_gpt))
+
+    return make_response_stream(generate(), lease)
 
-    # user_idとソースコードを返す
-    return jsonify({
-        "userId": user_id,
-        "content": chat_gpt.get_source_code_javascript_with_comment(),
-        "sourceCode": chat_gpt.get_source_code_javascript()
-    })
+
+# 処理時間や使用したトークン数などの計測値を返す（Prometheusのテキスト形式）
+@app.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    return Response(Metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 # ChatGPTに2回目以降のメッセージを送信する
 @app.route("/sendMessage", methods=["POST"])
 def send_message() -> Response:
-    from models.table_message import TableMessage
-
     # リクエストの受取り
     user_id = request.form["userId"]
     content = request.form["content"]
-    # 設定ファイルからAPIキーと送信メッセージの設定を取得する
-    chat_gpt = ChatGpt(SECRET["apiKey"]["openAi"])
-    setting = APP_CONFIG["chatGpt"]["sendingMessage"]
-    # テーブルからレコードを取得する
-    records = TableMessage.select_records(user_id)
-    count_record_user = 0
 
-    # レコードが存在しない場合はエラーを返す
-    if len(records) == 0:
-        raise NotFound("レコードが存在しません。")
+    # ソースコードを返す
+    return jsonify(run_message(user_id, content, request.path))
 
-    # ユーザーのメッセージの送信回数を数える
-    for record in records:
-        if record["role"] == "user":
-            count_record_user += 1
 
-    # ユーザーのメッセージの送信回数が上限に達している場合はエラーを返す
-    if count_record_user >= setting["maxCount"]:
-        raise BadRequest("メッセージの送信回数が上限に達しました。")
+# ChatGPTに2回目以降のメッセージを送信し、返答をServer-Sent Eventsで少しずつ返す
+@app.route("/sendMessageStream", methods=["POST"])
+def send_message_stream() -> Response:
+    # リクエストの受取り
+    user_id = request.form["userId"]
+    content = request.form["content"]
+    # 過去のやりとりを1度だけ読み込む
+    session = make_session(user_id)
+    # ChatGPTに送信するメッセージを設定する
+    # （レコードが存在しない場合などのエラーは、ストリームを開始する前に返す）
+    chat_gpt = make_chat_gpt(session, content)
+    # ストリームを開始する前に枠を確保する（確保できない場合はエラーを返す）
+    lease = acquire_admission(request.path)
+
+    def generate() -> Iterator[str]:
+        nonlocal chat_gpt
+
+        # 新しいやりとりはまとめてテーブルに保存する
+        with session:
+            # ChatGPTにメッセージを送信し、返答を少しずつ返す（修正を依頼できる場合は、違反が確定した時点で打ち切る）
+            yield from stream_message(
+                chat_gpt,
+                APP_CONFIG["chatGpt"]["sendingMessage"]["maxCount"],
+                make_stream_validator(RETRY_COUNT > 0)
+            )
+            # ChatGPTとのやりとりの最後の2件を履歴に追加する
+            session.add_turn(chat_gpt)
+
+            for i in range(RETRY_COUNT):
+                # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                # 追加のメッセージを作成する
+                message_user = make_additional_message(chat_gpt)
+
+                if message_user:
+                    # 再送信することを通知する
+                    yield Utility.format_sse("retry", {"count": i + 1})
+                    # 履歴からメッセージを設定する
+                    chat_gpt = session.make_chat_gpt(message_user)
+                    # ChatGPTにメッセージを送信し、返答を少しずつ返す
+                    yield from stream_message(
+                        chat_gpt, validator=make_stream_validator(i + 1 < RETRY_COUNT)
+                    )
+                    # ChatGPTとのやりとりの最後の2件を履歴に追加する
+                    session.add_turn(chat_gpt)
+                else:
+                    break
+
+        body = make_response_body(user_id, chat_gpt, session.prompt_tokens)
+        save_latest(body)
+
+        # ソースコードを返す
+        yield Utility.format_sse("done", body)
+
+    return make_response_stream(generate(), lease)
+
+
+# ChatGPTに最初のメッセージを送信するジョブを登録し、ジョブのIDを返す
+@app.route("/submitFirstMessage", methods=["POST"])
+def submit_first_message() -> Response:
+    # リクエストの受取り
+    content = request.form["content"]
 
-    # レコードをChatGPTクラスに渡し、メッセージを圧縮する
-    chat_gpt.set_messages_past(records)
-    chat_gpt.compress_message()
-    # ChatGPTに送信するメッセージを追加し、送信する
-    chat_gpt.add_message_user(
-        f"{content}\nただし、前述したコーディングルールは遵守してください。",
-        setting["maxContentLength"]
-    )
-    chat_gpt.send_message(1.0, setting["maxCount"])
-    # ChatGPTとのやりとりの最後の2件をテーブルに保存する
-    TableMessage.insert_records(user_id, chat_gpt.messages[-2:])
-
-    for i in range(RETRY_COUNT):
-        # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
-        # 追加のメッセージを作成する
-        message_user = make_additional_message(chat_gpt)
-
-        if message_user:
-            # 再度テーブルからレコードを取得する
-            records = TableMessage.select_records(user_id)
-            chat_gpt = ChatGpt(SECRET["apiKey"]["openAi"])
-            # レコードをChatGPTクラスに渡す→メッセージを圧縮する→メッセージを追加する
-            chat_gpt.set_messages_past(records)
-            chat_gpt.compress_message()
-            chat_gpt.add_message_user(message_user)
-            # ChatGPTにメッセージを送信する
-            chat_gpt.send_message(1.0)
-            # ChatGPTとのやりとりの最後の2件をテーブルに保存する
-            TableMessage.insert_records(user_id, chat_gpt.messages[-2:])
-        else:
-            break
+    return jsonify({
+        "jobId": submit_job(
+            "firstMessage", {"content": content}, partial(run_first_message, endpoint=request.path)
+        )
+    })
+
+
+# ChatGPTに2回目以降のメッセージを送信するジョブを登録し、ジョブのIDを返す
+@app.route("/submitMessage", methods=["POST"])
+def submit_message() -> Response:
+    # リクエストの受取り
+    user_id = request.form["userId"]
+    content = request.form["content"]
 
-    # ソースコードを返す
     return jsonify({
-        "userId": user_id,
-        "content": chat_gpt.get_source_code_javascript_with_comment(),
-        "sourceCode": chat_gpt.get_source_code_javascript()
+        "jobId": submit_job(
+            "message",
+            {"user_id": user_id, "content": content},
+            partial(run_message, endpoint=request.path)
+        )
     })
 
 
+# ジョブの状態を取得する
+@app.route("/getJobStatus", methods=["GET"])
+def get_job_status() -> Response:
+    # リクエストの受取り
+    job_id = request.args.get("jobId")
+    # テーブルからジョブの状態を取得する
+    job = TableJob.select_job(job_id)
+
+    # ジョブが存在しない場合はエラーを返す
+    if job is None:
+        raise NotFound("ジョブが存在しません。")
+
+    # 実行中のまま一定時間更新されていないジョブは、失敗したとみなす（インスタンスの停止など）
+    if job["status"] in ("queued", "running") and (
+        datetime.now(timezone.utc) - job["updatedAt"]
+    ).total_seconds() > APP_CONFIG["job"]["timeout"]:
+        job["status"] = "failed"
+        job["error"] = "ジョブが時間内に完了しませんでした。"
+
+    return jsonify(job)
+
+
+# 最初のメッセージに対するやりとりのキャッシュの使用状況を取得する
+@app.route("/getCacheStats", methods=["GET"])
+def get_cache_stats() -> Response:
+    return jsonify(GENERATION_CACHE.get_stats())
+
+
+# ChatGPTにメッセージを送信するリクエストの実行中及び待っている件数を取得する
+@app.route("/getAdmissionStats", methods=["GET"])
+def get_admission_stats() -> Response:
+    if ADMISSION is None:
+        return jsonify({"enabled": False})
+
+    return jsonify({"enabled": True, **ADMISSION.get_stats()})
+
+
 # ChatGPTから受け取ったソースコードを再度取得する
+# （内容が変わっていない場合は、If-None-Matchに対して304を返す）
 @app.route("/getLastSourceCode", methods=["GET"])
 def get_last_source_code() -> Response:
-    from models.table_message import TableMessage
-
     # リクエストの受取り
     user_id = request.args.get("userId")
-    # テーブルからレコードを取得する
-    records = TableMessage.select_records(user_id)
-    chat_gpt = ChatGpt("")
-
-    # レコードが存在しない場合はエラーを返す
-    if len(records) == 0:
-        raise NotFound("レコードが存在しません。")
-
-    # レコードをChatGPTクラスに渡す
-    chat_gpt.set_messages_past(records)
-
-    # ソースコードを返す
-    return jsonify({
-        "userId": user_id,
-        "content": chat_gpt.get_source_code_javascript_with_comment(),
-        "sourceCode": chat_gpt.get_source_code_javascript()
+    # 最新のソースコードを取得する
+    latest = TableLatest.get_latest(user_id)
+
+    # 最新のソースコードを保存する前のやりとりは、テーブルのレコードから作成して保存する
+    if latest is None:
+        records = TableMessage.select_records(user_id)
+        chat_gpt = ChatGpt("")
+
+        # レコードが存在しない場合はエラーを返す
+        if len(records) == 0:
+            raise NotFound("レコードが存在しません。")
+
+        # レコードをChatGPTクラスに渡す
+        chat_gpt.set_messages_past(records)
+        latest = make_response_body(user_id, chat_gpt)
+        latest["etag"] = save_latest(latest)
+
+    # ソースコードを返す（ブラウザが毎回ETagで確認するようにする）
+    response = jsonify({
+        "userId": latest["userId"],
+        "content": latest["content"],
+        "sourceCode": latest["sourceCode"]
     })
+    response.set_etag(latest["etag"])
+    response.headers["Cache-Control"] = "no-cache"
+
+    return response.make_conditional(request)
 
 
 # DynamoDBにテーブルを作成する
 @app.route("/createTable", methods=["GET"])
 def create_table() -> Response:
-    from models.table_message import TableMessage
+    # ジョブ及び最新のソースコードのテーブルが存在しない場合は作成する
+    if not TableJob.exists():
+        TableJob.create_table(wait=True)
+    if not TableLatest.exists():
+        TableLatest.create_table(wait=True)
+
+    # キャッシュの保存先がDynamoDBで、テーブルが存在しない場合は作成する
+    if APP_CONFIG["generationCache"]["backend"] == "dynamodb" and not TableCache.exists():
+        TableCache.create_table(wait=True)
 
     # テーブルが存在しない場合は作成する
+    # （既存のテーブルのカウンターは/updateTableで既存のレコードに合わせて作成するため、ここでは作成しない）
     if TableMessage.exists():
         return jsonify({"message": "テーブルは既に存在しています。"})
     else:
+        if not TableCounter.exists():
+            TableCounter.create_table(wait=True)
+
         TableMessage.create_table()
 
         return jsonify({"message": "テーブルを作成しました。"})
 
 
+# 既存のテーブルを移行する（user_idのインデックスの追加、idのカウンターの初期化）
+@app.route("/updateTable", methods=["GET"])
+def update_table() -> Response:
+    # テーブルが存在しない場合はエラーを返す
+    if not TableMessage.exists():
+        raise NotFound("テーブルが存在しません。")
+
+    # カウンターのテーブルが存在しない場合は作成する
+    if not TableCounter.exists():
+        TableCounter.create_table(wait=True)
+
+    # idのカウンターを既存のレコードのidの最大値まで進め、user_idの件数を数え直す
+    # （カウンターのテーブルが既に存在する場合も行う）
+    TableMessage.update_counter_id()
+    TableMessage.recount_user_id()
+
+    # 最新のソースコードのテーブルが存在しない場合は作成する（既存のuser_idは、最初の取得時に作成される）
+    if not TableLatest.exists():
+        TableLatest.create_table(wait=True)
+
+    if TableMessage.update_table():
+        return jsonify({
+            "message": "インデックスの作成を開始しました。既存のレコードが登録されるまで時間がかかります。"
+        })
+    else:
+        return jsonify({"message": "インデックスは既に存在しています。"})
+
+
 # テーブルのレコードを1件追加する
 @app.route("/insertRecord", methods=["POST"])
 def insert_record() -> Response:
-    from models.table_message import TableMessage
-
     # リクエストの受取り
     user_id = request.form["userId"]
     role = request.form["role"]
@@ -205,16 +427,19 @@ def insert_record() -> Response:
     # レコードの追加
     TableMessage.insert_record(user_id, role, content)
 
+    # 返答を追加した場合は、最新のソースコードを作成し直す
+    if role == "assistant":
+        TableLatest.delete_latest(user_id)
+
     return jsonify({"message": "レコードを1件追加しました。"})
 
 
 # user_idを指定して、テーブルのレコードを削除する
 @app.route("/deleteRecord/<user_id>", methods=["DELETE"])
 def delete_record(user_id: str) -> Response:
-    from models.table_message import TableMessage
-
-    # レコードの削除
+    # レコードと最新のソースコードの削除
     count_records = TableMessage.delete_record(user_id)
+    TableLatest.delete_latest(user_id)
 
     return jsonify({"message": f"レコードを{count_records}件削除しました。"})
 
@@ -222,8 +447,6 @@ def delete_record(user_id: str) -> Response:
 # テーブルのレコードを全件削除する
 @app.route("/deleteAllRecords", methods=["POST"])
 def delete_all_records() -> Response:
-    from models.table_message import TableMessage
-
     # リクエストの受取り
     password = request.form["password"]
     # 削除したレコード件数
@@ -233,29 +456,116 @@ def delete_all_records() -> Response:
     if password != SECRET["password"]["database"]:
         raise BadRequest("パスワードが不正です。")
 
-    # レコードの削除
+    # レコードと最新のソースコードの削除
     count_records = TableMessage.delete_all_records()
+    TableLatest.delete_all_latest()
 
     return jsonify({"message": f"レコードを{count_records}件削除しました。"})
 
 
 # user_idを指定して、テーブルのレコードを取得する
+# limitを指定した場合は、limit件ごとに取得する（続きはレスポンスのnextCursorをcursorに指定して取得する）
+# fieldsに列名をカンマ区切りで指定した場合は、その列のみ取得する
+# format=ndjsonを指定した場合は、取得したレコードから1行ずつ返す（limitを指定した場合は、最後の行がnextCursorとなる）
 @app.route("/selectRecords", methods=["GET"])
 def select_records() -> Response:
-    from models.table_message import TableMessage
-
     # リクエストの受取り
     user_id = request.args.get("userId")
-    # レコードの取得
-    records = TableMessage.select_records(user_id)
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    fields = request.args.get("fields")
+    is_ndjson = request.args.get("format") == "ndjson"
+
+    # 条件の指定がない場合は、全てのレコードをまとめて返す
+    if limit is None and cursor is None and fields is None and not is_ndjson:
+        return jsonify({"records": TableMessage.select_records(user_id)})
+
+    if user_id is None:
+        raise BadRequest("userIdが指定されていません。")
+
+    max_limit = APP_CONFIG["selectRecords"]["maxLimit"]
+
+    if limit is not None and not 1 <= limit <= max_limit:
+        raise BadRequest(f"limitは1以上{max_limit}以下の値を指定してください。")
+
+    fields = make_fields(fields)
+    last_evaluated_key = make_last_evaluated_key(user_id, cursor)
+
+    if is_ndjson:
+        return Response(
+            stream_with_context(stream_records(user_id, limit, last_evaluated_key, fields)),
+            mimetype="application/x-ndjson"
+        )
+
+    records, last_evaluated_key = TableMessage.select_records_page(
+        user_id, limit or max_limit, last_evaluated_key, fields
+    )
+
+    return jsonify({
+        "records": records,
+        "nextCursor": Utility.encode_cursor(last_evaluated_key) if last_evaluated_key else None
+    })
+
+
+# テーブルのレコードを全件ファイルに書き出すジョブを登録し、ジョブのIDを返す
+# nameは書き出し先のディレクトリ名（archive.directoryの下に作成する。同じnameで再度登録すると、中断した位置から再開する）
+# formatには"jsonl"または"parquet"、segmentsには並列にスキャンするセグメント数を指定できる
+# （書き出した件数は、/getJobStatusのprogressで確認できる）
+@app.route("/exportRecords", methods=["POST"])
+def export_records() -> Response:
+    # リクエストの受取り
+    password = request.form["password"]
+    name = request.form["name"]
+    fmt = request.form.get("format", APP_CONFIG["archive"]["format"])
+    segments = request.form.get("segments", type=int)
+
+    # パスワードが不正である場合は処理を中断する
+    if password != SECRET["password"]["database"]:
+        raise BadRequest("パスワードが不正です。")
+
+    if fmt not in ("jsonl", "parquet"):
+        raise BadRequest("formatにはjsonlまたはparquetを指定してください。")
+
+    if segments is not None and not 1 <= segments <= 64:
+        raise BadRequest("segmentsは1以上64以下の値を指定してください。")
+
+    # 書き出し先のディレクトリ名を確認する
+    make_archive_directory(name)
+
+    return jsonify({
+        "jobId": submit_job(
+            "export", {"name": name, "fmt": fmt, "total_segments": segments}, run_export
+        )
+    })
+
+
+# /exportRecordsで書き出したファイルを、テーブルに読み込むジョブを登録し、ジョブのIDを返す
+# （負荷試験などで開発環境のテーブルにレコードを投入するためのもので、同じidのレコードは上書きするため本番環境では使用できない）
+@app.route("/importRecords", methods=["POST"])
+def import_records() -> Response:
+    # リクエストの受取り
+    password = request.form["password"]
+    name = request.form["name"]
+
+    # パスワードが不正である場合は処理を中断する
+    if password != SECRET["password"]["database"]:
+        raise BadRequest("パスワードが不正です。")
+
+    if not AppConfig.is_dev():
+        raise BadRequest("本番環境では使用できません。")
+
+    if not os.path.isdir(make_archive_directory(name)):
+        raise NotFound("書き出したファイルが存在しません。")
 
-    return jsonify({"records": records})
+    return jsonify({"jobId": submit_job("import", {"name": name}, run_import)})
 
 
-# テーブルに登録されているuser_idを取得する（重複なし）
+# テーブルに登録されているuser_idの件数を取得する（重複なし）
 @app.route("/countUserId", methods=["GET"])
 def count_user_id() -> Response:
-    from models.table_message import TableMessage
+    # mode=exactが指定された場合は、テーブルを全件走査して数え直す
+    if request.args.get("mode") == "exact":
+        return jsonify({"count": TableMessage.recount_user_id()})
 
     return jsonify({"count": TableMessage.count_user_id()})
 
@@ -264,12 +574,19 @@ def count_user_id() -> Response:
 @app.errorhandler(BadRequest)
 @app.errorhandler(NotFound)
 @app.errorhandler(InternalServerError)
+@app.errorhandler(ServiceUnavailable)
 def error_handler(error) -> tuple[Response, int]:
     print(error)
 
-    return jsonify({
+    response = jsonify({
         "error": {"name": error.name, "description": error.description}
-    }), error.code
+    })
+
+    # 混雑している場合は、再送信するまでの時間を返す
+    if getattr(error, "retry_after", None) is not None:
+        response.headers["Retry-After"] = str(error.retry_after)
+
+    return response, error.code
 
 
 # その他のエラーが発生したとき処理
@@ -280,29 +597,460 @@ def error_handler_other(error) -> tuple[Response, int]:
     return error_handler(InternalServerError("サーバー内部でエラーが発生しました。"))
 
 
-# 使用できないモジュールやクラス、無効なURLが含まれている場合、メッセージを作成する
-def make_additional_message(chat_gpt: ChatGpt) -> str:
-    IMPORTABLE_MODULES = APP_CONFIG["chatGpt"]["receivingMessage"]["importableModules"]
-    WORDS = APP_CONFIG["chatGpt"]["receivingMessage"]["words"]
-    # importされているモジュールを抽出する
-    import_modules = chat_gpt.get_import_modules()
-    # 共通変数（定数）WORDSに含まれるNGワードを抽出する
-    ng_words = chat_gpt.check_ng_words(list(map(lambda x: x["NG"], WORDS)))
-    # 無効なURLを抽出する
-    invalid_urls = list(filter(
-        lambda x: not Utility.validate_url(x),
-        chat_gpt.get_urls()
-    ))
+# ChatGPTに最初のメッセージを送信し、ルールを満たすまで修正を依頼する
+# （endpointは枠を確保する際の優先度を決めるエンドポイント。
+# on_progressには、返答を確認するたびに何件目の返答か（attempt）と、ルールに違反した内容（findings）が渡される）
+def run_first_message(
+    content: str,
+    endpoint: str,
+    on_progress: Callable[..., None] | None = None
+) -> dict[str, str]:
+    # 日付+16桁ランダムな文字列をuser_idとする
+    user_id = f"{Utility.get_date_str()}{Utility.generate_random_string(16)}"
+    # ChatGPTに送信するメッセージを設定する
+    chat_gpt = make_chat_gpt_first(content)
+    # キャッシュのキーを作成し、キャッシュからやりとりを取得する
+    cache_key = make_cache_key(content)
+    messages_cache = GENERATION_CACHE.get(cache_key)
+
+    # キャッシュが存在する場合は、ChatGPTにメッセージを送信しない
+    if messages_cache:
+        set_reply_cached(chat_gpt, messages_cache)
+    else:
+        with admit(endpoint), Metrics.timer("generation_seconds", mode=CANDIDATES["mode"]):
+            # ChatGPTにメッセージを送信する（全ての候補がルールを満たさない場合のみ、修正を依頼する）
+            send_message_candidates(chat_gpt)
+            # 最後の返答がルールを満たすかどうか（確認していない場合はNone）
+            is_valid = None
+
+            for i in range(RETRY_COUNT):
+                # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                # 追加のメッセージを作成する
+                message_user = make_additional_message(chat_gpt, None, i + 1, on_progress)
+
+                if message_user:
+                    # ChatGPTに送信するメッセージを設定する
+                    chat_gpt.add_message_user(message_user)
+                    # ChatGPTにメッセージを送信する
+                    chat_gpt.send_message(
+                        1.0, validator=make_stream_validator(i + 1 < RETRY_COUNT, True)
+                    )
+                else:
+                    is_valid = True
+                    break
+
+        # ルールを満たす返答が得られた場合は、キャッシュに保存する
+        set_cache(cache_key, chat_gpt, is_valid)
+
+    return save_first_message(user_id, chat_gpt)
+
+
+# ChatGPTに2回目以降のメッセージを送信し、ルールを満たすまで修正を依頼する
+# （endpointは枠を確保する際の優先度を決めるエンドポイント。
+# on_progressには、返答を確認するたびに何件目の返答か（attempt）と、ルールに違反した内容（findings）が渡される）
+def run_message(
+    user_id: str,
+    content: str,
+    endpoint: str,
+    on_progress: Callable[..., None] | None = None
+) -> dict[str, str]:
+    # 過去のやりとりを1度だけ読み込み、新しいやりとりはまとめてテーブルに保存する
+    with make_session(user_id) as session:
+        # ChatGPTに送信するメッセージを設定する
+        chat_gpt = make_chat_gpt(session, content)
+
+        with admit(endpoint), Metrics.timer("generation_seconds", mode=CANDIDATES["mode"]):
+            # ChatGPTにメッセージを送信する（全ての候補がルールを満たさない場合のみ、修正を依頼する）
+            send_message_candidates(chat_gpt, APP_CONFIG["chatGpt"]["sendingMessage"]["maxCount"])
+            # ChatGPTとのやりとりの最後の2件を履歴に追加する
+            session.add_turn(chat_gpt)
+
+            for i in range(RETRY_COUNT):
+                # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                # 追加のメッセージを作成する
+                message_user = make_additional_message(chat_gpt, None, i + 1, on_progress)
+
+                if message_user:
+                    # 履歴からメッセージを設定する
+                    chat_gpt = session.make_chat_gpt(message_user)
+                    # ChatGPTにメッセージを送信する
+                    chat_gpt.send_message(
+                        1.0, validator=make_stream_validator(i + 1 < RETRY_COUNT, True)
+                    )
+                    # ChatGPTとのやりとりの最後の2件を履歴に追加する
+                    session.add_turn(chat_gpt)
+                else:
+                    break
+
+    body = make_response_body(user_id, chat_gpt, session.prompt_tokens)
+    save_latest(body)
+
+    return body
+
+
+# ジョブを登録し、ジョブのIDを返す（実行待ちのジョブが上限に達している場合はエラーを返す）
+# （ChatGPTとやりとりするジョブは、登録したエンドポイントの優先度で枠を確保する）
+def submit_job(kind: str, params: dict, func: Callable[..., dict]) -> str:
+    job_id = JOB_RUNNER.submit(kind, params, func)
+
+    if job_id is None:
+        raise ServiceUnavailable("実行待ちのジョブが上限に達しました。時間をおいて再度送信してください。")
+
+    return job_id
+
+
+# テーブルのレコードを全件、archive.directoryの下のnameのディレクトリに書き出す
+# （on_progressには、書き出した件数がprogressとして渡される）
+def run_export(
+    name: str,
+    fmt: str,
+    total_segments: int | None = None,
+    on_progress: Callable[..., None] | None = None
+) -> dict[str, any]:
+    archive = MessageArchive.from_config(
+        APP_CONFIG["archive"], make_archive_directory(name), fmt, total_segments
+    )
+
+    return archive.export(None if on_progress is None else lambda count: on_progress(progress=count))
+
+
+# archive.directoryの下のnameのディレクトリに書き出したファイルを、テーブルに読み込む
+# （on_progressには、読み込んだ件数がprogressとして渡される）
+def run_import(
+    name: str,
+    on_progress: Callable[..., None] | None = None
+) -> dict[str, any]:
+    archive = MessageArchive.from_config(APP_CONFIG["archive"], make_archive_directory(name))
+
+    return archive.import_files(None if on_progress is None else lambda count: on_progress(progress=count))
+
+
+# 書き出し先のディレクトリ名を、archive.directoryの下のパスに変換する（英数字、"-"、"_"以外を含む場合はエラーとする）
+def make_archive_directory(name: str) -> str:
+    if not re.fullmatch(r"[0-9A-Za-z_-]{1,64}", name):
+        raise BadRequest("nameには英数字、-、_のみを指定してください。")
+
+    return os.path.join(APP_CONFIG["archive"]["directory"], name)
+
+
+# 最初のメッセージを設定したChatGPTクラスのインスタンスを作成する
+def make_chat_gpt_first(content: str) -> ChatGpt:
+    # 設定ファイルからAPIキーを取得する
+    chat_gpt = ChatGpt(SECRET["apiKey"]["openAi"])
     message_user = ""
 
-    # import_modulesの要素から使用可能なモジュールの名称を削除する
-    for module in import_modules:
-        if module in IMPORTABLE_MODULES:
-            import_modules.remove(module)
+    # ChatGPTに送信する初期メッセージを設定する
+    chat_gpt.set_message_init(PROMPT_SYSTEM)
+    # ユーザーメッセージを作成する
+    message_user = PROMPT_USER_FIRST.format(content=content)
+    # ChatGPTに送信するメッセージを設定する
+    chat_gpt.add_message_user(
+        message_user,
+        APP_CONFIG["chatGpt"]["sendingMessage"]["maxContentLength"]
+    )
+
+    return chat_gpt
+
+
+# カンマ区切りの列名を、取得する列のタプルに変換する（指定がない場合は全ての列とする）
+def make_fields(fields: str | None) -> tuple[str, ...]:
+    if fields is None:
+        return FIELDS_RECORD
+
+    fields_request = tuple(field.strip() for field in fields.split(",") if field.strip())
+    fields_invalid = [field for field in fields_request if field not in FIELDS_RECORD]
+
+    if not fields_request or fields_invalid:
+        raise BadRequest(f"fieldsには{','.join(FIELDS_RECORD)}のいずれかを指定してください。")
+
+    return fields_request
+
+
+# cursorを検索を再開するためのキーに変換する（別のuser_idのcursorや、キーの形式が異なるcursorはエラーとする）
+def make_last_evaluated_key(user_id: str, cursor: str | None) -> dict | None:
+    if cursor is None:
+        return None
+
+    try:
+        last_evaluated_key = Utility.decode_cursor(cursor)
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+    id = last_evaluated_key.get("id")
+
+    if (
+        last_evaluated_key.keys() != {"id", "user_id"}
+        or last_evaluated_key["user_id"] != {"S": user_id}
+        or not isinstance(id, dict) or id.keys() != {"N"}
+        or not isinstance(id["N"], str) or not id["N"].isdecimal()
+    ):
+        raise BadRequest("cursorが不正です。")
+
+    return last_evaluated_key
+
+
+# レコードを少しずつ検索し、1件ずつndjson形式で返す（limitを指定した場合は、最後にnextCursorを返す）
+def stream_records(
+    user_id: str,
+    limit: int | None,
+    last_evaluated_key: dict | None,
+    fields: tuple[str, ...]
+) -> Iterator[str]:
+    page_size = APP_CONFIG["selectRecords"]["pageSize"]
+    count = 0
+
+    while limit is None or count < limit:
+        size = page_size if limit is None else min(page_size, limit - count)
+        records, last_evaluated_key = TableMessage.select_records_page(
+            user_id, size, last_evaluated_key, fields
+        )
+
+        for record in records:
+            yield app.json.dumps(record) + "\n"
+
+        count += len(records)
+
+        if not last_evaluated_key:
+            break
+
+    if limit is not None:
+        yield app.json.dumps({
+            "nextCursor": Utility.encode_cursor(last_evaluated_key) if last_evaluated_key else None
+        }) + "\n"
+
+
+# 過去のやりとりを読み込み、ConversationSessionクラスのインスタンスを作成する
+def make_session(user_id: str) -> ConversationSession:
+    return ConversationSession(
+        user_id,
+        SECRET["apiKey"]["openAi"],
+        APP_CONFIG["chatGpt"]["sendingMessage"]["checkpoint"],
+        APP_CONFIG["chatGpt"]["sendingMessage"]["compression"]
+    )
+
+
+# 過去のやりとりと2回目以降のメッセージを設定したChatGPTクラスのインスタンスを作成する
+def make_chat_gpt(session: ConversationSession, content: str) -> ChatGpt:
+    # 設定ファイルから送信メッセージの設定を取得する
+    setting = APP_CONFIG["chatGpt"]["sendingMessage"]
+
+    # レコードが存在しない場合はエラーを返す
+    if len(session.messages) == 0:
+        raise NotFound("レコードが存在しません。")
+
+    # ユーザーのメッセージの送信回数が上限に達している場合はエラーを返す
+    if session.count_message_user() >= setting["maxCount"]:
+        raise BadRequest("メッセージの送信回数が上限に達しました。")
+
+    # 履歴を圧縮し、ChatGPTに送信するメッセージを追加する
+    return session.make_chat_gpt(
+        f"{content}\nただし、前述したコーディングルールは遵守してください。",
+        setting["maxContentLength"]
+    )
+
+
+# 最初のメッセージに対するやりとりのキャッシュのキーを作成する
+def make_cache_key(content: str) -> str:
+    return GenerationCache.make_key(
+        content,
+        PROMPT_SYSTEM,
+        PROMPT_USER_FIRST,
+        ChatGpt.MODEL,
+        APP_CONFIG["chatGpt"]["receivingMessage"]
+    )
+
+
+# user_idとソースコードを格納したレスポンスの本文を作成する
+# （prompt_tokensを渡した場合は、ChatGPTに送信したメッセージのトークン数も格納する）
+def make_response_body(
+    user_id: str, chat_gpt: ChatGpt, prompt_tokens: int | None = None
+) -> dict[str, any]:
+    # ChatGPTの返答を解析した結果を取得する（検証時の解析結果を使い回す）
+    analysis = chat_gpt.get_analysis()
+    body = {
+        "userId": user_id,
+        "content": analysis.source_code_with_comment,
+        "sourceCode": analysis.source_code
+    }
+
+    if prompt_tokens is not None:
+        body["promptTokens"] = prompt_tokens
+
+    return body
+
+
+# キャッシュしたやりとりの最後の返答を、最初のメッセージに対する返答として設定する
+# （キャッシュのキーは正規化した入力から作成するため、ユーザーのメッセージは今回の入力のままとする）
+def set_reply_cached(chat_gpt: ChatGpt, messages_cache: list[dict[str, str]]) -> None:
+    chat_gpt.set_messages_past(chat_gpt.messages + messages_cache[-1:])
+
+
+# 最初のメッセージに対するやりとりを、最後の返答がルールを満たす場合のみキャッシュに保存する
+# （is_validがNoneの場合は、最後の返答を確認してから保存する）
+def set_cache(cache_key: str, chat_gpt: ChatGpt, is_valid: bool | None) -> None:
+    if not GENERATION_CACHE.enabled:
+        return
+
+    if is_valid is None:
+        is_valid = is_valid_candidate(chat_gpt)
+
+    if is_valid:
+        GENERATION_CACHE.set(cache_key, chat_gpt.messages)
+
+
+# 最初のメッセージに対するやりとりをテーブルに保存してuser_idを登録し、レスポンスの本文を返す
+def save_first_message(user_id: str, chat_gpt: ChatGpt) -> dict[str, any]:
+    TableMessage.insert_records(user_id, chat_gpt.get_messages_marked())
+    TableMessage.register_user_id()
+    body = make_response_body(user_id, chat_gpt, chat_gpt.prompt_tokens)
+    save_latest(body)
+
+    return body
+
+
+# レスポンスの本文のソースコードを、user_idの最新のソースコードとして保存し、ETagを返す
+def save_latest(body: dict[str, any]) -> str:
+    return TableLatest.set_latest(body["userId"], body["content"], body["sourceCode"])
+
+
+# 返答を受信しながらルールを確認するインスタンスを作成する（受信を打ち切らない場合はNoneを返す）
+# （abortは修正を依頼できるかどうか。blockingがtrueの場合は、ストリーミングでないエンドポイントで使用する）
+def make_stream_validator(abort: bool, blocking: bool = False) -> StreamValidator | None:
+    if not abort or not STREAM_ABORT["violations"] or (blocking and not STREAM_ABORT["blocking"]):
+        return None
+
+    return StreamValidator(
+        NG_WORD_MATCHER,
+        APP_CONFIG["chatGpt"]["receivingMessage"]["importableModules"],
+        # 無効なURLで打ち切る場合のみ、受信したURLから順に確認する
+        URL_VALIDATOR if "invalidUrls" in STREAM_ABORT["violations"] else None,
+        STREAM_ABORT["violations"]
+    )
+
+
+# ChatGPTにメッセージを送信し、返答をServer-Sent Events形式で少しずつ返す
+# （validatorを渡した場合は、ルールに違反することが確定した時点で受信を打ち切る）
+def stream_message(
+    chat_gpt: ChatGpt, max_count: int = 0, validator: StreamValidator | None = None
+) -> Iterator[str]:
+    for delta in chat_gpt.send_message_stream(1.0, max_count, validator):
+        yield Utility.format_sse("token", {"content": delta})
+
+
+# ChatGPTにメッセージを送信する枠を確保する（空くまで待ち、確保できない場合はエラーを返す）
+# （制限が無効な場合はNoneを返す）
+def acquire_admission(endpoint: str) -> any:
+    if ADMISSION is None:
+        return None
+
+    lease = ADMISSION.acquire(endpoint, ADMISSION_WEIGHT)
+
+    if lease is None:
+        raise make_admission_error()
+
+    return lease
+
+
+# 確保した枠を解放する
+def release_admission(lease: any) -> None:
+    if lease is not None:
+        ADMISSION.release(lease)
+
+
+# 枠を確保できなかった場合のエラーを作成する
+def make_admission_error() -> ServiceUnavailable:
+    return ServiceUnavailable(
+        "混雑しているため、処理を開始できませんでした。時間をおいて再度送信してください。",
+        retry_after=ADMISSION.retry_after
+    )
+
+
+# ChatGPTにメッセージを送信する間、枠を確保する
+@contextmanager
+def admit(endpoint: str) -> Iterator[None]:
+    lease = acquire_admission(endpoint)
+
+    try:
+        yield
+    finally:
+        release_admission(lease)
+
+
+# Server-Sent Eventsのレスポンスを作成する
+# （leaseを渡した場合は、レスポンスを閉じたときに枠を解放する。ストリームを開始せずに切断された場合も含む）
+def make_response_stream(events: Iterator[str], lease: any = None) -> Response:
+    # ストリームの途中でエラーが発生した場合は、エラーのイベントを返して終了する
+    def generate() -> Iterator[str]:
+        try:
+            yield from events
+        except Exception as error:
+            print(error)
+
+            yield Utility.format_sse("error", {
+                "error": {
+                    "name": InternalServerError.name,
+                    "description": "サーバー内部でエラーが発生しました。"
+                }
+            })
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # プロキシによるバッファリングを無効にし、受信した順に返す
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(partial(release_admission, lease))
+
+    return response
+
+
+# ChatGPTの返答から、使用できないモジュールやクラス、無効なURLを抽出する
+# （URLの確認結果results_urlを渡した場合は、URLの確認を省略する）
+@Metrics.timed("validation_seconds", "validation")
+def find_violations(
+    chat_gpt: ChatGpt, results_url: dict[str, bool] | None = None
+) -> dict[str, list[str]]:
+    IMPORTABLE_MODULES = APP_CONFIG["chatGpt"]["receivingMessage"]["importableModules"]
+    # ChatGPTの返答を解析した結果を取得する
+    analysis = chat_gpt.get_analysis()
+
+    # 無効なURLを抽出する（全てのURLを並列に確認する）
+    if results_url is None:
+        results_url = URL_VALIDATOR.validate_urls(analysis.urls)
+
+    violations = {
+        # importされているモジュールのうち、使用できないもの
+        "importModules": [
+            module for module in analysis.import_modules
+            if module not in IMPORTABLE_MODULES
+        ],
+        # 共通変数（定数）NG_WORD_MATCHERに登録されたNGワード
+        "ngWords": analysis.check_ng_words(NG_WORD_MATCHER),
+        # 無効なURL
+        "invalidUrls": [url for url, is_valid in results_url.items() if not is_valid]
+    }
+
+    # ルールに違反した件数を記録する
+    Metrics.increment("disallowed_imports_total", len(violations["importModules"]))
+    Metrics.increment("invalid_urls_total", len(violations["invalidUrls"]))
+
+    for ng_word in violations["ngWords"]:
+        Metrics.increment("ng_word_hits_total", word=ng_word)
+
+    return violations
+
+
+# 使用できないモジュールやクラス、無効なURLが含まれている場合、修正を依頼するメッセージを作成する
+def make_message_violations(violations: dict[str, list[str]]) -> str:
+    import_modules = violations["importModules"]
+    ng_words = violations["ngWords"]
+    invalid_urls = violations["invalidUrls"]
+    message_user = ""
 
     # 使用できないモジュールやクラスが含まれている場合、ChatGPTに修正を依頼する
     if len(import_modules + ng_words + invalid_urls) > 0:
         message_user = "以下のルールを加えて、コードを書き直してください。"
+        Metrics.increment("retries_total")
 
         # 使用できないモジュールが含まれている場合
         if len(import_modules) > 0:
@@ -311,11 +1059,9 @@ def make_additional_message(chat_gpt: ChatGpt) -> str:
 
         # 使用できないクラスが含まれている場合
         if len(ng_words) > 0:
-            # 使用できる類似クラスを取得する
-            ok_words = list(filter(lambda x: x["NG"] in ng_words, WORDS))
-
-            # メッセージ追加する
-            for ng_word, ok_word in zip(ng_words, ok_words):
+            # 使用できる類似クラスを取得し、メッセージを追加する
+            for ng_word in ng_words:
+                ok_word = NG_WORD_MATCHER.get_ok_word(ng_word)
                 message_user += f"・{ng_word}の代わりに{ok_word}を使用する。"
 
         # 無効なURLが含まれている場合
@@ -325,6 +1071,103 @@ def make_additional_message(chat_gpt: ChatGpt) -> str:
     return message_user
 
 
+# ChatGPTの返答の候補が、使用できないモジュールやクラス、無効なURLを含まないか確認する
+# （修正を依頼する回数には含めない）
+def is_valid_candidate(
+    chat_gpt: ChatGpt, results_url: dict[str, bool] | None = None
+) -> bool:
+    return not any(find_violations(chat_gpt, results_url).values())
+
+
+# ChatGPTにメッセージを送信する
+# （候補を複数生成する設定の場合は、ルールを満たす最初の候補を返答とする）
+def send_message_candidates(chat_gpt: ChatGpt, max_count: int = 0) -> None:
+    if CANDIDATES["mode"] == "off":
+        chat_gpt.send_message(1.0, max_count, make_stream_validator(RETRY_COUNT > 0, True))
+    else:
+        chat_gpt.send_message_candidates(
+            1.0, CANDIDATES["count"], is_valid_candidate, CANDIDATES["mode"], max_count
+        )
+
+
+# ルールに違反した返答をローカルで修正し、修正後に残った違反を返す
+# 修正後の返答がルールを満たす場合は最後の返答を置き換え（違反は空になる）、満たさない場合は元の違反を返す
+# （どちらで修正したかは、repairs_totalのpathに"local"または"llm"として記録する）
+def repair_violations(
+    chat_gpt: ChatGpt, violations: dict[str, list[str]]
+) -> dict[str, list[str]]:
+    # 受信を打ち切った返答は途中までのため、ローカルでは修正しない
+    if CODE_REPAIRER is None or chat_gpt.is_aborted or not any(violations.values()):
+        return violations
+
+    with Metrics.timer("repair_seconds", "repair"):
+        message = chat_gpt.messages[-1]
+        content = message["content"]
+        content_repaired = CODE_REPAIRER.repair(chat_gpt.get_analysis(), violations)
+
+        if content_repaired is not None:
+            # 修正後の返答を確認する（無効なURLは取り除いているため、残りのURLは確認済みの結果を使用する）
+            # 履歴と同じメッセージを共有しているため、置き換えた返答はそのまま保存される
+            message["content"] = content_repaired
+            violations_repaired = find_violations(chat_gpt, {
+                url: url not in violations["invalidUrls"]
+                for url in chat_gpt.get_analysis().urls
+            })
+
+            if not any(violations_repaired.values()):
+                Metrics.increment("repairs_total", path="local")
+                return violations_repaired
+
+            message["content"] = content
+
+    Metrics.increment("repairs_total", path="llm")
+
+    return violations
+
+
+# 使用できないモジュールやクラス、無効なURLが含まれている場合、メッセージを作成する
+# （URLの確認結果results_urlを渡した場合は、URLの確認を省略する）
+# ローカルで修正できた場合は、返答を置き換えて空文字を返す
+# （on_progressを渡した場合は、何件目の返答かを示すattemptと、ルールに違反した内容findingsを渡す）
+def make_additional_message(
+    chat_gpt: ChatGpt,
+    results_url: dict[str, bool] | None = None,
+    attempt: int = 0,
+    on_progress: Callable[..., None] | None = None
+) -> str:
+    violations = find_violations(chat_gpt, results_url)
+    message_user = make_message_violations(repair_violations(chat_gpt, violations))
+
+    if on_progress:
+        on_progress(attempt=attempt, findings=violations)
+
+    return message_user
+
+
+# 多くのリクエストで使用するテーブルの情報を取得し、DynamoDBのクライアントと接続を事前に作成する
+# （最初のリクエストでクライアントの作成やテーブル情報の取得を待たないようにする。失敗した場合は最初のリクエストで再度行う）
+# クライアントの作成はテーブルごとに数十ミリ秒かかるため、ジョブのテーブルは対象にしない
+def prewarm_tables() -> None:
+    tables = [TableMessage, TableCounter, TableLatest]
+
+    if APP_CONFIG["generationCache"]["backend"] == "dynamodb":
+        tables.append(TableCache)
+
+    def describe(table) -> None:
+        try:
+            table.describe_table()
+        except Exception as error:
+            print(error)
+
+    with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+        list(executor.map(describe, tables))
+
+
+# 環境ごとの設定で有効な場合は、起動時にテーブルへの接続を準備する
+if APP_CONFIG["prewarm"][AppConfig.get_environment()]:
+    prewarm_tables()
+
+
 # Flaskアプリの起動
 if __name__ == ("__main__"):
     # localhost以外からのアクセスを許可
@@ -0,0 +1,384 @@
+import io
+import sys
+import json
+import time
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator
+from aiohttp import web
+from multidict import CIMultiDict
+from werkzeug.exceptions import HTTPException, BadRequest, InternalServerError
+
+from main import (
+    app,
+    APP_CONFIG,
+    RETRY_COUNT,
+    CANDIDATES,
+    URL_VALIDATOR,
+    GENERATION_CACHE,
+    ADMISSION,
+    ADMISSION_WEIGHT,
+    LIMITER,
+    make_chat_gpt_first,
+    make_chat_gpt,
+    make_session,
+    make_cache_key,
+    make_additional_message,
+    make_stream_validator,
+    is_valid_candidate,
+    make_response_body,
+    make_admission_error,
+    save_first_message,
+    set_reply_cached,
+    set_cache,
+    save_latest
+)
+from models.utility import Utility
+from models.chat_gpt import ChatGpt, CLIENT
+from models.metrics import Metrics
+
+
+# 非同期サーバー
+# ChatGPTとやりとりするエンドポイントは、応答を待つ間にスレッドを占有しないよう非同期で処理する
+# それ以外のエンドポイントは、Flaskアプリをスレッドで実行して処理する
+# 起動方法：python main_async.py
+
+
+# 同期処理（DynamoDBへのアクセスなど）をスレッドで実行する
+# （工程ごとの処理時間を記録できるよう、呼び出し元のコンテキストを引き継ぐ）
+async def run_sync(func, *args, **kwargs) -> any:
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(None, partial(context.run, func, *args, **kwargs))
+
+
+# フォームの値を取得する（存在しない場合はエラーを返す）
+def get_form_value(form, key: str) -> str:
+    if key not in form:
+        raise BadRequest(f"{key}が指定されていません。")
+
+    return form[key]
+
+
+# レスポンスをjson形式で返す
+def json_response(data: dict, status: int = 200) -> web.Response:
+    return web.json_response(
+        data, status=status, dumps=partial(json.dumps, ensure_ascii=False)
+    )
+
+
+# Flaskアプリのエンドポイントと同じ制限で、リクエストの頻度を確認する（超えている場合はエラーを返す）
+# （Flaskアプリのリクエストとして照合し、エンドポイントごとの回数を共有する）
+def check_limit(request: web.Request) -> None:
+    with app.test_request_context(
+        request.path, method=request.method, environ_base={"REMOTE_ADDR": request.remote or ""}
+    ):
+        LIMITER.check()
+
+
+# ChatGPTの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、メッセージを作成する
+async def make_additional_message_async(chat_gpt: ChatGpt) -> str:
+    # URLは非同期で並列に確認する
+    results_url = await URL_VALIDATOR.validate_urls_async(chat_gpt.get_analysis().urls)
+
+    return make_additional_message(chat_gpt, results_url)
+
+
+# ChatGPTの返答の候補が、使用できないモジュールやクラス、無効なURLを含まないか確認する
+async def is_valid_candidate_async(chat_gpt: ChatGpt) -> bool:
+    # URLは非同期で並列に確認する
+    results_url = await URL_VALIDATOR.validate_urls_async(chat_gpt.get_analysis().urls)
+
+    return is_valid_candidate(chat_gpt, results_url)
+
+
+# ChatGPTにメッセージを非同期で送信する
+# （候補を複数生成する設定の場合は、ルールを満たす最初の候補を返答とする）
+async def send_message_candidates_async(chat_gpt: ChatGpt, max_count: int = 0) -> None:
+    if CANDIDATES["mode"] == "off":
+        await chat_gpt.send_message_async(
+            1.0, max_count, make_stream_validator(RETRY_COUNT > 0, True)
+        )
+    else:
+        await chat_gpt.send_message_candidates_async(
+            1.0, CANDIDATES["count"], is_valid_candidate_async, CANDIDATES["mode"], max_count
+        )
+
+
+# ChatGPTにメッセージを送信する間、枠を確保する（空くまで非同期で待ち、確保できない場合はエラーを返す）
+@asynccontextmanager
+async def admit_async(endpoint: str):
+    if ADMISSION is None:
+        yield
+        return
+
+    lease = await ADMISSION.acquire_async(endpoint, ADMISSION_WEIGHT)
+
+    if lease is None:
+        raise make_admission_error()
+
+    try:
+        yield
+    finally:
+        await ADMISSION.release_async(lease)
+
+
+# エラーが発生したとき処理（Flaskアプリと同じ形式で返す）
+@web.middleware
+async def error_middleware(request: web.Request, handler) -> web.StreamResponse:
+    try:
+        response = await handler(request)
+    except web.HTTPException:
+        raise
+    except HTTPException as error:
+        print(error)
+
+        response = json_response({
+            "error": {"name": error.name, "description": error.description}
+        }, error.code)
+
+        # 混雑している場合は、再送信するまでの時間を返す
+        if getattr(error, "retry_after", None) is not None:
+            response.headers["Retry-After"] = str(error.retry_after)
+    except Exception as error:
+        print(error)
+
+        error = InternalServerError("サーバー内部でエラーが発生しました。")
+        response = json_response({
+            "error": {"name": error.name, "description": error.description}
+        }, error.code)
+
+    # サーバーを跨いでのリクエストを許可する
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+
+    return response
+
+
+# 非同期で処理したリクエストの処理時間を記録し、工程ごとの処理時間をヘッダーに追加する
+# （Flaskアプリで処理したリクエストは、Flaskアプリ側で記録する）
+@web.middleware
+async def metrics_middleware(request: web.Request, handler) -> web.StreamResponse:
+    if request.match_info.handler is handle_wsgi:
+        return await handler(request)
+
+    started_at = time.perf_counter()
+    Metrics.start_timings()
+    response = await handler(request)
+
+    seconds = time.perf_counter() - started_at
+    Metrics.observe(
+        "http_request_seconds", seconds, endpoint=request.path, status=response.status
+    )
+    Metrics.add_timing("total", seconds)
+    response.headers["Server-Timing"] = Metrics.get_server_timing()
+
+    return response
+
+
+# ChatGPTに最初のメッセージを送信する
+async def send_first_message(request: web.Request) -> web.Response:
+    # リクエストの頻度を確認する
+    await run_sync(check_limit, request)
+    # リクエストの受取り
+    content = get_form_value(await request.post(), "content")
+    # 日付+16桁ランダムな文字列をuser_idとする
+    user_id = f"{Utility.get_date_str()}{Utility.generate_random_string(16)}"
+    # ChatGPTに送信するメッセージを設定する
+    chat_gpt = make_chat_gpt_first(content)
+    # キャッシュのキーを作成し、キャッシュからやりとりを取得する
+    cache_key = make_cache_key(content)
+    messages_cache = await run_sync(GENERATION_CACHE.get, cache_key)
+
+    # キャッシュが存在する場合は、ChatGPTにメッセージを送信しない
+    if messages_cache:
+        set_reply_cached(chat_gpt, messages_cache)
+    else:
+        async with admit_async(request.path):
+            with Metrics.timer("generation_seconds", mode=CANDIDATES["mode"]):
+                # ChatGPTにメッセージを送信する（全ての候補がルールを満たさない場合のみ、修正を依頼する）
+                await send_message_candidates_async(chat_gpt)
+                # 最後の返答がルールを満たすかどうか（確認していない場合はNone）
+                is_valid = None
+
+                for i in range(RETRY_COUNT):
+                    # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                    # 追加のメッセージを作成する
+                    message_user = await make_additional_message_async(chat_gpt)
+
+                    if message_user:
+                        # ChatGPTに送信するメッセージを設定する
+                        chat_gpt.add_message_user(message_user)
+                        # ChatGPTにメッセージを送信する
+                        await chat_gpt.send_message_async(
+                            1.0, validator=make_stream_validator(i + 1 < RETRY_COUNT, True)
+                        )
+                    else:
+                        is_valid = True
+                        break
+
+        # ルールを満たす返答が得られた場合は、キャッシュに保存する（最後の返答を確認していない場合は確認する）
+        if is_valid is None and GENERATION_CACHE.enabled:
+            is_valid = await is_valid_candidate_async(chat_gpt)
+
+        await run_sync(set_cache, cache_key, chat_gpt, is_valid)
+
+    # ChatGPTとのやりとりをテーブルに保存し、user_idとソースコードを返す
+    return json_response(await run_sync(save_first_message, user_id, chat_gpt))
+
+
+# ChatGPTに2回目以降のメッセージを送信する
+async def send_message(request: web.Request) -> web.Response:
+    # リクエストの頻度を確認する
+    await run_sync(check_limit, request)
+    # リクエストの受取り
+    form = await request.post()
+    user_id = get_form_value(form, "userId")
+    content = get_form_value(form, "content")
+    # 過去のやりとりを1度だけ読み込む
+    session = await run_sync(make_session, user_id)
+
+    try:
+        # ChatGPTに送信するメッセージを設定する
+        chat_gpt = make_chat_gpt(session, content)
+        async with admit_async(request.path):
+            with Metrics.timer("generation_seconds", mode=CANDIDATES["mode"]):
+                # ChatGPTにメッセージを送信する（全ての候補がルールを満たさない場合のみ、修正を依頼する）
+                await send_message_candidates_async(
+                    chat_gpt, APP_CONFIG["chatGpt"]["sendingMessage"]["maxCount"]
+                )
+                # ChatGPTとのやりとりの最後の2件を履歴に追加する
+                await run_sync(session.add_turn, chat_gpt)
+
+                for i in range(RETRY_COUNT):
+                    # ChatGPTからの返答に使用できないモジュールやクラス、無効なURLが含まれている場合、
+                    # 追加のメッセージを作成する
+                    message_user = await make_additional_message_async(chat_gpt)
+
+                    if message_user:
+                        # 履歴からメッセージを設定する
+                        chat_gpt = session.make_chat_gpt(message_user)
+                        # ChatGPTにメッセージを送信する
+                        await chat_gpt.send_message_async(
+                            1.0, validator=make_stream_validator(i + 1 < RETRY_COUNT, True)
+                        )
+                        # ChatGPTとのやりとりの最後の2件を履歴に追加する
+                        await run_sync(session.add_turn, chat_gpt)
+                    else:
+                        break
+    finally:
+        # 新しいやりとりをまとめてテーブルに保存する
+        await run_sync(session.flush)
+
+    body = make_response_body(user_id, chat_gpt, session.prompt_tokens)
+    await run_sync(save_latest, body)
+
+    # ソースコードを返す
+    return json_response(body)
+
+
+# その他のエンドポイントは、FlaskアプリをWSGIアプリとしてスレッドで実行する
+# レスポンスの本文は、Flaskアプリが返した順に少しずつ返す（Server-Sent Eventsやndjsonを、生成し終えるまで待たせない）
+async def handle_wsgi(request: web.Request) -> web.StreamResponse:
+    body = await request.read()
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": request.host.split(":")[0],
+        "SERVER_PORT": str(APP_CONFIG["asyncServer"]["port"]),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    status_headers = {}
+
+    # HTTPヘッダーをWSGIの形式に変換する
+    for key, value in request.headers.items():
+        name = f"HTTP_{key.upper().replace('-', '_')}"
+
+        if name not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[name] = value
+
+    def start_response(status: str, headers: list, exc_info=None) -> None:
+        status_headers["status"] = int(status.split(" ")[0])
+        status_headers["headers"] = CIMultiDict(headers)
+
+    # Flaskアプリを呼び出し、本文の最初の部分を取得する（通常のレスポンスは、1回のスレッドの実行で返し終える）
+    def call_app() -> tuple[Iterable[bytes], Iterator[bytes], bytes | None]:
+        result = app.wsgi_app(environ, start_response)
+        iterator = iter(result)
+
+        return result, iterator, next(iterator, None)
+
+    # 本文の続きは同じスレッドの呼び出しごとに取得する
+    # （ストリーミングのレスポンスはリクエストのコンテキストを保持するため、同じコンテキストで実行する）
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    result, iterator, chunk = await loop.run_in_executor(None, context.run, call_app)
+    response = web.StreamResponse(
+        status=status_headers["status"], headers=status_headers["headers"]
+    )
+
+    try:
+        await response.prepare(request)
+
+        while chunk is not None:
+            if chunk:
+                await response.write(chunk)
+
+            chunk = await loop.run_in_executor(None, context.run, next, iterator, None)
+
+        await response.write_eof()
+    finally:
+        # 切断された場合も、Flaskアプリの後処理（枠の解放など）を行う
+        if hasattr(result, "close"):
+            await loop.run_in_executor(None, context.run, result.close)
+
+    return response
+
+
+# アプリの起動時に、同期処理を実行するスレッドの最大数を設定する
+async def set_executor(app_async: web.Application) -> None:
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=APP_CONFIG["asyncServer"]["maxWorkersSync"])
+    )
+
+
+# アプリの終了時に、URLの確認で使用したセッションを閉じる
+async def close_sessions(app_async: web.Application) -> None:
+    await URL_VALIDATOR.close_async()
+    await CLIENT.close_async()
+
+
+# 非同期サーバーのアプリを作成する
+def create_app() -> web.Application:
+    app_async = web.Application(
+        middlewares=[metrics_middleware, error_middleware],
+        client_max_size=app.config["MAX_CONTENT_LENGTH"]
+    )
+    app_async.router.add_post("/sendFirstMessage", send_first_message)
+    app_async.router.add_post("/sendMessage", send_message)
+    app_async.router.add_route("*", "/{path:.*}", handle_wsgi)
+    app_async.on_startup.append(set_executor)
+    app_async.on_cleanup.append(close_sessions)
+
+    return app_async
+
+
+# 非同期サーバーの起動
+if __name__ == "__main__":
+    # localhost以外からのアクセスを許可
+    web.run_app(create_app(), host="0.0.0.0", port=APP_CONFIG["asyncServer"]["port"])
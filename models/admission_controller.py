@@ -0,0 +1,433 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .metrics import Metrics
+
+
+# 実行中の件数の保存先の基底クラス
+# 枠を確保すると、解放するときに渡す値（リース）を返す
+class AdmissionBackend(ABC):
+    def __init__(self, limit: int) -> None:
+        # 同時に実行できる件数
+        self.limit = limit
+
+    # weight件分の枠を確保し、リースを返す（空いていない場合はNoneを返す）
+    @abstractmethod
+    def try_acquire(self, weight: int) -> any:
+        pass
+
+    # 確保した枠を解放する
+    @abstractmethod
+    def release(self, lease: any) -> None:
+        pass
+
+    # 実行中の件数を取得する
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+
+# プロセスのメモリに実行中の件数を保存するクラス（インスタンスごとの制限となる）
+class MemoryAdmissionBackend(AdmissionBackend):
+    def __init__(self, limit: int) -> None:
+        super().__init__(limit)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self, weight: int) -> any:
+        with self.lock:
+            if self.in_flight + weight > self.limit:
+                return None
+
+            self.in_flight += weight
+
+        return weight
+
+    def release(self, lease: any) -> None:
+        with self.lock:
+            self.in_flight -= lease
+
+    def count(self) -> int:
+        return self.in_flight
+
+
+# カウンターのテーブルに枠ごとの有効期限を保存するクラス（全てのインスタンス間で共有できる）
+# 枠は"admission:{name}:{番号}"の行とし、有効期限が切れている枠を条件付きの更新で確保する
+# （停止したインスタンスが確保していた枠は、lease_ttl秒後に他のインスタンスが確保できるようになる）
+# 全ての枠を1回のバッチ読み込みで確認し、空いている枠のみ更新する（埋まっている間は書き込みを消費しない）
+# 確保中の枠は、lease_ttlの1/3ごとに有効期限を延長する（lease_ttlより長く実行しても、他のインスタンスに枠を渡さない）
+class DynamoDbAdmissionBackend(AdmissionBackend):
+    def __init__(self, name: str, limit: int, lease_ttl: float) -> None:
+        super().__init__(limit)
+        self.name = name
+        self.lease_ttl = lease_ttl
+        # 確保中のリース（有効期限を延長するため保持する。延長した有効期限はリースに書き戻す）
+        self.__leases: dict[int, list[tuple[str, float]]] = {}
+        self.__lock = threading.Lock()
+        threading.Thread(target=self.__renew_leases, daemon=True).start()
+
+    # 枠の行の名前
+    def __get_slot(self, index: int) -> str:
+        return f"admission:{self.name}:{index}"
+
+    # 全ての枠の有効期限を取得する
+    def __get_expires(self) -> dict[str, float]:
+        from .table_counter import TableCounter
+
+        return TableCounter.get_values([self.__get_slot(index) for index in range(self.limit)])
+
+    # 空いている枠を探して確保する（同時に確保するインスタンスと競合しないよう、ランダムな順に確認する）
+    def try_acquire(self, weight: int) -> any:
+        from .table_counter import TableCounter
+
+        now = time.time()
+        expires_at = now + self.lease_ttl
+        lease: list[tuple[str, float]] = []
+        expires = self.__get_expires()
+        indexes = [index for index in range(self.limit) if expires[self.__get_slot(index)] < now]
+
+        # 空いている枠が足りない場合は、書き込まずに終了する
+        if len(indexes) < weight:
+            return None
+
+        random.shuffle(indexes)
+
+        for index in indexes:
+            if TableCounter.acquire_lease(self.__get_slot(index), expires_at, now):
+                lease.append((self.__get_slot(index), expires_at))
+
+                if len(lease) == weight:
+                    with self.__lock:
+                        self.__leases[id(lease)] = lease
+
+                    return lease
+
+        # 必要な件数を確保できなかった場合は、確保した枠を戻す
+        self.__release_slots(lease)
+
+        return None
+
+    def release(self, lease: any) -> None:
+        # 延長中の場合は、延長し終えた有効期限で解放する
+        with self.__lock:
+            self.__leases.pop(id(lease), None)
+            slots = list(lease)
+
+        self.__release_slots(slots)
+
+    # 枠を有効期限を条件に解放する
+    def __release_slots(self, slots: list[tuple[str, float]]) -> None:
+        from .table_counter import TableCounter
+
+        for slot, expires_at in slots:
+            TableCounter.release_lease(slot, expires_at)
+
+    # 確保中の枠の有効期限を、lease_ttlの1/3ごとに延長し続ける
+    # （延長できなかった枠は、有効期限が切れて他で確保されたものとしてそのままにする）
+    def __renew_leases(self) -> None:
+        from .table_counter import TableCounter
+
+        while True:
+            time.sleep(self.lease_ttl / 3)
+
+            with self.__lock:
+                leases = list(self.__leases.values())
+
+            for lease in leases:
+                for index, (slot, expires_at) in enumerate(list(lease)):
+                    # 解放と競合しないよう、延長と書き戻しはロックしたまま行う
+                    with self.__lock:
+                        if id(lease) not in self.__leases:
+                            break
+
+                        try:
+                            expires_at_new = time.time() + self.lease_ttl
+
+                            if TableCounter.renew_lease(slot, expires_at, expires_at_new):
+                                lease[index] = (slot, expires_at_new)
+                        except Exception as error:
+                            print(error)
+
+    # 有効期限が切れていない枠の件数を取得する
+    def count(self) -> int:
+        now = time.time()
+
+        return sum(expires_at > now for expires_at in self.__get_expires().values())
+
+
+# ChatGPTにメッセージを送信するリクエストの同時実行数を制限するクラス
+# ・枠が空いていない場合は、優先度の高い順（同じ優先度は到着順）に待ち、枠が空いたものから実行する
+# ・待っているリクエストが上限に達している場合や、queue_timeout秒待っても実行できない場合はNoneを返す
+# ・他のインスタンスで空いた枠は、poll_interval秒ごとに確認する（待っているリクエストの件数に関わらず1回とする）
+# 枠の確保は待っているリクエストの先頭から行うため、優先度の低いリクエストは高いリクエストを追い越さない
+# 保存先へのアクセス（DynamoDBの場合は通信）はロックの外で行い、ロックでは待っているリクエストの更新のみを守る
+class AdmissionController:
+    def __init__(
+        self,
+        backend: AdmissionBackend,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: int,
+        poll_interval: float,
+        priorities: dict[str, int]
+    ) -> None:
+        self.backend = backend
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # 実行できなかった場合に、再送信までに待つように返す時間（秒）
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        # エンドポイントごとの優先度（小さいほど先に実行する。登録されていないものは最も低くする）
+        self.priorities = priorities
+        self.__priority_default = max(priorities.values(), default=0) + 1
+        # 待っているリクエスト（優先度、到着順、待っているリクエストの情報）
+        self.__queue: list[tuple[int, int, dict]] = []
+        self.__sequence = itertools.count()
+        self.__lock = threading.Lock()
+        # 最後に枠の確保を試みた時刻（monotonic）
+        self.__dispatched_at = 0.0
+        # 枠の確保を試みているスレッドがあるかどうかと、その間に枠が解放されたなどで再度試みる必要があるかどうか
+        # （待っているリクエストへの枠の確保は、同時に1つのスレッドでのみ行う）
+        self.__dispatching = False
+        self.__dispatch_again = False
+        # 解放した回数（すぐに確保できなかったリクエストを追加する間に、枠が解放されたかを確認する）
+        self.__released = 0
+        # 非同期で待つ場合に、保存先へのアクセスでイベントループを止めないよう使用するスレッド
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+
+    # 設定からインスタンスを作成する
+    @classmethod
+    def from_config(cls, config: dict) -> "AdmissionController":
+        backend: AdmissionBackend
+
+        if config["backend"] == "dynamodb":
+            backend = DynamoDbAdmissionBackend(
+                "openai", config["maxConcurrency"], config["leaseTtl"]
+            )
+        else:
+            backend = MemoryAdmissionBackend(config["maxConcurrency"])
+
+        return cls(
+            backend,
+            config["maxQueue"],
+            config["queueTimeout"],
+            config["retryAfter"],
+            config["pollInterval"],
+            config["priorities"]
+        )
+
+    # エンドポイントの優先度を取得する
+    def get_priority(self, endpoint: str) -> int:
+        return self.priorities.get(endpoint, self.__priority_default)
+
+    # 待っているリクエストの先頭から、枠を確保できたものに順に知らせる
+    # （他のスレッドが確保を試みている場合は、そのスレッドにもう一度試みさせて終了する）
+    def __dispatch(self) -> None:
+        with self.__lock:
+            if self.__dispatching:
+                self.__dispatch_again = True
+                return
+
+            self.__dispatching = True
+
+        try:
+            while True:
+                with self.__lock:
+                    self.__dispatch_again = False
+                    self.__dispatched_at = time.monotonic()
+
+                    if not self.__queue:
+                        self.__dispatching = False
+                        return
+
+                    waiter = self.__queue[0][2]
+
+                lease = self.backend.try_acquire(waiter["weight"])
+
+                with self.__lock:
+                    if lease is None:
+                        if not self.__dispatch_again:
+                            self.__dispatching = False
+                            return
+
+                        continue
+
+                    # 確保している間に待つのをやめた場合は、確保した枠を戻す
+                    if waiter["left"]:
+                        lease_unused = lease
+                    else:
+                        lease_unused = None
+                        self.__remove(waiter)
+                        waiter["lease"] = lease
+                        waiter["notify"]()
+
+                if lease_unused is not None:
+                    self.backend.release(lease_unused)
+        except Exception:
+            with self.__lock:
+                self.__dispatching = False
+            raise
+
+    # 待っているリクエストから取り除く（ロックを取得してから呼び出す）
+    def __remove(self, waiter: dict) -> None:
+        self.__queue = [item for item in self.__queue if item[2] is not waiter]
+        heapq.heapify(self.__queue)
+
+    # すぐに枠を確保するか、待っているリクエストに追加する
+    # 確保できた場合はリース、待つ場合は待っているリクエストの情報、待てない場合はNoneを返す
+    def __enter(self, priority: int, weight: int, notify: Callable[[], None]) -> tuple[any, dict | None]:
+        # 同じか高い優先度のリクエストが待っていない場合のみ、追い越して確保する
+        with self.__lock:
+            can_overtake = not self.__queue or self.__queue[0][0] > priority
+            released = self.__released
+
+        if can_overtake:
+            lease = self.backend.try_acquire(weight)
+
+            if lease is not None:
+                return lease, None
+
+        with self.__lock:
+            if len(self.__queue) >= self.max_queue:
+                return None, None
+
+            waiter = {"weight": weight, "lease": None, "left": False, "notify": notify}
+            heapq.heappush(self.__queue, (priority, next(self.__sequence), waiter))
+            # 確保を試みてから追加するまでに解放された枠は、すぐに確認する
+            released_since = self.__released != released
+
+        if released_since:
+            self.__dispatch()
+
+        return None, waiter
+
+    # 待っているリクエストが枠を確保できたか確認し、リースを返す
+    # （他のインスタンスで空いた枠は、他の待っているリクエストがpoll_interval秒以内に確認していない場合のみ確認する）
+    def __poll(self, waiter: dict) -> any:
+        with self.__lock:
+            should_dispatch = (
+                waiter["lease"] is None
+                and time.monotonic() - self.__dispatched_at >= self.poll_interval
+            )
+
+        if should_dispatch:
+            self.__dispatch()
+
+        return waiter["lease"]
+
+    # 待つのをやめる（既に枠を確保していた場合はリースを返す）
+    def __leave(self, waiter: dict) -> any:
+        with self.__lock:
+            if waiter["lease"] is None:
+                waiter["left"] = True
+                self.__remove(waiter)
+
+            return waiter["lease"]
+
+    # 枠を確保した結果を記録する
+    def __record(self, endpoint: str, result: str, started_at: float) -> None:
+        Metrics.increment("admission_total", endpoint=endpoint, result=result)
+        Metrics.observe(
+            "admission_wait_seconds", time.perf_counter() - started_at, endpoint=endpoint
+        )
+
+    # 枠を確保し、リースを返す（枠が空くまで待つ。実行できない場合はNoneを返す）
+    def acquire(self, endpoint: str, weight: int = 1) -> any:
+        started_at = time.perf_counter()
+        weight = min(weight, self.backend.limit)
+        event = threading.Event()
+        lease, waiter = self.__enter(self.get_priority(endpoint), weight, event.set)
+
+        if waiter is None:
+            self.__record(endpoint, "admitted" if lease is not None else "rejected", started_at)
+            return lease
+
+        deadline = time.monotonic() + self.queue_timeout
+
+        while time.monotonic() < deadline:
+            event.wait(min(self.poll_interval, deadline - time.monotonic()))
+
+            if self.__poll(waiter) is not None:
+                self.__record(endpoint, "queued", started_at)
+                return waiter["lease"]
+
+        lease = self.__leave(waiter)
+        self.__record(endpoint, "queued" if lease is not None else "timeout", started_at)
+
+        return lease
+
+    # 枠を非同期で確保し、リースを返す
+    # （保存先へのアクセスは専用のスレッドで行い、待つ間もイベントループを占有しない）
+    async def acquire_async(self, endpoint: str, weight: int = 1) -> any:
+        started_at = time.perf_counter()
+        weight = min(weight, self.backend.limit)
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        # 枠は他のスレッドで解放されることがあるため、イベントループのスレッドで知らせる
+        lease, waiter = await loop.run_in_executor(
+            self.__executor,
+            self.__enter,
+            self.get_priority(endpoint),
+            weight,
+            lambda: loop.call_soon_threadsafe(event.set)
+        )
+
+        if waiter is None:
+            self.__record(endpoint, "admitted" if lease is not None else "rejected", started_at)
+            return lease
+
+        deadline = time.monotonic() + self.queue_timeout
+
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(
+                        event.wait(), min(self.poll_interval, deadline - time.monotonic())
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+                if await loop.run_in_executor(self.__executor, self.__poll, waiter) is not None:
+                    self.__record(endpoint, "queued", started_at)
+                    return waiter["lease"]
+        except asyncio.CancelledError:
+            # 待っている間にリクエストが中断された場合は、確保した枠を解放する
+            lease = self.__leave(waiter)
+
+            if lease is not None:
+                self.__executor.submit(self.release, lease)
+            raise
+
+        lease = self.__leave(waiter)
+        self.__record(endpoint, "queued" if lease is not None else "timeout", started_at)
+
+        return lease
+
+    # 確保した枠を解放し、待っているリクエストに枠を渡す
+    def release(self, lease: any) -> None:
+        self.backend.release(lease)
+
+        with self.__lock:
+            self.__released += 1
+
+        self.__dispatch()
+
+    # 確保した枠を非同期で解放する
+    async def release_async(self, lease: any) -> None:
+        await asyncio.get_running_loop().run_in_executor(self.__executor, self.release, lease)
+
+    # 実行中及び待っているリクエストの件数を取得する
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "limit": self.backend.limit,
+            "inFlight": self.backend.count(),
+            "queued": len(self.__queue)
+        }
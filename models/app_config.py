@@ -0,0 +1,76 @@
+import os
+import threading
+
+from .file_access import FileAccess
+
+
+# 変更できない辞書（jsonに変換できるよう、dictを継承する）
+class FrozenDict(dict):
+    def __readonly(self, *args, **kwargs) -> None:
+        raise TypeError("設定は変更できません。")
+
+    __setitem__ = __readonly
+    __delitem__ = __readonly
+    clear = __readonly
+    pop = __readonly
+    popitem = __readonly
+    setdefault = __readonly
+    update = __readonly
+
+    def __hash__(self) -> int:
+        return id(self)
+
+
+# 設定ファイルとシークレットファイルを1度だけ読み込み、変更できない形式で保持するクラス
+# （テーブルのモジュールなどはmainを参照せず、このクラスから設定を取得する）
+class AppConfig:
+    __config: FrozenDict | None = None
+    __secret: FrozenDict | None = None
+    __lock = threading.Lock()
+
+    # 設定ファイルのパス（環境変数APP_CONFIG_FILEで切り替えられる。ベンチマークなどで使用する）
+    @classmethod
+    def get_path(cls) -> str:
+        return os.environ.get("APP_CONFIG_FILE", "./appconfig.json")
+
+    # 読み込んだ値を変更できない形式に変換する（辞書はFrozenDict、リストはタプルにする）
+    @classmethod
+    def freeze(cls, value: any) -> any:
+        if isinstance(value, dict):
+            return FrozenDict({key: cls.freeze(item) for key, item in value.items()})
+        elif isinstance(value, list):
+            return tuple(cls.freeze(item) for item in value)
+
+        return value
+
+    # 設定を取得する（最初に呼び出したときのみ、設定ファイルを読み込む）
+    @classmethod
+    def get(cls) -> FrozenDict:
+        if cls.__config is None:
+            with cls.__lock:
+                if cls.__config is None:
+                    cls.__config = cls.freeze(FileAccess(cls.get_path()).read_json_file())
+
+        return cls.__config
+
+    # シークレットを取得する（最初に呼び出したときのみ、シークレットファイルを読み込む）
+    @classmethod
+    def get_secret(cls) -> FrozenDict:
+        if cls.__secret is None:
+            path_secret = cls.get()["filePath"]["secret"]
+
+            with cls.__lock:
+                if cls.__secret is None:
+                    cls.__secret = cls.freeze(FileAccess(path_secret).read_json_file())
+
+        return cls.__secret
+
+    # 実行環境（development、productionなど）を取得する
+    @classmethod
+    def get_environment(cls) -> str:
+        return cls.get()["environment"]["value"]
+
+    # 開発環境であるか判定する
+    @classmethod
+    def is_dev(cls) -> bool:
+        return cls.get_environment() == "development"
@@ -1,20 +1,18 @@
+from typing import Mapping
 from flask import Flask
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from .file_access import FileAccess
-
 
 # Flaskアプリの初期設定を行うためのクラス
 class AppSetting:
     # Flaskインスタンスのconfig変数を設定する
     @classmethod
-    def set_config(cls, app: Flask, path_config_file: str) -> None:
-        # 設定ファイルから情報を取得する
-        file_access = FileAccess(path_config_file)
-        environment = file_access.read_json_file()["environment"]["value"]
-        dict_config = file_access.read_json_file()["config"][environment]
+    def set_config(cls, app: Flask, app_config: Mapping) -> None:
+        # 読み込み済みの設定から情報を取得する
+        environment = app_config["environment"]["value"]
+        dict_config = app_config["config"][environment]
 
         app.config["ENV"] = environment
         app.config["DEBUG"] = dict_config["debug"]
@@ -28,11 +26,17 @@ class AppSetting:
         return CORS(app)
 
     # リクエストの頻度を制限する
+    # （回数の保存先をstorageUriで共有すると、インスタンスを跨いで制限する。接続できない場合はプロセスのメモリで制限する）
     @classmethod
-    def limit_request(cls, app: Flask, path_config_file: str) -> Limiter:
-        # 設定ファイルから情報を取得する
-        file_access = FileAccess(path_config_file)
-        environment = file_access.read_json_file()["environment"]["value"]
-        limit = file_access.read_json_file()["limit"][environment]
+    def limit_request(cls, app: Flask, app_config: Mapping) -> Limiter:
+        # 読み込み済みの設定から情報を取得する
+        environment = app_config["environment"]["value"]
+        limit = app_config["limit"][environment]
 
-        return Limiter(get_remote_address, app=app, default_limits=[limit])
+        return Limiter(
+            get_remote_address,
+            app=app,
+            default_limits=[limit],
+            storage_uri=app_config["limit"]["storageUri"],
+            in_memory_fallback_enabled=True
+        )
@@ -1,7 +1,19 @@
-import openai
 import re
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import AsyncIterator, Awaitable, Callable, Iterator
 
-from .utility import Utility
+from .app_config import AppConfig
+from .openai_client import OpenAiClient
+from .source_code_analysis import SourceCodeAnalysis
+from .token_counter import TokenCounter
+from .stream_validator import StreamValidator
+from .metrics import Metrics
+
+
+# ChatGPTのAPIへのリクエストは、接続を使い回せるよう全てのインスタンスで共有する
+CLIENT = OpenAiClient.from_config(AppConfig.get()["chatGpt"]["client"])
 
 
 # ChatGPTとやり取りするためのクラス
@@ -9,8 +21,47 @@ class ChatGpt:
     MODEL = "gpt-4o"
 
     def __init__(self, api_key: str) -> None:
-        openai.api_key = api_key
+        # APIキーはリクエストごとに渡す（openaiモジュールのグローバルな設定は変更しない）
+        self.api_key = api_key
         self.messages: list[dict[str, str]] = []
+        # ChatGPTの返答の解析結果（最後のメッセージが変わるまで使い回す）
+        self.__analysis: SourceCodeAnalysis | None = None
+        # このインスタンスから送信したメッセージのトークン数の合計
+        self.prompt_tokens = 0
+        # 最後の返答の受信を、ルールに違反することが確定したため途中で打ち切ったかどうか
+        self.is_aborted = False
+        # 受信を打ち切った返答（messagesの要素。テーブルに保存する際に印を付ける）
+        self.__messages_aborted: list[dict[str, str]] = []
+
+    # APIのレスポンスから使用したトークン数を取得し、送信したメッセージのトークン数を合計に加算する
+    # （レスポンスに含まれない場合は見積もった値を加算する）
+    # 返答の候補を複数生成した場合は、候補の生成方法modeごとのトークン数も記録する
+    def __add_prompt_tokens(
+        self,
+        response: dict | None,
+        messages: list[dict[str, str]] | None = None,
+        mode: str | None = None
+    ) -> None:
+        messages = self.messages[:-1] if messages is None else messages
+        usage = (response or {}).get("usage") or {}
+
+        if mode is not None:
+            Metrics.increment("candidate_tokens_total", usage.get("prompt_tokens", 0), mode=mode, type="prompt")
+            Metrics.increment(
+                "candidate_tokens_total", usage.get("completion_tokens", 0), mode=mode, type="completion"
+            )
+
+        if "prompt_tokens" in usage:
+            self.prompt_tokens += usage["prompt_tokens"]
+            TokenCounter.calibrate(messages, usage["prompt_tokens"])
+            Metrics.increment("openai_tokens_total", usage["prompt_tokens"], type="prompt")
+            Metrics.increment(
+                "openai_tokens_total", usage.get("completion_tokens", 0), type="completion"
+            )
+        else:
+            tokens = TokenCounter.count_messages(messages)
+            self.prompt_tokens += tokens
+            Metrics.increment("openai_tokens_total", tokens, type="prompt_estimated")
 
     # APIのレスポンスからメッセージを取得する
     def __get_content(self, response: dict) -> str:
@@ -63,9 +114,54 @@ class ChatGpt:
 
         self.messages = [self.messages[0], self.messages[1], self.messages[-1]]
 
-    # メッセージを送信する
-    def send_message(self, temperature: float, max_count: int = 0) -> None:
-        response = None
+    # 返答のソースコードを省略した文字列に置き換える
+    def __summarize_code(self, content: str) -> str:
+        return re.sub(
+            r"```(javascript)?\n.*?\n```",
+            "```javascript\n// 以前のコードは省略します。最新のコードを参照してください。\n```",
+            content,
+            flags=re.DOTALL
+        )
+
+    # トークン数の上限までメッセージを圧縮する
+    # 最初の2件と最後の返答は必ず残し、上限に収まる範囲で新しいやりとりから順に残す
+    # summarize_old_codeがTrueの場合は、最後の返答以外のソースコードを省略する
+    def compress_message_budget(
+        self, max_tokens: int, summarize_old_code: bool = False
+    ) -> None:
+        # 順番の確認は、固定の件数で圧縮する場合と同じ
+        messages = self.messages
+        self.compress_message()
+        messages_head = self.messages[:2]
+        messages_tail = self.messages[2:]
+        index = len(messages) - 2
+
+        # 最初の2件と最後の返答のトークン数
+        tokens = TokenCounter.count_messages(messages_head + messages_tail)
+
+        # ユーザーのメッセージと返答の組を、新しい順に追加する
+        while index - 1 >= 2:
+            messages_pair = [dict(messages[index - 1]), dict(messages[index])]
+
+            if summarize_old_code and messages_pair[0]["role"] == "assistant":
+                messages_pair[0]["content"] = self.__summarize_code(
+                    messages_pair[0]["content"]
+                )
+
+            # 組を追加した場合のトークン数が上限を超える場合は終了する
+            tokens_pair = TokenCounter.count_messages(messages_pair) - TokenCounter.TOKENS_PER_REPLY
+
+            if tokens + tokens_pair > max_tokens:
+                break
+
+            tokens += tokens_pair
+            messages_tail = messages_pair + messages_tail
+            index -= 2
+
+        self.messages = messages_head + messages_tail
+
+    # 送信するメッセージと引数の値を検証する
+    def __validate_message(self, temperature: float, max_count: int) -> None:
         user_message_count = 0
 
         # ユーザーのメッセージの数を取得する
@@ -78,91 +174,347 @@ class ChatGpt:
             raise ValueError("引数temperatureは0.0以上1.0以下の値を指定してください。")
         elif max_count > 0 and user_message_count > max_count:
             raise ValueError(f"ユーザーのメッセージの数は{max_count}以下にしてください。")
+
+    # メッセージを送信する
+    # （validatorを渡した場合は、返答をストリーミングで受信しながら確認し、ルールに違反することが確定した時点で打ち切る）
+    def send_message(
+        self, temperature: float, max_count: int = 0, validator: StreamValidator | None = None
+    ) -> None:
+        response = None
+
+        if validator is not None:
+            for _ in self.send_message_stream(temperature, max_count, validator):
+                pass
+
+            return
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
         # APIへのリクエストを送信する
-        response = openai.ChatCompletion.create(
-            model=self.MODEL, temperature=temperature, messages=self.messages
-        )
+        with Metrics.timer("openai_request_seconds", "openai", mode="blocking"):
+            response = CLIENT.create(
+                self.api_key, model=self.MODEL, temperature=temperature, messages=self.messages
+            )
         # ChatGPTからの返答をmessagesに追加する
         self.messages.append(
             {"role": "assistant", "content": self.__get_content(response)}
         )
+        self.__add_prompt_tokens(response)
 
-    # ChatGPTの返答を取得する
-    def get_content_assistant(self) -> str:
-        return self.messages[-1]["content"]
+    # メッセージを非同期で送信する（応答を待つ間、他のリクエストを処理できる）
+    # （validatorを渡した場合は、返答をストリーミングで受信しながら確認し、ルールに違反することが確定した時点で打ち切る）
+    async def send_message_async(
+        self, temperature: float, max_count: int = 0, validator: StreamValidator | None = None
+    ) -> None:
+        if validator is not None:
+            async for _ in self.send_message_stream_async(temperature, max_count, validator):
+                pass
 
-    # ChatGPTの返答からjavascriptのソースコードをコメント、改行コード付きで抽出する
-    def get_source_code_javascript_with_comment(self) -> str:
-        # 正規表現パターンを設定する
-        pattern = (
-            r"```javascript\n(.*?)\n```"
-            if r"```javascript" in self.get_content_assistant()
-            else r"```\n(.*?)\n```"
-        )
-        # javascriptのソースコードを抽出する
-        source_code = re.search(pattern, self.get_content_assistant(), re.DOTALL).group(
-            1
+            return
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
+        # APIへのリクエストを送信する
+        with Metrics.timer("openai_request_seconds", "openai", mode="async"):
+            response = await CLIENT.acreate(
+                self.api_key, model=self.MODEL, temperature=temperature, messages=self.messages
+            )
+        # ChatGPTからの返答をmessagesに追加する
+        self.messages.append(
+            {"role": "assistant", "content": self.__get_content(response)}
         )
+        self.__add_prompt_tokens(response)
 
-        return source_code
+    # 返答の候補をmessagesに追加し、validateを満たすか確認する（満たさない場合は取り除く）
+    def __try_candidate(self, content: str, validate: Callable[["ChatGpt"], bool]) -> bool:
+        self.messages.append({"role": "assistant", "content": content})
+
+        if validate(self):
+            return True
+
+        self.messages.pop()
 
-    # ChatGPTの返答からjavascriptのソースコードを抽出する
-    def get_source_code_javascript(self) -> str:
-        # javascriptのソースコードをコメント、改行コード付きで抽出する
-        source_code = self.get_source_code_javascript_with_comment()
-        # コメントを削除する
-        source_code = re.sub(
-            r"(?<!:)//.*?$|\/\*.*?\*\/", "", source_code, flags=re.DOTALL | re.MULTILINE
-        )
-        # 改行コードを削除する
-        source_code = source_code.replace("\n", "")
+        return False
 
-        return source_code
+    # __try_candidateの非同期版（validateは非同期関数）
+    async def __try_candidate_async(
+        self, content: str, validate: Callable[["ChatGpt"], Awaitable[bool]]
+    ) -> bool:
+        self.messages.append({"role": "assistant", "content": content})
+
+        if await validate(self):
+            return True
+
+        self.messages.pop()
+
+        return False
+
+    # 候補が全てルールを満たさなかった場合は最初の候補を返答とし、確認結果を記録する
+    def __finish_candidates(self, mode: str, contents_failed: list[str], is_passed: bool) -> bool:
+        if not is_passed:
+            self.messages.append({"role": "assistant", "content": contents_failed[0]})
+
+        Metrics.increment("candidates_total", mode=mode, result="passed" if is_passed else "failed")
+
+        return is_passed
+
+    # 返答の候補を複数生成し、validateを満たす最初の候補を返答としてmessagesに追加する
+    # mode="n"は1回のリクエストでcount件の候補を生成し、"concurrent"はcount件のリクエストを同時に送信して受信した順に確認する
+    # 全ての候補がvalidateを満たさない場合は、最初の候補を追加してFalseを返す
+    def send_message_candidates(
+        self,
+        temperature: float,
+        count: int,
+        validate: Callable[["ChatGpt"], bool],
+        mode: str = "n",
+        max_count: int = 0
+    ) -> bool:
+        messages = list(self.messages)
+        contents_failed: list[str] = []
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
+
+        with Metrics.timer("candidate_seconds", "candidates", mode=mode):
+            if mode == "n":
+                # APIへのリクエストを送信する（候補は1回のレスポンスにまとめて含まれる）
+                with Metrics.timer("openai_request_seconds", "openai", mode="candidates"):
+                    response = CLIENT.create(
+                        self.api_key, model=self.MODEL, temperature=temperature, messages=messages, n=count
+                    )
+                self.__add_prompt_tokens(response, messages, mode)
+
+                for choice in response["choices"]:
+                    if self.__try_candidate(choice["message"]["content"], validate):
+                        return self.__finish_candidates(mode, contents_failed, True)
+
+                    contents_failed.append(choice["message"]["content"])
+
+                return self.__finish_candidates(mode, contents_failed, False)
+
+            # APIへのリクエストを別スレッドで送信する（処理時間を記録できるよう、呼び出し元のコンテキストを引き継ぐ）
+            def request() -> dict:
+                with Metrics.timer("openai_request_seconds", mode="concurrent"):
+                    return CLIENT.create(
+                        self.api_key, model=self.MODEL, temperature=temperature, messages=messages
+                    )
+
+            # 確認する前に戻った場合、残りのリクエストのトークン数は受信した時点で加算する
+            def add_prompt_tokens_later(future: Future) -> None:
+                if future.exception() is None:
+                    self.__add_prompt_tokens(future.result(), messages, mode)
+
+            executor = ThreadPoolExecutor(count)
+            futures = {executor.submit(contextvars.copy_context().run, request) for _ in range(count)}
+            error: Exception | None = None
+            # ルールを満たす候補が見つかった時点で戻れるよう、残りのリクエストの完了は待たない
+            executor.shutdown(wait=False)
+
+            try:
+                for future in as_completed(futures):
+                    futures.discard(future)
+
+                    # 失敗したリクエストは候補から除く（全て失敗した場合はエラーを発生させる）
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+
+                    response = future.result()
+                    self.__add_prompt_tokens(response, messages, mode)
+
+                    if self.__try_candidate(response["choices"][0]["message"]["content"], validate):
+                        return self.__finish_candidates(mode, contents_failed, True)
+
+                    contents_failed.append(response["choices"][0]["message"]["content"])
+            finally:
+                for future in futures:
+                    future.add_done_callback(add_prompt_tokens_later)
+
+            if not contents_failed:
+                raise error
+
+            return self.__finish_candidates(mode, contents_failed, False)
+
+    # 返答の候補を非同期で複数生成し、validateを満たす最初の候補を返答としてmessagesに追加する
+    # （send_message_candidatesの非同期版。"concurrent"の場合、ルールを満たす候補が見つかった時点で残りのリクエストをキャンセルする）
+    async def send_message_candidates_async(
+        self,
+        temperature: float,
+        count: int,
+        validate: Callable[["ChatGpt"], Awaitable[bool]],
+        mode: str = "n",
+        max_count: int = 0
+    ) -> bool:
+        messages = list(self.messages)
+        contents_failed: list[str] = []
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
+
+        with Metrics.timer("candidate_seconds", "candidates", mode=mode):
+            if mode == "n":
+                # APIへのリクエストを送信する（候補は1回のレスポンスにまとめて含まれる）
+                with Metrics.timer("openai_request_seconds", "openai", mode="candidates"):
+                    response = await CLIENT.acreate(
+                        self.api_key, model=self.MODEL, temperature=temperature, messages=messages, n=count
+                    )
+                self.__add_prompt_tokens(response, messages, mode)
+
+                for choice in response["choices"]:
+                    if await self.__try_candidate_async(choice["message"]["content"], validate):
+                        return self.__finish_candidates(mode, contents_failed, True)
+
+                    contents_failed.append(choice["message"]["content"])
+
+                return self.__finish_candidates(mode, contents_failed, False)
+
+            # APIへのリクエストを送信する
+            async def request() -> dict:
+                with Metrics.timer("openai_request_seconds", mode="concurrent"):
+                    return await CLIENT.acreate(
+                        self.api_key, model=self.MODEL, temperature=temperature, messages=messages
+                    )
+
+            tasks = [asyncio.create_task(request()) for _ in range(count)]
+            error: Exception | None = None
+
+            try:
+                for task in asyncio.as_completed(tasks):
+                    # 失敗したリクエストは候補から除く（全て失敗した場合はエラーを発生させる）
+                    try:
+                        response = await task
+                    except Exception as e:
+                        error = error or e
+                        continue
+
+                    self.__add_prompt_tokens(response, messages, mode)
+
+                    if await self.__try_candidate_async(response["choices"][0]["message"]["content"], validate):
+                        return self.__finish_candidates(mode, contents_failed, True)
+
+                    contents_failed.append(response["choices"][0]["message"]["content"])
+            finally:
+                # ルールを満たす候補が見つかった場合は、残りのリクエストをキャンセルする
+                for task in tasks:
+                    task.cancel()
+
+            if not contents_failed:
+                raise error
+
+            return self.__finish_candidates(mode, contents_failed, False)
+
+    # メッセージを送信し、ChatGPTの返答を受信した順に少しずつ返す
+    # validatorを渡した場合は、受信しながら確認し、ルールに違反することが確定した時点で受信を打ち切る
+    # （打ち切った場合の返答は、確定した部分までとしてコードブロックを閉じたものになる）
+    def send_message_stream(
+        self, temperature: float, max_count: int = 0, validator: StreamValidator | None = None
+    ) -> Iterator[str]:
+        content = ""
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
+        # APIへのリクエストを送信する（返答は分割して受信する）
+        with Metrics.timer("openai_request_seconds", "openai", mode="stream"):
+            response = CLIENT.create(
+                self.api_key, model=self.MODEL,
+                temperature=temperature,
+                messages=self.messages,
+                stream=True
+            )
 
-    # javascriptのソースコードでimportされているモジュールを抽出する
-    def get_import_modules(self) -> list[str]:
-        import_modules = []
+            for chunk in response:
+                delta = chunk["choices"][0]["delta"].get("content", "")
+
+                if delta:
+                    content += delta
+                    yield delta
+
+                    # 残りの返答は受信しない（接続を閉じる）
+                    if validator is not None and validator.feed(delta):
+                        content = validator.get_content_truncated()
+                        self.is_aborted = True
+                        Metrics.increment("stream_aborts_total")
+
+                        if hasattr(response, "close"):
+                            response.close()
+
+                        break
+
+        # 全て受信したら、ChatGPTからの返答をmessagesに追加する
+        self.messages.append({"role": "assistant", "content": content})
+        self.__add_prompt_tokens(None)
+
+        if self.is_aborted:
+            self.__messages_aborted.append(self.messages[-1])
+
+    # send_message_streamの非同期版
+    async def send_message_stream_async(
+        self, temperature: float, max_count: int = 0, validator: StreamValidator | None = None
+    ) -> AsyncIterator[str]:
+        content = ""
+
+        self.__validate_message(temperature, max_count)
+        self.is_aborted = False
+        # APIへのリクエストを送信する（返答は分割して受信する）
+        with Metrics.timer("openai_request_seconds", "openai", mode="stream_async"):
+            response = await CLIENT.acreate(
+                self.api_key, model=self.MODEL,
+                temperature=temperature,
+                messages=self.messages,
+                stream=True
+            )
 
-        # ソースコードを";"で分割し、配列にする→ループ
-        for item in self.get_source_code_javascript().split(";"):
-            # 両端の空白を削除する
-            sentence = item.strip()
-            import_module = ""
+            async for chunk in response:
+                delta = chunk["choices"][0]["delta"].get("content", "")
 
-            # 最初の6文字が"import"でない場合は、処理を抜ける
-            if sentence[:6] != "import":
-                break
+                if delta:
+                    content += delta
+                    yield delta
 
-            # importとfromの間を取得する
-            import_module = sentence[7 : sentence.find("from")].strip()
-            # "*"、" as "、"{"、"}"を削除し、全ての空白を削除する
-            import_module = Utility.remove_chars(
-                import_module, ["*", " as ", "{", "}", " "]
-            )
-            # ","が含まれる場合は","で分割し、ng_import_modulesに追加する
-            import_modules.extend(
-                import_module.split(",") if "," in import_module else [import_module]
-            )
-        return import_modules
+                    # 残りの返答は受信しない（接続を閉じる）
+                    if validator is not None and validator.feed(delta):
+                        content = validator.get_content_truncated()
+                        self.is_aborted = True
+                        Metrics.increment("stream_aborts_total")
 
-    # javascriptのソースコードにNGワードが含まれているか確認し、含まれている場合はそのNGワードを返す
-    def check_ng_words(self, ng_words: list[str]) -> list[str]:
-        # javascriptのソースコードを取得する
-        source_code = self.get_source_code_javascript()
-        results = []
+                        if hasattr(response, "aclose"):
+                            await response.aclose()
 
-        # NGワードが含まれているか確認する
-        for ng_word in ng_words:
-            if ng_word in source_code:
-                results.append(ng_word)
+                        break
 
-        return results
+        # 全て受信したら、ChatGPTからの返答をmessagesに追加する
+        self.messages.append({"role": "assistant", "content": content})
+        self.__add_prompt_tokens(None)
 
-    # javascriptのソースコードから、シングルクォートで囲まれたURL（https://~, http://~）を抽出する
-    def get_urls(self) -> list[str]:
-        # javascriptのソースコードを取得する
-        source_code = self.get_source_code_javascript()
-        # 正規表現パターンを設定する
-        pattern = r"'(https?://[\w/:%#\$&\?\(\)~\.=\+\-]+)'"
+        if self.is_aborted:
+            self.__messages_aborted.append(self.messages[-1])
 
-        return re.findall(pattern, source_code)
+    # messagesのうち、受信を打ち切った返答にabortedを付けたもの（テーブルに保存するため）
+    def get_messages_marked(self) -> list[dict[str, any]]:
+        return [
+            {**message, "aborted": True}
+            if any(message is aborted for aborted in self.__messages_aborted) else message
+            for message in self.messages
+        ]
+
+    # ChatGPTの返答を取得する
+    def get_content_assistant(self) -> str:
+        return self.messages[-1]["content"]
+
+    # ChatGPTの返答を解析した結果を取得する
+    def get_analysis(self) -> SourceCodeAnalysis:
+        content = self.get_content_assistant()
+
+        # 最後のメッセージが変わった場合のみ解析し直す
+        if self.__analysis is None or self.__analysis.content != content:
+            self.__analysis = SourceCodeAnalysis(content)
+
+        return self.__analysis
+
+    # ChatGPTの返答からjavascriptのソースコードをコメント、改行コード付きで抽出する
+    def get_source_code_javascript_with_comment(self) -> str:
+        return self.get_analysis().source_code_with_comment
+
+    # ChatGPTの返答からjavascriptのソースコードを抽出する
+    def get_source_code_javascript(self) -> str:
+        return self.get_analysis().source_code
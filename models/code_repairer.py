@@ -0,0 +1,144 @@
+import re
+
+from .ng_word_matcher import NgWordMatcher
+from .source_code_analysis import SourceCodeAnalysis
+
+
+# ルールに違反したChatGPTの返答を、ChatGPTに修正を依頼せずにソースコードを書き換えて修正するクラス
+# ・NGワードは、識別子の区切りで一致するものを代わりに使用するワードに置き換える
+# ・使用できないモジュールのimport文は、importした名前がソースコードで使用されていない場合のみ削除する
+# ・無効なURLのテクスチャの読み込みはnullに置き換え、テクスチャのないマテリアルにする
+# 1つでも安全に修正できない違反がある場合は修正しない（ChatGPTに修正を依頼する）
+class CodeRepairer:
+    # 1行で記述されたimport文の正規表現パターン（行末のコメントを含む）
+    PATTERN_IMPORT = re.compile(
+        r"^[ \t]*(?P<sentence>import\s+(?P<clause>[^'\"\n;]+?)\s+from\s+(['\"])[^'\"\n]+\3)"
+        r"[ \t]*;?[ \t]*(?://[^\n]*)?(?:\n|$)",
+        re.MULTILINE
+    )
+    # テクスチャを読み込む式の正規表現パターン（{url}に読み込むURLが入る。コールバックを渡すものは対象外）
+    PATTERN_LOAD = (
+        r"(?:new\s+THREE\.TextureLoader\(\s*\)|[\w$]+)\s*\.\s*load\(\s*'{url}'\s*\)"
+    )
+    # テクスチャを代入した変数の、修正しても安全な使い方（オブジェクトのプロパティの値、プロパティへの代入）
+    PATTERN_SAFE_USAGE = r"(?:[\w$]+\s*:|\.[\w$]+\s*=)\s*{name}(?![\w$])"
+
+    def __init__(self, matcher: NgWordMatcher, importable_modules: list[str]) -> None:
+        self.matcher = matcher
+        self.importable_modules = importable_modules
+
+    # 識別子の一部ではない位置で、文字列に一致する正規表現パターンを作成する
+    @classmethod
+    def __make_pattern_token(cls, text: str) -> str:
+        return r"(?<![\w$.])" + re.escape(text) + r"(?![\w$])"
+
+    # 返答の違反を修正し、修正後の返答を返す（安全に修正できない場合はNoneを返す）
+    def repair(
+        self, analysis: SourceCodeAnalysis, violations: dict[str, list[str]]
+    ) -> str | None:
+        source_code = analysis.source_code_with_comment
+
+        if violations["ngWords"]:
+            source_code = self.__replace_ng_words(source_code, violations["ngWords"])
+        if source_code is not None and violations["importModules"]:
+            source_code = self.__remove_imports(source_code, violations["importModules"])
+        if source_code is not None and violations["invalidUrls"]:
+            source_code = self.__remove_textures(source_code, violations["invalidUrls"])
+
+        if source_code is None:
+            return None
+
+        return analysis.content.replace(analysis.source_code_with_comment, source_code, 1)
+
+    # NGワードを、代わりに使用するワードに置き換える
+    # （代わりに使用するワードがない場合は修正できない）
+    def __replace_ng_words(self, source_code: str, ng_words: list[str]) -> str | None:
+        for ng_word in ng_words:
+            ok_word = self.matcher.get_ok_word(ng_word)
+
+            if not ok_word:
+                return None
+
+            # NGワードの前後が識別子の続き（THREE.Geometryに対するTHREE.GeometryUtilsなど）の場合は置き換えない
+            # （代わりに使用するワードは、置換のテンプレートとして解釈されないよう関数で返す）
+            source_code = re.sub(
+                r"(?<![\w$])" + re.escape(ng_word) + r"(?![\w$])",
+                lambda _: ok_word,
+                source_code
+            )
+
+        return source_code
+
+    # 使用できないモジュールのimport文を削除する
+    # （importした名前をソースコードで使用している場合や、使用できるモジュールと同じ文でimportしている場合は修正できない）
+    def __remove_imports(self, source_code: str, import_modules: list[str]) -> str | None:
+        removed: set[str] = set()
+
+        for match in reversed(list(self.PATTERN_IMPORT.finditer(source_code))):
+            modules = SourceCodeAnalysis.parse_import_modules(match.group("sentence"))
+
+            if not set(modules) & set(import_modules):
+                continue
+            if any(module in self.importable_modules for module in modules):
+                return None
+
+            source_code_removed = source_code[:match.start()] + source_code[match.end():]
+            code = SourceCodeAnalysis.PATTERN_COMMENT.sub("", source_code_removed)
+
+            # importした名前が残りのソースコードで使用されている場合は、削除するとエラーになる
+            for name in self.__get_import_names(match.group("clause")):
+                if re.search(self.__make_pattern_token(name), code):
+                    return None
+
+            source_code = source_code_removed
+            removed.update(modules)
+
+        # 1行で記述されていないimport文などは修正できない
+        if not set(import_modules) <= removed:
+            return None
+
+        return source_code
+
+    # import文のimportとfromの間から、importした名前を取得する
+    # （"* as THREE"はTHREE、"{ A, B as C }"はAとC、"D"はD）
+    @classmethod
+    def __get_import_names(cls, clause: str) -> list[str]:
+        names = []
+
+        for item in clause.replace("{", ",").replace("}", ",").split(","):
+            name = item.split(" as ")[-1].strip(" *\t\n")
+
+            if name:
+                names.append(name)
+
+        return names
+
+    # 無効なURLのテクスチャの読み込みをnullに置き換え、テクスチャのないマテリアルにする
+    # （URLをテクスチャの読み込み以外で使用している場合や、読み込んだテクスチャを変数に代入して
+    # マテリアルに設定する以外の使い方をしている場合は修正できない）
+    def __remove_textures(self, source_code: str, invalid_urls: list[str]) -> str | None:
+        for url in invalid_urls:
+            pattern_load = self.PATTERN_LOAD.format(url=re.escape(url))
+
+            # URLが全てテクスチャの読み込みで使用されているか確認する
+            if len(re.findall(pattern_load, source_code)) != source_code.count(f"'{url}'"):
+                return None
+
+            # テクスチャを変数に代入している場合は、その変数の使い方を確認する
+            names = re.findall(
+                r"(?:const|let|var)\s+([\w$]+)\s*=\s*" + pattern_load, source_code
+            )
+            source_code = re.sub(pattern_load, "null", source_code)
+            code = SourceCodeAnalysis.PATTERN_COMMENT.sub("", source_code)
+
+            for name in names:
+                pattern_name = self.__make_pattern_token(name)
+                pattern_safe = self.PATTERN_SAFE_USAGE.format(name=re.escape(name))
+                # 宣言と安全な使い方を除いて、変数が使用されていないこと
+                count_used = len(re.findall(pattern_name, code))
+                count_safe = len(re.findall(pattern_safe, code))
+
+                if count_used - count_safe != 1:
+                    return None
+
+        return source_code
@@ -0,0 +1,81 @@
+from .chat_gpt import ChatGpt
+from .table_message import TableMessage
+from .token_counter import TokenCounter
+
+
+# 1回のリクエストの間、ChatGPTとのやりとりをメモリに保持し、まとめてテーブルに保存するためのクラス
+class ConversationSession:
+    def __init__(
+        self,
+        user_id: str,
+        api_key: str,
+        checkpoint: str = "end",
+        compression: dict | None = None
+    ) -> None:
+        self.user_id = user_id
+        self.api_key = api_key
+        # テーブルに保存するタイミング（"end"：リクエストの最後、"turn"：やりとりごと）
+        self.checkpoint = checkpoint
+        # 履歴の圧縮方法（Noneの場合は、最初の2件と最後の返答のみを残す）
+        self.compression = compression or {"strategy": "fixed"}
+        # このリクエストでChatGPTに送信したメッセージのトークン数の合計
+        self.prompt_tokens = 0
+        # テーブルからレコードを1度だけ取得し、やりとりの履歴とする
+        records, self.__base = TableMessage.select_conversation(user_id)
+        self.messages: list[dict[str, str]] = [
+            {"role": record["role"], "content": record["content"]} for record in records
+        ]
+        # テーブルに保存していないやりとり
+        self.__messages_pending: list[dict[str, any]] = []
+
+    def __enter__(self) -> "ConversationSession":
+        return self
+
+    # 途中でエラーが発生した場合も、それまでのやりとりをテーブルに保存する
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    # ユーザーのメッセージの送信回数を数える
+    def count_message_user(self) -> int:
+        return len([message for message in self.messages if message["role"] == "user"])
+
+    # 履歴を圧縮し、ユーザーのメッセージを追加したChatGPTクラスのインスタンスを作成する
+    def make_chat_gpt(self, content: str, max_content_length: int = 0) -> ChatGpt:
+        chat_gpt = ChatGpt(self.api_key)
+
+        # 履歴をChatGPTクラスに渡す→メッセージを圧縮する→メッセージを追加する
+        chat_gpt.set_messages_past(self.messages)
+
+        # トークン数の上限から、追加するメッセージの分を除いた範囲に圧縮する
+        if self.compression["strategy"] == "budget":
+            chat_gpt.compress_message_budget(
+                self.compression["maxPromptTokens"]
+                - TokenCounter.count_messages([{"role": "user", "content": content}]),
+                self.compression["summarizeOldCode"]
+            )
+        else:
+            chat_gpt.compress_message()
+
+        chat_gpt.add_message_user(content, max_content_length)
+
+        return chat_gpt
+
+    # ChatGPTとのやりとりの最後の2件を履歴に追加する
+    # （checkpointが"turn"の場合は、それまでのやりとりを保存する。追加したやりとりの返答はローカルで修正される
+    # 場合があるため、次のやりとりの追加時か終了時に保存する。受信を打ち切った返答は、印を付けて保存する）
+    def add_turn(self, chat_gpt: ChatGpt) -> None:
+        if self.checkpoint == "turn":
+            self.flush()
+
+        self.prompt_tokens += chat_gpt.prompt_tokens
+        self.messages.extend(chat_gpt.messages[-2:])
+        self.__messages_pending.extend(chat_gpt.get_messages_marked()[-2:])
+
+    # テーブルに保存していないやりとりをまとめて保存する
+    def flush(self) -> None:
+        if self.__messages_pending:
+            # 返答を差分で保存する場合の基準は、保存するたびに更新する
+            self.__base = TableMessage.insert_records(
+                self.user_id, self.__messages_pending, self.__base
+            )
+            self.__messages_pending = []
@@ -0,0 +1,214 @@
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from .file_access import FileAccess
+from .metrics import Metrics
+
+
+# キャッシュの保存先の基底クラス
+class CacheBackend(ABC):
+    # キーに対応する値を取得する（存在しない、または期限切れの場合はNoneを返す）
+    @abstractmethod
+    def get(self, key: str) -> list[dict[str, str]] | None:
+        pass
+
+    # キーと値を保存する
+    @abstractmethod
+    def set(self, key: str, value: list[dict[str, str]]) -> None:
+        pass
+
+    # 保存されている件数を取得する
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+
+# プロセスのメモリにキャッシュを保存するクラス（LRU方式で古いものから削除する）
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        # キーをキーとし、値と有効期限（UNIX時間）を値とする辞書（古い順に並ぶ）
+        self.items: OrderedDict[str, tuple[list[dict[str, str]], float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> list[dict[str, str]] | None:
+        with self.lock:
+            if key not in self.items:
+                return None
+
+            value, expires_at = self.items[key]
+
+            # 期限切れの場合は削除する
+            if expires_at < time.time():
+                del self.items[key]
+                return None
+
+            # 最近使用したものとして末尾に移動する
+            self.items.move_to_end(key)
+
+            return value
+
+    def set(self, key: str, value: list[dict[str, str]]) -> None:
+        with self.lock:
+            self.items[key] = (value, time.time() + self.ttl)
+            self.items.move_to_end(key)
+
+            # 最大件数を超えた場合は最も古いものを削除する
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def count(self) -> int:
+        return len(self.items)
+
+
+# jsonファイルにキャッシュを保存するクラス（同じファイルを参照するインスタンス間で共有できる）
+class FileCacheBackend(MemoryCacheBackend):
+    def __init__(self, file_path: str, max_size: int, ttl: float) -> None:
+        super().__init__(max_size, ttl)
+        self.file_access = FileAccess(file_path)
+        # ファイルの読み込みから書き込みまでを排他制御するためのロック
+        self.file_lock = threading.Lock()
+
+    # ファイルからキャッシュを読み込む（ファイルが存在しない場合は空とする）
+    def __load(self) -> None:
+        try:
+            json_data = self.file_access.read_json_file()
+        except (FileNotFoundError, json.JSONDecodeError):
+            json_data = {}
+
+        self.items = OrderedDict(
+            (key, (item["value"], item["expiresAt"]))
+            for key, item in json_data.items()
+        )
+
+    # キャッシュをファイルに書き込む
+    def __save(self) -> None:
+        self.file_access.write_json_file({
+            key: {"value": value, "expiresAt": expires_at}
+            for key, (value, expires_at) in self.items.items()
+        })
+
+    def get(self, key: str) -> list[dict[str, str]] | None:
+        with self.file_lock:
+            self.__load()
+
+            return super().get(key)
+
+    def set(self, key: str, value: list[dict[str, str]]) -> None:
+        with self.file_lock:
+            self.__load()
+            super().set(key, value)
+            self.__save()
+
+    def count(self) -> int:
+        with self.file_lock:
+            self.__load()
+
+            return super().count()
+
+
+# DynamoDBのテーブルにキャッシュを保存するクラス（全てのインスタンス間で共有できる）
+class DynamoDbCacheBackend(CacheBackend):
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+
+    def get(self, key: str) -> list[dict[str, str]] | None:
+        from .table_cache import TableCache
+
+        return TableCache.get_value(key)
+
+    def set(self, key: str, value: list[dict[str, str]]) -> None:
+        from .table_cache import TableCache
+
+        TableCache.set_value(key, value, self.ttl)
+
+    # 件数はテーブルの情報から取得する（全件走査を避けるため、概算値となる）
+    def count(self) -> int:
+        from .table_cache import TableCache
+
+        return TableCache.describe_table().get("ItemCount", 0)
+
+
+# 最初のメッセージに対するChatGPTとのやりとりをキャッシュするためのクラス
+class GenerationCache:
+    def __init__(self, backend: CacheBackend, enabled: bool = True) -> None:
+        self.backend = backend
+        self.enabled = enabled
+        # キャッシュが使用された回数、使用されなかった回数
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    # 設定ファイルの値からインスタンスを作成する
+    @classmethod
+    def from_config(cls, config: dict) -> "GenerationCache":
+        backend: CacheBackend
+
+        if config["backend"] == "file":
+            backend = FileCacheBackend(config["filePath"], config["maxSize"], config["ttl"])
+        elif config["backend"] == "dynamodb":
+            backend = DynamoDbCacheBackend(config["ttl"])
+        else:
+            backend = MemoryCacheBackend(config["maxSize"], config["ttl"])
+
+        return cls(backend, config["enabled"])
+
+    # ユーザーの入力を正規化する（全角・半角の統一、大文字・小文字の統一、連続する空白の除去）
+    @classmethod
+    def normalize(cls, content: str) -> str:
+        return " ".join(unicodedata.normalize("NFKC", content).lower().split())
+
+    # キャッシュのキーを作成する
+    @classmethod
+    def make_key(
+        cls,
+        content: str,
+        prompt_system: str,
+        prompt_user: str,
+        model: str,
+        config_receiving: dict
+    ) -> str:
+        source = json.dumps(
+            [cls.normalize(content), prompt_system, prompt_user, model, config_receiving],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    # キャッシュからやりとりを取得する（存在しない場合はNoneを返す）
+    def get(self, key: str) -> list[dict[str, str]] | None:
+        if not self.enabled:
+            return None
+
+        messages = self.backend.get(key)
+
+        with self.__lock:
+            if messages is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        Metrics.increment("generation_cache_total", result="miss" if messages is None else "hit")
+
+        return messages
+
+    # キャッシュにやりとりを保存する
+    def set(self, key: str, messages: list[dict[str, str]]) -> None:
+        if self.enabled:
+            self.backend.set(key, messages)
+
+    # キャッシュの使用状況を取得する
+    def get_stats(self) -> dict[str, any]:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "count": self.backend.count() if self.enabled else 0
+        }
@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .utility import Utility
+
+
+# ChatGPTとのやりとりを、リクエストとは別のスレッドでジョブとして実行するためのクラス
+class JobRunner:
+    def __init__(self, max_workers: int, max_queue: int, ttl: float) -> None:
+        # 同時に実行するジョブの最大数、実行待ちを含めたジョブの最大数
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        # ジョブの状態を保存する期間（秒）
+        self.ttl = ttl
+        # このインスタンスで実行中及び実行待ちのジョブの件数
+        self.__count = 0
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    # 実行中及び実行待ちのジョブの件数が上限に達しているか確認する
+    def is_full(self) -> bool:
+        return self.__count >= self.max_queue
+
+    # ジョブを登録し、ジョブのIDを返す（上限に達している場合はNoneを返す）
+    # funcには、引数paramsと、進捗を受け取る関数on_progressが渡される
+    # （on_progressには、更新するTableJobの列をキーワード引数で渡す。例：attempt=1、findings={...}、progress=100）
+    def submit(
+        self,
+        kind: str,
+        params: dict,
+        func: Callable[..., dict]
+    ) -> str | None:
+        from .table_job import TableJob
+
+        with self.__lock:
+            if self.is_full():
+                return None
+
+            self.__count += 1
+
+        # 日付+16桁ランダムな文字列をjob_idとする
+        job_id = f"{Utility.get_date_str()}{Utility.generate_random_string(16)}"
+
+        try:
+            TableJob.insert_job(job_id, kind, params, self.ttl)
+            self.__executor.submit(self.__run, job_id, params, func)
+        except Exception:
+            with self.__lock:
+                self.__count -= 1
+            raise
+
+        return job_id
+
+    # ジョブを実行し、進捗と結果をテーブルに保存する
+    def __run(self, job_id: str, params: dict, func: Callable[..., dict]) -> None:
+        from .table_job import TableJob
+
+        # 進捗を受け取るたびに、保存する
+        def on_progress(**values) -> None:
+            TableJob.update_job(job_id, **values)
+
+        try:
+            TableJob.update_job(job_id, status="running")
+            result = func(**params, on_progress=on_progress)
+            TableJob.update_job(job_id, status="succeeded", result=result)
+        except Exception as error:
+            print(error)
+
+            # エラーの内容を保存する（HTTPのエラーの場合は説明を保存する）
+            TableJob.update_job(
+                job_id, status="failed", error=getattr(error, "description", str(error))
+            )
+        finally:
+            with self.__lock:
+                self.__count -= 1
@@ -0,0 +1,385 @@
+import os
+import re
+import gzip
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator
+
+# Parquetはpyarrowがインストールされている場合のみ使用する（されていない場合はjsonlで書き出す）
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .file_access import FileAccess
+from .metrics import Metrics
+from .table_latest import TableLatest
+from .table_message import TableMessage, TOTAL_SEGMENTS
+
+
+# 件数の上限を超えた場合に、最も古いものから削除する辞書
+# （差分の基準となる返答の保持に使用し、スキャンするレコードの件数に関わらずメモリの使用量を一定にする）
+class BoundedDict(OrderedDict):
+    def __init__(self, max_size: int) -> None:
+        super().__init__()
+        self.max_size = max_size
+
+    def __setitem__(self, key: any, value: any) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+# 書き出すファイルの形式の基底クラス
+class ArchiveWriter(ABC):
+    # ファイルの拡張子
+    EXTENSION = ""
+
+    # レコードを書き込む
+    @abstractmethod
+    def write(self, records: list[dict[str, any]]) -> None:
+        pass
+
+    # ファイルを閉じる
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+# gzipで圧縮したjsonl形式で書き出すクラス（created_atはISO 8601形式の文字列とする）
+class JsonlArchiveWriter(ArchiveWriter):
+    EXTENSION = ".jsonl.gz"
+
+    def __init__(self, path: str) -> None:
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, records: list[dict[str, any]]) -> None:
+        for record in records:
+            self.file.write(json.dumps(
+                {**record, "created_at": record["created_at"].isoformat()}, ensure_ascii=False
+            ) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Parquet形式で書き出すクラス（row_group_size件ごとに列ごとに圧縮して書き込む）
+class ParquetArchiveWriter(ArchiveWriter):
+    EXTENSION = ".parquet"
+
+    def __init__(self, path: str, row_group_size: int = 10000) -> None:
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.get_schema(), compression="zstd")
+        self.row_group_size = row_group_size
+        # 書き込んでいないレコード
+        self.records: list[dict[str, any]] = []
+
+    # 列の定義
+    @classmethod
+    def get_schema(cls) -> "pyarrow.Schema":
+        return pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("user_id", pyarrow.string()),
+            ("role", pyarrow.string()),
+            ("content", pyarrow.string()),
+            ("aborted", pyarrow.bool_()),
+            ("created_at", pyarrow.timestamp("us", tz="UTC"))
+        ])
+
+    # 溜めたレコードを書き込む
+    def __flush(self) -> None:
+        if self.records:
+            self.writer.write_table(
+                pyarrow.Table.from_pylist(self.records, schema=self.get_schema())
+            )
+            self.records = []
+
+    def write(self, records: list[dict[str, any]]) -> None:
+        self.records.extend(records)
+
+        if len(self.records) >= self.row_group_size:
+            self.__flush()
+
+    def close(self) -> None:
+        self.__flush()
+        self.writer.close()
+
+
+# TableMessageのレコードを、ファイルに書き出す・ファイルから読み込むクラス
+# ・書き出しは、テーブルをtotal_segments個のセグメントに分割して並列にスキャンし、セグメントごとのファイルに書き込む
+#   （part_size件ごとにファイルを分け、閉じたファイルまでの続きのキーをcheckpoint.jsonに保存する）
+# ・同じディレクトリで再度書き出すと、checkpoint.jsonの位置から再開する（書きかけのファイルは削除して書き直す）
+# ・読み込みは、ディレクトリのファイルを並列に読み込み、バッチ書き込みでテーブルに追加する
+class MessageArchive:
+    FILE_CHECKPOINT = "checkpoint.json"
+    # 書き出すファイルの名前（セグメントの番号、セグメント内の連番）
+    FORMAT_FILE = "messages-{segment:04d}-{part:05d}{extension}"
+    PATTERN_FILE = re.compile(r"^messages-(\d{4})-(\d{5})(\.jsonl\.gz|\.parquet)$")
+
+    def __init__(
+        self,
+        directory: str,
+        fmt: str = "jsonl",
+        total_segments: int = TOTAL_SEGMENTS,
+        page_size: int = 1000,
+        part_size: int = 100000,
+        max_bases: int = 1024,
+        max_workers: int = 4
+    ) -> None:
+        # 書き出し先・読み込み元のディレクトリ
+        self.directory = directory
+        # 書き出す形式（"jsonl"、"parquet"。pyarrowがインストールされていない場合はjsonlとする）
+        self.format = "jsonl" if fmt == "parquet" and pyarrow is None else fmt
+        self.total_segments = total_segments
+        # 1回のスキャンで取得する件数と、1つのファイルに書き込む件数の目安
+        self.page_size = page_size
+        self.part_size = part_size
+        # セグメントごとに保持する、差分の基準となる返答の件数
+        self.max_bases = max_bases
+        # 読み込みで並列に処理するファイルの数
+        self.max_workers = max_workers
+        # セグメントごとの進捗（checkpoint.jsonの内容）
+        self.__checkpoint: dict[str, any] = {}
+        self.__lock = threading.Lock()
+
+    # 設定からインスタンスを作成する（設定の値は、引数で上書きできる）
+    @classmethod
+    def from_config(
+        cls,
+        config: dict,
+        directory: str,
+        fmt: str | None = None,
+        total_segments: int | None = None
+    ) -> "MessageArchive":
+        return cls(
+            directory,
+            fmt or config["format"],
+            total_segments or TOTAL_SEGMENTS,
+            config["pageSize"],
+            config["partSize"],
+            config["maxBases"],
+            config["maxWorkers"]
+        )
+
+    # 書き出す形式のクラス
+    def __get_writer_class(self) -> type[ArchiveWriter]:
+        return ParquetArchiveWriter if self.format == "parquet" else JsonlArchiveWriter
+
+    # ファイルのパス
+    def __get_path(self, segment: int, part: int) -> str:
+        return os.path.join(self.directory, self.FORMAT_FILE.format(
+            segment=segment, part=part, extension=self.__get_writer_class().EXTENSION
+        ))
+
+    # checkpoint.jsonを読み込む（存在しない場合は、最初から書き出す内容を作成する）
+    # 形式やセグメント数が異なる場合は、続きのキーを使用できないためエラーとする
+    def __load_checkpoint(self) -> None:
+        path = os.path.join(self.directory, self.FILE_CHECKPOINT)
+
+        if not os.path.exists(path):
+            self.__checkpoint = {
+                "format": self.format,
+                "totalSegments": self.total_segments,
+                "segments": [
+                    {"lastEvaluatedKey": None, "part": 0, "count": 0, "done": False}
+                    for _ in range(self.total_segments)
+                ]
+            }
+            return
+
+        checkpoint = FileAccess(path).read_json_file()
+
+        if checkpoint["format"] != self.format or checkpoint["totalSegments"] != self.total_segments:
+            raise ValueError(
+                f"{self.directory}には{checkpoint['format']}形式、"
+                f"{checkpoint['totalSegments']}セグメントで書き出したファイルがあります。"
+            )
+
+        self.__checkpoint = checkpoint
+
+    # セグメントの進捗を更新し、checkpoint.jsonに保存する（書き込み途中で中断しても壊れないよう、置き換えで保存する）
+    def __save_checkpoint(self, segment: int, **values) -> None:
+        path = os.path.join(self.directory, self.FILE_CHECKPOINT)
+
+        with self.__lock:
+            self.__checkpoint["segments"][segment].update(values)
+            FileAccess(path + ".tmp").write_json_file(self.__checkpoint)
+            os.replace(path + ".tmp", path)
+
+    # セグメントの書きかけのファイル（checkpoint.jsonに保存した連番以降のもの）を削除する
+    def __remove_partial(self, segment: int, part: int) -> None:
+        for name in os.listdir(self.directory):
+            match = self.PATTERN_FILE.match(name)
+
+            if match and int(match.group(1)) == segment and int(match.group(2)) >= part:
+                os.remove(os.path.join(self.directory, name))
+
+    # セグメントを続きからスキャンしてファイルに書き出し、書き出した件数の合計を返す
+    def __export_segment(self, segment: int, on_progress: Callable[[int], None]) -> int:
+        state = dict(self.__checkpoint["segments"][segment])
+
+        if state["done"]:
+            return state["count"]
+
+        self.__remove_partial(segment, state["part"])
+        bases = BoundedDict(self.max_bases)
+        last_evaluated_key = state["lastEvaluatedKey"]
+        writer: ArchiveWriter | None = None
+        count_part = 0
+
+        while True:
+            records, last_evaluated_key = TableMessage.scan_segment_page(
+                segment, self.total_segments, self.page_size, last_evaluated_key, bases
+            )
+
+            if records:
+                if writer is None:
+                    writer = self.__get_writer_class()(self.__get_path(segment, state["part"]))
+
+                writer.write(records)
+                count_part += len(records)
+                Metrics.increment("archive_records_total", len(records), operation="export")
+
+            # ファイルを閉じてから、続きのキーを保存する
+            if last_evaluated_key is None or count_part >= self.part_size:
+                if writer is not None:
+                    writer.close()
+                    writer = None
+                    state["part"] += 1
+
+                state["count"] += count_part
+                state["lastEvaluatedKey"] = last_evaluated_key
+                state["done"] = last_evaluated_key is None
+                self.__save_checkpoint(segment, **state)
+                on_progress(count_part)
+                count_part = 0
+
+            if last_evaluated_key is None:
+                return state["count"]
+
+    # テーブルのレコードを全件ファイルに書き出し、書き出した結果を返す
+    # （on_progressには、ファイルを閉じるたびに全てのセグメントで書き出した件数の合計が渡される）
+    @Metrics.timed("archive_seconds", operation="export")
+    def export(self, on_progress: Callable[[int], None] | None = None) -> dict[str, any]:
+        os.makedirs(self.directory, exist_ok=True)
+        self.__load_checkpoint()
+        count = sum(state["count"] for state in self.__checkpoint["segments"])
+
+        def add_progress(count_part: int) -> None:
+            nonlocal count
+
+            # 保存される件数が前後しないよう、ロックしたまま渡す
+            with self.__lock:
+                count += count_part
+
+                if on_progress:
+                    on_progress(count)
+
+        with ThreadPoolExecutor(max_workers=self.total_segments) as executor:
+            counts = list(executor.map(
+                lambda segment: self.__export_segment(segment, add_progress),
+                range(self.total_segments)
+            ))
+
+        return {
+            "directory": self.directory,
+            "format": self.format,
+            "totalSegments": self.total_segments,
+            "count": sum(counts),
+            "files": len(self.list_files())
+        }
+
+    # ディレクトリの書き出したファイルのパスを取得する
+    def list_files(self) -> list[str]:
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if self.PATTERN_FILE.match(name)
+        )
+
+    # ファイルからレコードをbatch_size件ずつ読み込む
+    @classmethod
+    def read_file(cls, path: str, batch_size: int) -> Iterator[list[dict[str, any]]]:
+        if path.endswith(ParquetArchiveWriter.EXTENSION):
+            if pyarrow is None:
+                raise ValueError("Parquet形式のファイルを読み込むには、pyarrowをインストールしてください。")
+
+            for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size):
+                yield batch.to_pylist()
+
+            return
+
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            records = []
+
+            for line in file:
+                record = json.loads(line)
+                record["created_at"] = datetime.fromisoformat(record["created_at"])
+                records.append(record)
+
+                if len(records) >= batch_size:
+                    yield records
+                    records = []
+
+            if records:
+                yield records
+
+    # ファイルのレコードをテーブルに追加し、追加した件数とidの最大値、返答を追加したuser_idを返す
+    # （on_progressには、バッチ書き込みするたびに追加した件数が渡される）
+    def __import_file(self, path: str, on_progress: Callable[[int], None]) -> tuple[int, int, set[str]]:
+        count = 0
+        max_id = 0
+        user_ids = set()
+
+        for records in self.read_file(path, self.page_size):
+            count_batch, max_id_batch = TableMessage.import_records(records)
+            count += count_batch
+            max_id = max(max_id, max_id_batch)
+            user_ids.update(record["user_id"] for record in records if record["role"] == "assistant")
+            Metrics.increment("archive_records_total", count_batch, operation="import")
+            on_progress(count_batch)
+
+        return count, max_id, user_ids
+
+    # ディレクトリのファイルを全てテーブルに追加し、読み込んだ結果を返す
+    # （同じidのレコードは上書きするため、中断した場合は最初からやり直せる）
+    # 追加後、連番のカウンターとuser_idの件数を、追加したレコードに合わせ、返答を追加したuser_idの最新のソースコードを作成し直す
+    # （on_progressには、バッチ書き込みするたびに全てのファイルで追加した件数の合計が渡される）
+    @Metrics.timed("archive_seconds", operation="import")
+    def import_files(self, on_progress: Callable[[int], None] | None = None) -> dict[str, any]:
+        paths = self.list_files()
+        count = 0
+
+        def add_progress(count_batch: int) -> None:
+            nonlocal count
+
+            # 保存される件数が前後しないよう、ロックしたまま渡す
+            with self.__lock:
+                count += count_batch
+
+                if on_progress:
+                    on_progress(count)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda path: self.__import_file(path, add_progress), paths))
+
+        max_id = max((max_id for _, max_id, _ in results), default=0)
+
+        if max_id:
+            TableMessage.raise_counter_id(max_id)
+
+        # 上書きした返答から作成された最新のソースコードを削除する（/insertRecordと同じ）
+        for user_id in set().union(*(user_ids for _, _, user_ids in results)):
+            TableLatest.delete_latest(user_id)
+
+        return {
+            "directory": self.directory,
+            "count": sum(count for count, _, _ in results),
+            "files": len(paths),
+            "userIds": TableMessage.recount_user_id()
+        }
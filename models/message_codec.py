@@ -0,0 +1,131 @@
+import json
+import zlib
+import difflib
+
+# zstdはインストールされている場合のみ使用する（されていない場合はzlibで圧縮する）
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# テーブルに保存するメッセージを圧縮・差分化するクラス
+# 圧縮方式（codec）は"zlib"、"zstd"のいずれかで、差分の場合は末尾に"+delta"が付く
+# 差分は、同じやりとりの直前の全文（基準となる返答）からの行単位の変更を、jsonにして圧縮したもの
+class MessageCodec:
+    # 差分であることを表す圧縮方式の末尾
+    SUFFIX_DELTA = "+delta"
+
+    def __init__(
+        self,
+        compression: str = "none",
+        min_size: int = 512,
+        delta: bool = False,
+        max_delta_ratio: float = 0.5
+    ) -> None:
+        # 圧縮方式（"none"の場合は圧縮しない。zstdが使用できない場合はzlibとする）
+        self.compression = "zlib" if compression == "zstd" and zstandard is None else compression
+        # この文字数未満のメッセージは圧縮しない
+        self.min_size = min_size
+        # 返答を差分で保存するかどうか
+        self.delta = delta
+        # 差分の大きさが全文を圧縮したものに対してこの割合以下の場合のみ、差分で保存する
+        self.max_delta_ratio = max_delta_ratio
+
+    # 設定からインスタンスを作成する
+    @classmethod
+    def from_config(cls, config: dict) -> "MessageCodec":
+        return cls(
+            config["compression"],
+            config["minSize"],
+            config["delta"],
+            config["maxDeltaRatio"]
+        )
+
+    # 圧縮するかどうか
+    @property
+    def enabled(self) -> bool:
+        return self.compression != "none"
+
+    # 差分の圧縮方式であるか判定する
+    @classmethod
+    def is_delta(cls, codec: str | None) -> bool:
+        return codec is not None and codec.endswith(cls.SUFFIX_DELTA)
+
+    # バイト列を圧縮する
+    def __compress(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(data)
+
+        return zlib.compress(data, 6)
+
+    # 圧縮されたバイト列を展開する
+    @classmethod
+    def __decompress(cls, compression: str, payload: bytes) -> bytes:
+        if compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstdで圧縮されたメッセージを展開するには、zstandardをインストールしてください。")
+
+            return zstandard.ZstdDecompressor().decompress(payload)
+
+        return zlib.decompress(payload)
+
+    # 基準となる文字列からの行単位の差分を作成する
+    # （[開始行, 終了行]は基準の文字列の行をそのまま使用し、文字列は追加された行を表す）
+    @classmethod
+    def make_delta(cls, base: str, content: str) -> list[list[int] | str]:
+        lines_base = base.splitlines(keepends=True)
+        lines_content = content.splitlines(keepends=True)
+        matcher = difflib.SequenceMatcher(None, lines_base, lines_content, autojunk=False)
+        operations: list[list[int] | str] = []
+
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                operations.append([i1, i2])
+            elif tag in ("replace", "insert"):
+                operations.append("".join(lines_content[j1:j2]))
+
+        return operations
+
+    # 基準となる文字列に差分を適用する
+    @classmethod
+    def apply_delta(cls, base: str, operations: list[list[int] | str]) -> str:
+        lines_base = base.splitlines(keepends=True)
+
+        return "".join(
+            operation if isinstance(operation, str) else "".join(lines_base[operation[0]:operation[1]])
+            for operation in operations
+        )
+
+    # メッセージを圧縮し、圧縮方式と圧縮したバイト列を返す（圧縮しない場合はどちらもNone）
+    # baseを渡した場合は、差分の方が十分に小さければ差分を圧縮したものを返す
+    def encode(self, content: str, base: str | None = None) -> tuple[str | None, bytes | None]:
+        if not self.enabled or len(content) < self.min_size:
+            return None, None
+
+        payload = self.__compress(content.encode("utf-8"))
+
+        if self.delta and base is not None:
+            operations = self.make_delta(base, content)
+            payload_delta = self.__compress(
+                json.dumps(operations, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            )
+
+            if len(payload_delta) <= len(payload) * self.max_delta_ratio:
+                return self.compression + self.SUFFIX_DELTA, payload_delta
+
+        return self.compression, payload
+
+    # 圧縮されたメッセージを展開する（差分の場合は基準となる文字列baseが必要）
+    @classmethod
+    def decode(cls, codec: str, payload: bytes, base: str | None = None) -> str:
+        if cls.is_delta(codec):
+            if base is None:
+                raise ValueError("差分を展開するには、基準となるメッセージが必要です。")
+
+            compression = codec[:-len(cls.SUFFIX_DELTA)]
+            operations = json.loads(cls.__decompress(compression, payload).decode("utf-8"))
+
+            return cls.apply_delta(base, operations)
+
+        return cls.__decompress(codec, payload).decode("utf-8")
@@ -0,0 +1,179 @@
+import time
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator
+
+
+# 処理時間や件数を集計し、Prometheusの形式で出力するためのクラス
+class Metrics:
+    # ヒストグラムのバケットの上限（秒）
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # 名前とラベルをキーとするカウンターとヒストグラム
+    __counters: dict[str, dict[tuple, float]] = {}
+    __histograms: dict[str, dict[tuple, list]] = {}
+    # 名前ごとの説明
+    __descriptions: dict[str, str] = {
+        "http_request_seconds": "エンドポイントごとのリクエストの処理時間",
+        "openai_request_seconds": "ChatGPTのAPIの応答時間",
+        "openai_tokens_total": "ChatGPTのAPIで使用したトークン数",
+        "dynamodb_seconds": "TableMessageの操作ごとの処理時間",
+        "url_validation_seconds": "URLの確認にかかった時間",
+        "validation_seconds": "ChatGPTの返答のルール確認にかかった時間",
+        "retries_total": "ChatGPTに修正を依頼した回数",
+        "ng_word_hits_total": "ChatGPTの返答に含まれていたNGワードの件数",
+        "invalid_urls_total": "ChatGPTの返答に含まれていた無効なURLの件数",
+        "disallowed_imports_total": "ChatGPTの返答に含まれていた使用できないモジュールの件数",
+        "generation_cache_total": "最初のメッセージに対するやりとりのキャッシュの使用状況",
+        "generation_seconds": "候補の生成方法ごとの、ルールを満たす返答が得られるまでの時間（修正の依頼を含む）",
+        "candidate_seconds": "候補の生成方法ごとの、返答の候補の生成と確認にかかった時間",
+        "candidates_total": "候補の生成方法ごとの、ルールを満たす候補が得られたかどうかの件数",
+        "candidate_tokens_total": "候補の生成方法ごとの、返答の候補の生成に使用したトークン数",
+        "repair_seconds": "ルールに違反した返答をローカルで修正するのにかかった時間",
+        "repairs_total": "ルールに違反した返答を修正した方法（local：ローカルで修正、llm：ChatGPTに修正を依頼）ごとの件数",
+        "stream_aborts_total": "ルールに違反することが確定し、返答の受信を打ち切った回数",
+        "openai_retries_total": "ChatGPTのAPIへのリクエストを再送信した回数（エラーの種類ごと）",
+        "openai_hedges_total": "応答が遅いため追加で送信したリクエストの件数（sent）と、そのうち先に返った件数（won）",
+        "admission_total": (
+            "エンドポイントごとの、ChatGPTに送信する枠を確保した結果"
+            "（admitted：すぐに実行、queued：待って実行、rejected：待ち行列が満杯、timeout：時間内に空かない）の件数"
+        ),
+        "admission_wait_seconds": "エンドポイントごとの、ChatGPTに送信する枠を確保するまでに待った時間",
+        "archive_records_total": "ファイルに書き出した（export）、ファイルから読み込んだ（import）レコードの件数",
+        "archive_seconds": "レコードの書き出し（export）、読み込み（import）にかかった時間"
+    }
+    __lock = threading.Lock()
+    # リクエストごとの処理時間（Server-Timingヘッダーに出力する）
+    __timings: ContextVar[dict[str, float] | None] = ContextVar("timings", default=None)
+
+    # カウンターに値を加算する
+    @classmethod
+    def increment(cls, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+
+        with cls.__lock:
+            counter = cls.__counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    # ヒストグラムに値を記録する
+    @classmethod
+    def observe(cls, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(cls.BUCKETS, value)
+
+        with cls.__lock:
+            histogram = cls.__histograms.setdefault(name, {})
+            # バケットごとの件数、合計値、件数
+            buckets, total, count = histogram.get(key, [[0] * len(cls.BUCKETS), 0.0, 0])
+
+            if index < len(buckets):
+                buckets[index] += 1
+
+            histogram[key] = [buckets, total + value, count + 1]
+
+    # 処理時間を計測し、ヒストグラムとリクエストごとの処理時間に記録する
+    # stageを指定した場合は、Server-Timingヘッダーにその名前で出力する
+    @classmethod
+    @contextmanager
+    def timer(cls, name: str, stage: str | None = None, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            cls.observe(name, elapsed, **labels)
+
+            if stage is not None:
+                cls.add_timing(stage, elapsed)
+
+    # 関数の処理時間を計測するデコレーター
+    @classmethod
+    def timed(cls, name: str, stage: str | None = None, **labels) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with cls.timer(name, stage, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    # リクエストごとの処理時間の記録を開始する
+    @classmethod
+    def start_timings(cls) -> None:
+        cls.__timings.set({})
+
+    # リクエストごとの処理時間に加算する（記録を開始していない場合は何もしない）
+    @classmethod
+    def add_timing(cls, stage: str, seconds: float) -> None:
+        timings = cls.__timings.get()
+
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    # リクエストごとの処理時間をServer-Timingヘッダーの形式で取得する
+    @classmethod
+    def get_server_timing(cls) -> str:
+        timings = cls.__timings.get() or {}
+
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+        )
+
+    # ラベルの値のバックスラッシュ、ダブルクォート、改行をエスケープする
+    @classmethod
+    def __escape(cls, value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    # ラベルをPrometheusの形式に変換する
+    @classmethod
+    def __format_labels(cls, key: tuple, extra: tuple = ()) -> str:
+        items = key + extra
+
+        if not items:
+            return ""
+
+        return "{" + ",".join(
+            f'{name}="{cls.__escape(str(value))}"' for name, value in items
+        ) + "}"
+
+    # 集計結果をPrometheusのテキスト形式で出力する
+    @classmethod
+    def render(cls) -> str:
+        lines: list[str] = []
+
+        with cls.__lock:
+            for name, counter in sorted(cls.__counters.items()):
+                if name in cls.__descriptions:
+                    lines.append(f"# HELP {name} {cls.__descriptions[name]}")
+                lines.append(f"# TYPE {name} counter")
+
+                for key, value in counter.items():
+                    lines.append(f"{name}{cls.__format_labels(key)} {value}")
+
+            for name, histogram in sorted(cls.__histograms.items()):
+                if name in cls.__descriptions:
+                    lines.append(f"# HELP {name} {cls.__descriptions[name]}")
+                lines.append(f"# TYPE {name} histogram")
+
+                for key, (buckets, total, count) in histogram.items():
+                    cumulative = 0
+
+                    for bound, bucket in zip(cls.BUCKETS, buckets):
+                        cumulative += bucket
+                        lines.append(
+                            f"{name}_bucket{cls.__format_labels(key, (('le', bound),))} {cumulative}"
+                        )
+
+                    lines.append(
+                        f"{name}_bucket{cls.__format_labels(key, (('le', '+Inf'),))} {count}"
+                    )
+                    lines.append(f"{name}_sum{cls.__format_labels(key)} {total}")
+                    lines.append(f"{name}_count{cls.__format_labels(key)} {count}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,56 @@
+import re
+
+
+# 複数のNGワードを1つの正規表現にまとめ、1回の走査で検索するためのクラス
+class NgWordMatcher:
+    def __init__(self, words: list[dict[str, str]]) -> None:
+        # NGワードのリスト（設定ファイルの順番）
+        self.ng_words: list[str] = []
+        # NGワードをキー、代わりに使用するワードを値とする辞書
+        self.ok_words: dict[str, str] = {}
+
+        for word in words:
+            # 空文字及び重複するNGワードは除外する（重複する場合は最初のものを使用する）
+            if not word["NG"] or word["NG"] in self.ok_words:
+                continue
+
+            self.ok_words[word["NG"]] = word.get("OK", "")
+            self.ng_words.append(word["NG"])
+
+        # NGワードの文字数（昇順、重複なし）
+        self.__lengths = sorted({len(ng_word) for ng_word in self.ng_words})
+        # 長い順に並べたNGワードを先読みで検索し、各位置で最長のNGワードを取得する正規表現
+        self.__pattern = re.compile(
+            "(?=(" + "|".join(
+                map(re.escape, sorted(self.ng_words, key=len, reverse=True))
+            ) + "))"
+        ) if self.ng_words else None
+
+    # 文字列に含まれるNGワードとその位置（先頭の文字の位置）を出現順に返す
+    def find(self, text: str) -> list[tuple[str, int]]:
+        results: list[tuple[str, int]] = []
+
+        if self.__pattern is None:
+            return results
+
+        for match in self.__pattern.finditer(text):
+            longest = match.group(1)
+
+            # 同じ位置から始まる短いNGワードは、最長のNGワードの先頭部分と一致する
+            for length in self.__lengths:
+                if length > len(longest):
+                    break
+                if longest[:length] in self.ok_words:
+                    results.append((longest[:length], match.start()))
+
+        return results
+
+    # 文字列に含まれるNGワードを重複なしで返す（設定ファイルの順番）
+    def check(self, text: str) -> list[str]:
+        hits = {ng_word for ng_word, _ in self.find(text)}
+
+        return [ng_word for ng_word in self.ng_words if ng_word in hits]
+
+    # NGワードの代わりに使用するワードを取得する
+    def get_ok_word(self, ng_word: str) -> str:
+        return self.ok_words[ng_word]
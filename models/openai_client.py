@@ -0,0 +1,313 @@
+import time
+import random
+import asyncio
+import threading
+import aiohttp
+import openai
+import requests
+from collections import deque
+from typing import Callable
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from openai import api_requestor, error
+
+from .metrics import Metrics
+
+
+# ChatGPTのAPIへのリクエストを、全てのChatGPTクラスのインスタンスで共有して送信するクラス
+# ・接続はプールして使い回す（同期はrequestsのセッション、非同期はaiohttpのセッション）
+# ・1回のリクエストごとのタイムアウトと、再送信を含めた全体の期限を設ける
+# ・429、5xx、タイムアウト、接続エラーの場合は、ジッター付きの指数バックオフで再送信する（Retry-Afterがあれば従う）
+# ・hedgeが有効な場合、応答時間がパーセンタイル値を超えたら同じリクエストをもう1つ送信し、先に返ったものを使用する
+# APIキーはリクエストごとに渡し、openaiモジュールのグローバルな設定は変更しない
+class OpenAiClient:
+    # 再送信するエラー（5xxのAPIErrorは、ステータスコードを確認して再送信する）
+    RETRYABLE_ERRORS = (
+        error.RateLimitError,
+        error.ServiceUnavailableError,
+        error.Timeout,
+        error.APIConnectionError,
+        error.TryAgain
+    )
+
+    def __init__(
+        self,
+        timeout: float = 60,
+        connect_timeout: float = 5,
+        deadline: float = 120,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8,
+        max_connections: int = 20,
+        hedge: dict | None = None
+    ) -> None:
+        # 1回のリクエストのタイムアウト（秒。読み込みは受信の間隔）と、接続のタイムアウト（秒）
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        # 再送信を含めた全体の期限（秒）
+        self.deadline = deadline
+        # 再送信の最大回数と、待ち時間の基準・上限（秒）
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        # 追加のリクエストを送信する設定（enabled、percentile、minSamples、window）
+        self.hedge = hedge or {"enabled": False}
+        # 最近の応答時間（秒。追加のリクエストを送信するまでの時間の計算に使用する）
+        self.__latencies: deque[float] = deque(maxlen=self.hedge.get("window", 200))
+        self.__lock = threading.Lock()
+        # 同期のリクエストで共有するセッション（再送信はこのクラスで行うため、requestsでは再送信しない）
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        # 追加のリクエストを送信するためのスレッド
+        self.__executor = ThreadPoolExecutor(max_workers=max_connections)
+        # 非同期のリクエストで共有するセッション（イベントループの中で作成する）
+        self.__session_async: aiohttp.ClientSession | None = None
+        self.__loop_async: asyncio.AbstractEventLoop | None = None
+
+    # 設定からインスタンスを作成する
+    @classmethod
+    def from_config(cls, config: dict) -> "OpenAiClient":
+        return cls(
+            config["timeout"],
+            config["connectTimeout"],
+            config["deadline"],
+            config["maxRetries"],
+            config["backoffBase"],
+            config["backoffMax"],
+            config["maxConnections"],
+            config["hedge"]
+        )
+
+    # 再送信するエラーであるか判定する
+    def __is_retryable(self, e: Exception) -> bool:
+        if isinstance(e, self.RETRYABLE_ERRORS):
+            return True
+
+        return isinstance(e, error.APIError) and (e.http_status is None or e.http_status >= 500)
+
+    # エラーのレスポンスのRetry-Afterヘッダーから、待つ時間（秒）を取得する（ない場合はNone）
+    @classmethod
+    def get_retry_after(cls, e: Exception) -> float | None:
+        headers = getattr(e, "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        # 日時で指定されている場合
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # 再送信までの待ち時間（秒）を計算する（フルジッター。Retry-Afterがある場合はそれ以上待つ）
+    def get_backoff(self, attempt: int, e: Exception) -> float:
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = self.get_retry_after(e)
+
+        return backoff if retry_after is None else max(backoff, retry_after)
+
+    # 1回のリクエストのタイムアウト（接続、読み込み。全体の期限を超えないようにする）
+    def __get_request_timeout(self, remaining: float) -> tuple[float, float]:
+        return (min(self.connect_timeout, remaining), min(self.timeout, remaining))
+
+    # 応答時間を記録する
+    def __add_latency(self, latency: float) -> None:
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    # 追加のリクエストを送信するまでの時間（秒）を取得する（無効な場合や、記録が少ない場合はNone）
+    def get_hedge_delay(self) -> float | None:
+        if not self.hedge["enabled"]:
+            return None
+
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+
+        if len(latencies) < self.hedge["minSamples"]:
+            return None
+
+        return latencies[int(self.hedge["percentile"] * (len(latencies) - 1))]
+
+    # 再送信しながらリクエストを送信する（requestにはタイムアウトが渡される）
+    def __call(self, request: Callable[[tuple[float, float]], any]) -> any:
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            remaining = self.deadline - (time.monotonic() - start)
+
+            try:
+                return request(self.__get_request_timeout(remaining))
+            except Exception as e:
+                if not self.__is_retryable(e) or attempt >= self.max_retries:
+                    raise
+
+                backoff = self.get_backoff(attempt, e)
+
+                # 全体の期限までに再送信できない場合は、そのままエラーとする
+                if time.monotonic() - start + backoff >= self.deadline:
+                    raise
+
+                Metrics.increment("openai_retries_total", reason=type(e).__name__)
+                time.sleep(backoff)
+                attempt += 1
+
+    # このスレッドのopenaiのリクエストで、共有のセッションを使用する
+    # （openai 0.27の非公開の属性api_requestor._thread_context.sessionに依存するため、
+    # openaiの版を上げる場合は、requirements.txtの固定と併せて確認する）
+    def __use_session(self) -> None:
+        if getattr(api_requestor._thread_context, "session", None) is not self.__session:
+            api_requestor._thread_context.session = self.__session
+
+    # 1回のリクエストを送信し、応答時間を記録する
+    def __request(self, api_key: str, kwargs: dict, timeout: tuple[float, float]) -> any:
+        self.__use_session()
+        start = time.monotonic()
+        response = openai.ChatCompletion.create(
+            api_key=api_key, request_timeout=timeout, **kwargs
+        )
+
+        if not kwargs.get("stream"):
+            self.__add_latency(time.monotonic() - start)
+
+        return response
+
+    # 1回のリクエストを送信する（応答が遅い場合は、追加のリクエストを送信して先に返ったものを使用する）
+    # 返らなかった方のリクエストは、キャンセルできないため完了するまでスレッドで実行される
+    def __request_hedged(self, api_key: str, kwargs: dict, timeout: tuple[float, float]) -> any:
+        delay = None if kwargs.get("stream") else self.get_hedge_delay()
+
+        if delay is None:
+            return self.__request(api_key, kwargs, timeout)
+
+        futures = {self.__executor.submit(self.__request, api_key, kwargs, timeout)}
+        future_hedge: Future | None = None
+        error_first: Exception | None = None
+
+        if not wait(futures, timeout=delay).done:
+            future_hedge = self.__executor.submit(self.__request, api_key, kwargs, timeout)
+            futures.add(future_hedge)
+            Metrics.increment("openai_hedges_total", result="sent")
+
+        # 成功したものを返す（全て失敗した場合は最初のエラーを発生させる）
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    if future is future_hedge:
+                        Metrics.increment("openai_hedges_total", result="won")
+
+                    return future.result()
+
+                error_first = error_first or future.exception()
+
+        raise error_first
+
+    # ChatGPTのAPIにリクエストを送信する（引数はopenai.ChatCompletion.createと同じ）
+    def create(self, api_key: str, **kwargs) -> any:
+        return self.__call(lambda timeout: self.__request_hedged(api_key, kwargs, timeout))
+
+    # 非同期のリクエストで共有するセッションを取得する（イベントループが変わった場合は作成し直す）
+    def __get_session_async(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+
+        if self.__session_async is None or self.__session_async.closed or self.__loop_async is not loop:
+            self.__session_async = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+            self.__loop_async = loop
+
+        return self.__session_async
+
+    # 1回の非同期のリクエストを送信し、応答時間を記録する
+    async def __request_async(self, api_key: str, kwargs: dict, timeout: tuple[float, float]) -> any:
+        # openaiのリクエストで、共有のセッションを使用する（このタスクのコンテキストのみ）
+        openai.aiosession.set(self.__get_session_async())
+        start = time.monotonic()
+        response = await openai.ChatCompletion.acreate(
+            api_key=api_key, request_timeout=timeout, **kwargs
+        )
+
+        if not kwargs.get("stream"):
+            self.__add_latency(time.monotonic() - start)
+
+        return response
+
+    # 1回の非同期のリクエストを送信する（応答が遅い場合は、追加のリクエストを送信して先に返ったものを使用し、残りはキャンセルする）
+    async def __request_hedged_async(
+        self, api_key: str, kwargs: dict, timeout: tuple[float, float]
+    ) -> any:
+        delay = None if kwargs.get("stream") else self.get_hedge_delay()
+
+        if delay is None:
+            return await self.__request_async(api_key, kwargs, timeout)
+
+        tasks = {asyncio.create_task(self.__request_async(api_key, kwargs, timeout))}
+        task_hedge: asyncio.Task | None = None
+        error_first: Exception | None = None
+
+        if not (await asyncio.wait(tasks, timeout=delay))[0]:
+            task_hedge = asyncio.create_task(self.__request_async(api_key, kwargs, timeout))
+            tasks.add(task_hedge)
+            Metrics.increment("openai_hedges_total", result="sent")
+
+        try:
+            # 成功したものを返す（全て失敗した場合は最初のエラーを発生させる）
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        if task is task_hedge:
+                            Metrics.increment("openai_hedges_total", result="won")
+
+                        return task.result()
+
+                    error_first = error_first or task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        raise error_first
+
+    # ChatGPTのAPIに非同期でリクエストを送信する（引数はopenai.ChatCompletion.acreateと同じ）
+    async def acreate(self, api_key: str, **kwargs) -> any:
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            remaining = self.deadline - (time.monotonic() - start)
+
+            try:
+                return await self.__request_hedged_async(
+                    api_key, kwargs, self.__get_request_timeout(remaining)
+                )
+            except Exception as e:
+                if not self.__is_retryable(e) or attempt >= self.max_retries:
+                    raise
+
+                backoff = self.get_backoff(attempt, e)
+
+                # 全体の期限までに再送信できない場合は、そのままエラーとする
+                if time.monotonic() - start + backoff >= self.deadline:
+                    raise
+
+                Metrics.increment("openai_retries_total", reason=type(e).__name__)
+                await asyncio.sleep(backoff)
+                attempt += 1
+
+    # 非同期のリクエストで共有するセッションを閉じる
+    async def close_async(self) -> None:
+        if self.__session_async is not None:
+            await self.__session_async.close()
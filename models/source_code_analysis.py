@@ -0,0 +1,82 @@
+import re
+
+from .utility import Utility
+from .ng_word_matcher import NgWordMatcher
+
+
+# ChatGPTの返答からjavascriptのソースコードを抽出し、解析した結果を保持するクラス
+class SourceCodeAnalysis:
+    # シングルクォートで囲まれたURL（https://~, http://~）の正規表現パターン
+    PATTERN_URL = re.compile(r"'(https?://[\w/:%#\$&\?\(\)~\.=\+\-]+)'")
+    # コメントの正規表現パターン
+    PATTERN_COMMENT = re.compile(r"(?<!:)//.*?$|\/\*.*?\*\/", re.DOTALL | re.MULTILINE)
+
+    def __init__(self, content: str) -> None:
+        # ChatGPTの返答
+        self.content = content
+        # javascriptのソースコード（コメント、改行コード付き）
+        self.source_code_with_comment = self.__extract_source_code(content)
+        # javascriptのソースコード（コメント、改行コードを削除したもの）
+        self.source_code = self.PATTERN_COMMENT.sub(
+            "", self.source_code_with_comment
+        ).replace("\n", "")
+        # importされているモジュール
+        self.import_modules = self.__extract_import_modules(self.source_code)
+        # シングルクォートで囲まれたURL
+        self.urls: list[str] = self.PATTERN_URL.findall(self.source_code)
+        # NGワードの検索結果（NgWordMatcherのインスタンスごとに保持する）
+        self.__ng_word_hits: dict[int, list[tuple[str, int]]] = {}
+
+    # ChatGPTの返答からjavascriptのソースコードをコメント、改行コード付きで抽出する
+    def __extract_source_code(self, content: str) -> str:
+        # 正規表現パターンを設定する
+        pattern = (
+            r"```javascript\n(.*?)\n```"
+            if r"```javascript" in content
+            else r"```\n(.*?)\n```"
+        )
+
+        return re.search(pattern, content, re.DOTALL).group(1)
+
+    # javascriptのソースコードでimportされているモジュールを抽出する
+    def __extract_import_modules(self, source_code: str) -> list[str]:
+        import_modules = []
+
+        # ソースコードを";"で分割し、配列にする→ループ
+        for item in source_code.split(";"):
+            # 両端の空白を削除する
+            sentence = item.strip()
+
+            # 最初の6文字が"import"でない場合は、処理を抜ける
+            if sentence[:6] != "import":
+                break
+
+            import_modules.extend(self.parse_import_modules(sentence))
+        return import_modules
+
+    # 1つのimport文からimportされているモジュールを抽出する
+    @classmethod
+    def parse_import_modules(cls, sentence: str) -> list[str]:
+        # importとfromの間を取得する
+        import_module = sentence[7 : sentence.find("from")].strip()
+        # "*"、" as "、"{"、"}"を削除し、全ての空白を削除する
+        import_module = Utility.remove_chars(
+            import_module, ["*", " as ", "{", "}", " "]
+        )
+
+        # ","が含まれる場合は","で分割する
+        return import_module.split(",") if "," in import_module else [import_module]
+
+    # javascriptのソースコードに含まれるNGワードとその位置を返す
+    def find_ng_words(self, matcher: NgWordMatcher) -> list[tuple[str, int]]:
+        # 同じNgWordMatcherで検索済みの場合は、前回の結果を返す
+        if id(matcher) not in self.__ng_word_hits:
+            self.__ng_word_hits[id(matcher)] = matcher.find(self.source_code)
+
+        return list(self.__ng_word_hits[id(matcher)])
+
+    # javascriptのソースコードにNGワードが含まれているか確認し、含まれている場合はそのNGワードを返す
+    def check_ng_words(self, matcher: NgWordMatcher) -> list[str]:
+        hits = {ng_word for ng_word, _ in self.find_ng_words(matcher)}
+
+        return [ng_word for ng_word in matcher.ng_words if ng_word in hits]
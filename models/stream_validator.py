@@ -0,0 +1,187 @@
+from concurrent.futures import Future
+
+from .ng_word_matcher import NgWordMatcher
+from .source_code_analysis import SourceCodeAnalysis
+from .url_validator import UrlValidator
+
+
+# ChatGPTの返答を受信しながら少しずつ解析し、ルールに違反することが確定した時点で知らせるクラス
+# 確定した部分の結果は、受信し終えた返答をSourceCodeAnalysisで解析したもの（import_modules、check_ng_words、urls）と一致する
+# ・ソースコードは"```javascript\n"から始まるものとし、改行までの行が揃った範囲を確定した部分として解析する
+#   （閉じていない"/*"を含む行は、閉じるまで確定しない）
+# ・"```javascript"を含まない返答は、どのコードブロックが使われるか確定しないため、受信中は解析しない
+# 受信し終えた返答は、打ち切らなかった場合も含めてfind_violationsで確認するため、このクラスでは確認しない
+class StreamValidator:
+    FENCE_JAVASCRIPT = "```javascript\n"
+    FENCE_CLOSE = "\n```"
+    # 違反の種類（find_violationsの結果のキーと同じ）
+    VIOLATIONS = ("importModules", "ngWords", "invalidUrls")
+
+    def __init__(
+        self,
+        matcher: NgWordMatcher,
+        importable_modules: list[str],
+        url_validator: UrlValidator | None = None,
+        abort_on: list[str] = VIOLATIONS
+    ) -> None:
+        self.matcher = matcher
+        self.importable_modules = importable_modules
+        # URLの確認に使用するインスタンス（Noneの場合は確認しない）
+        self.url_validator = url_validator
+        # 受信を打ち切る違反の種類
+        self.abort_on = abort_on
+        # 受信した返答
+        self.content = ""
+        # 確定した部分のソースコード（コメント、改行コードを削除したもの）
+        self.source_code = ""
+        # importされているモジュールと、シングルクォートで囲まれたURL（確定した部分のみ）
+        self.import_modules: list[str] = []
+        self.urls: list[str] = []
+        # ソースコードの開始位置と、確定した部分の終了位置（返答の中の位置）
+        self.__start: int | None = None
+        self.__position = 0
+        # コードブロックが閉じたかどうか
+        self.__closed = False
+        # importの並びが続いているかどうかと、次の文の開始位置（ソースコードの中の位置）
+        self.__in_prologue = True
+        self.__position_statement = 0
+        # NGワードとURLを検索し終えた位置（ソースコードの中の位置）
+        self.__position_ng_word = 0
+        self.__position_url = 0
+        self.__ng_word_hits: set[str] = set()
+        self.__length_ng_word = max(map(len, matcher.ng_words), default=1)
+        # URLの確認結果
+        self.__futures_url: dict[str, Future] = {}
+
+    # 受信した返答の一部を追加し、ルールに違反することが確定した場合はTrueを返す
+    def feed(self, delta: str) -> bool:
+        self.content += delta
+
+        if self.__start is None:
+            index = self.content.find(self.FENCE_JAVASCRIPT)
+
+            if index < 0:
+                return False
+
+            self.__start = self.__position = index + len(self.FENCE_JAVASCRIPT)
+
+        if not self.__closed:
+            self.__commit()
+
+        return self.should_abort()
+
+    # ソースコードのうち、新たに確定した部分を解析する
+    def __commit(self) -> None:
+        # コードブロックが閉じた場合は、閉じるまでを全て確定する
+        close = self.content.find(self.FENCE_CLOSE, max(self.__start, self.__position - 1))
+
+        if close >= 0:
+            self.__add_source_code(self.content[self.__position:close])
+            self.__position = close
+            self.__closed = True
+        else:
+            end = self.content.rfind("\n", self.__position) + 1
+
+            if end <= self.__position:
+                return
+
+            source_code = SourceCodeAnalysis.PATTERN_COMMENT.sub("", self.content[self.__position:end])
+
+            # 閉じていないコメントがある場合は、閉じるまで待つ
+            if "/*" in source_code:
+                return
+
+            self.__add_source_code(self.content[self.__position:end])
+            self.__position = end
+
+        self.__scan_statements()
+        self.__scan_ng_words()
+        self.__scan_urls()
+
+    # 確定した部分のソースコードを、コメント、改行コードを削除して追加する
+    def __add_source_code(self, source_code: str) -> None:
+        self.source_code += SourceCodeAnalysis.PATTERN_COMMENT.sub("", source_code).replace("\n", "")
+
+    # ";"で区切られた文のうち、確定したものからimportされているモジュールを抽出する
+    def __scan_statements(self) -> None:
+        while self.__in_prologue:
+            end = self.source_code.find(";", self.__position_statement)
+
+            # コードブロックが閉じた場合は、最後の";"以降も1つの文とする
+            if end < 0:
+                if not self.__closed:
+                    return
+
+                end = len(self.source_code)
+
+            sentence = self.source_code[self.__position_statement:end].strip()
+            self.__position_statement = end + 1
+
+            # importから始まらない文が現れた時点で、importの並びは終わる
+            if sentence[:6] != "import":
+                self.__in_prologue = False
+            else:
+                self.import_modules.extend(SourceCodeAnalysis.parse_import_modules(sentence))
+
+    # 新たに確定した部分からNGワードを検索する（前回の終わりをまたぐNGワードも検索する）
+    def __scan_ng_words(self) -> None:
+        start = max(0, self.__position_ng_word - self.__length_ng_word + 1)
+
+        for ng_word, _ in self.matcher.find(self.source_code[start:]):
+            self.__ng_word_hits.add(ng_word)
+
+        self.__position_ng_word = len(self.source_code)
+
+    # 新たに確定した部分からURLを抽出し、確認を始める
+    def __scan_urls(self) -> None:
+        for match in SourceCodeAnalysis.PATTERN_URL.finditer(self.source_code, self.__position_url):
+            url = match.group(1)
+            self.urls.append(url)
+            self.__position_url = match.end()
+
+            if self.url_validator is not None and url not in self.__futures_url:
+                self.__futures_url[url] = self.url_validator.submit(url)
+
+        # URLはシングルクォートから始まるため、最後のシングルクォートから次回の検索を始める
+        # （それより前から始まるURLは、閉じるシングルクォートまで確定している）
+        quote = self.source_code.rfind("'", self.__position_url)
+        self.__position_url = quote if quote >= 0 else len(self.source_code)
+
+    # importされているモジュールのうち、使用できないもの
+    def get_disallowed_modules(self) -> list[str]:
+        return [
+            module for module in self.import_modules
+            if module not in self.importable_modules
+        ]
+
+    # 含まれているNGワード（NgWordMatcherの順番）
+    def get_ng_words(self) -> list[str]:
+        return [ng_word for ng_word in self.matcher.ng_words if ng_word in self.__ng_word_hits]
+
+    # 確認が終わったURLのうち、無効なもの
+    def get_invalid_urls(self) -> list[str]:
+        return [
+            url for url, future in self.__futures_url.items()
+            if future.done() and not future.result()
+        ]
+
+    # 確定したルールの違反（find_violationsと同じ形式）
+    def get_violations(self) -> dict[str, list[str]]:
+        return {
+            "importModules": self.get_disallowed_modules(),
+            "ngWords": self.get_ng_words(),
+            "invalidUrls": self.get_invalid_urls()
+        }
+
+    # 受信を打ち切る違反が確定したかどうか
+    def should_abort(self) -> bool:
+        violations = self.get_violations()
+
+        return any(violations[kind] for kind in self.abort_on)
+
+    # 受信を打ち切った場合の返答（確定した部分までとし、コードブロックを閉じる）
+    def get_content_truncated(self) -> str:
+        if self.__closed or self.__start is None:
+            return self.content
+
+        return self.content[:self.__position] + self.FENCE_CLOSE[1:]
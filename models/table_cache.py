@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timedelta
+from pynamodb.models import Model
+from pynamodb.attributes import UnicodeAttribute, TTLAttribute
+from .app_config import AppConfig
+
+
+IS_DEV = AppConfig.is_dev()
+# DynamoDB Localなどの接続先（Noneの場合はAWSに接続する）
+HOST = AppConfig.get()["dynamoDb"]["host"]
+
+
+# ChatGPTとのやりとりのキャッシュを保存するテーブル
+class TableCache(Model):
+    # テーブルの基本情報
+    class Meta:
+        table_name = f"Generating3dcg-Cache{'-dev' if IS_DEV else ''}"
+        # 東京リージョン
+        region = "ap-northeast-1"
+        primary_key = "key"
+        # リード・ライトの単位
+        read_capacity_units = 5
+        write_capacity_units = 5
+        host = HOST
+
+    # 列の定義
+    key = UnicodeAttribute(hash_key=True, null=False)
+    value = UnicodeAttribute(null=False)
+    # 有効期限（テーブルのTTLに設定すると、期限切れのレコードは自動で削除される）
+    expires_at = TTLAttribute(null=False)
+
+    # キャッシュを取得する（存在しない、または期限切れの場合はNoneを返す）
+    @classmethod
+    def get_value(cls, key: str) -> list[dict[str, str]] | None:
+        try:
+            item = cls.get(key)
+        except cls.DoesNotExist:
+            return None
+
+        # TTLによる削除は即時ではないため、期限切れを確認する
+        if item.expires_at < datetime.now(item.expires_at.tzinfo):
+            return None
+
+        return json.loads(item.value)
+
+    # キャッシュを保存する
+    @classmethod
+    def set_value(cls, key: str, value: list[dict[str, str]], ttl: float) -> None:
+        cls(
+            key,
+            value=json.dumps(value, ensure_ascii=False),
+            expires_at=timedelta(seconds=ttl)
+        ).save()
@@ -0,0 +1,106 @@
+from pynamodb.models import Model
+from pynamodb.attributes import UnicodeAttribute, NumberAttribute
+from pynamodb.exceptions import UpdateError
+from .app_config import AppConfig
+
+
+IS_DEV = AppConfig.is_dev()
+# DynamoDB Localなどの接続先（Noneの場合はAWSに接続する）
+HOST = AppConfig.get()["dynamoDb"]["host"]
+
+
+# 連番やユーザー数などのカウンターを保存するテーブル
+class TableCounter(Model):
+    # テーブルの基本情報
+    class Meta:
+        table_name = f"Generating3dcg-Counter{'-dev' if IS_DEV else ''}"
+        # 東京リージョン
+        region = "ap-northeast-1"
+        primary_key = "name"
+        # リード・ライトの単位
+        read_capacity_units = 5
+        write_capacity_units = 5
+        host = HOST
+
+    # 列の定義
+    name = UnicodeAttribute(hash_key=True, null=False)
+    value = NumberAttribute(null=False, default=0)
+
+    # カウンターの値を取得する（存在しない場合は0を返す）
+    @classmethod
+    def get_value(cls, name: str) -> int:
+        try:
+            return cls.get(name).value
+        except cls.DoesNotExist:
+            return 0
+
+    # 複数のカウンターの値をまとめて取得する（存在しないものは0とする）
+    @classmethod
+    def get_values(cls, names: list[str]) -> dict[str, int]:
+        values = {name: 0 for name in names}
+
+        for counter in cls.batch_get(names):
+            values[counter.name] = counter.value
+
+        return values
+
+    # カウンターに値を加算し、加算後の値を返す（UpdateItemのADDで原子的に加算する）
+    @classmethod
+    def increment(cls, name: str, count: int = 1) -> int:
+        counter = cls(name)
+        counter.update(actions=[cls.value.add(count)])
+
+        return counter.value
+
+    # カウンターの値を上書きする
+    @classmethod
+    def set_value(cls, name: str, value: int) -> None:
+        cls(name, value=value).save()
+
+    # カウンターの値が指定した値より小さい場合のみ、その値に更新する（同時に加算されても値が戻らない）
+    @classmethod
+    def set_max(cls, name: str, value: int) -> None:
+        try:
+            cls(name).update(
+                actions=[cls.value.set(value)],
+                condition=cls.value.does_not_exist() | (cls.value < value)
+            )
+        except UpdateError as error:
+            if error.cause_response_code != "ConditionalCheckFailedException":
+                raise
+
+    # 有効期限（UNIX時間）を値とする枠を、期限が切れている場合のみ確保する（確保できた場合はTrueを返す）
+    @classmethod
+    def acquire_lease(cls, name: str, expires_at: float, now: float) -> bool:
+        try:
+            cls(name).update(
+                actions=[cls.value.set(expires_at)],
+                condition=cls.value.does_not_exist() | (cls.value < now)
+            )
+        except UpdateError as error:
+            if error.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
+
+        return True
+
+    # 確保した枠の有効期限を延長する（有効期限が切れて他で確保された枠は延長せず、Falseを返す）
+    @classmethod
+    def renew_lease(cls, name: str, expires_at: float, expires_at_new: float) -> bool:
+        try:
+            cls(name).update(actions=[cls.value.set(expires_at_new)], condition=cls.value == expires_at)
+        except UpdateError as error:
+            if error.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
+
+        return True
+
+    # 確保した枠を解放する（有効期限が切れて他で確保された枠は解放しない）
+    @classmethod
+    def release_lease(cls, name: str, expires_at: float) -> None:
+        try:
+            cls(name).update(actions=[cls.value.set(0)], condition=cls.value == expires_at)
+        except UpdateError as error:
+            if error.cause_response_code != "ConditionalCheckFailedException":
+                raise
@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta, timezone
+from pynamodb.models import Model
+from pynamodb.attributes import (
+    UnicodeAttribute,
+    NumberAttribute,
+    UTCDateTimeAttribute,
+    TTLAttribute
+)
+from .app_config import AppConfig
+
+
+IS_DEV = AppConfig.is_dev()
+# DynamoDB Localなどの接続先（Noneの場合はAWSに接続する）
+HOST = AppConfig.get()["dynamoDb"]["host"]
+
+
+# ChatGPTとのやりとりを非同期で実行するジョブの状態を保存するテーブル
+class TableJob(Model):
+    # テーブルの基本情報
+    class Meta:
+        table_name = f"Generating3dcg-Job{'-dev' if IS_DEV else ''}"
+        # 東京リージョン
+        region = "ap-northeast-1"
+        primary_key = "job_id"
+        # リード・ライトの単位
+        read_capacity_units = 5
+        write_capacity_units = 5
+        host = HOST
+
+    # 列の定義
+    job_id = UnicodeAttribute(hash_key=True, null=False)
+    # ジョブの種類（"firstMessage"、"message"、"export"、"import"）
+    kind = UnicodeAttribute(null=False)
+    # ジョブの状態（"queued"、"running"、"succeeded"、"failed"）
+    status = UnicodeAttribute(null=False)
+    # ジョブの引数、ルールに違反した内容、結果（json形式）
+    params = UnicodeAttribute(null=False)
+    findings = UnicodeAttribute(null=False, default="{}")
+    result = UnicodeAttribute(null=True)
+    # 確認した返答の件数
+    attempt = NumberAttribute(null=False, default=0)
+    # 処理したレコードの件数（"export"、"import"のジョブ）
+    progress = NumberAttribute(null=False, default=0)
+    # エラーの内容
+    error = UnicodeAttribute(null=True)
+    created_at = UTCDateTimeAttribute(null=False)
+    updated_at = UTCDateTimeAttribute(null=False)
+    # 有効期限（テーブルのTTLに設定すると、期限切れのレコードは自動で削除される）
+    expires_at = TTLAttribute(null=False)
+
+    # ジョブを登録する
+    @classmethod
+    def insert_job(cls, job_id: str, kind: str, params: dict, ttl: float) -> None:
+        now = datetime.now(timezone.utc)
+
+        cls(
+            job_id,
+            kind=kind,
+            status="queued",
+            params=json.dumps(params, ensure_ascii=False),
+            created_at=now,
+            updated_at=now,
+            expires_at=timedelta(seconds=ttl)
+        ).save()
+
+    # ジョブの状態を更新する
+    @classmethod
+    def update_job(cls, job_id: str, **values) -> None:
+        actions = [cls.updated_at.set(datetime.now(timezone.utc))]
+
+        for name, value in values.items():
+            # 辞書はjson形式の文字列に変換する
+            if isinstance(value, dict):
+                value = json.dumps(value, ensure_ascii=False)
+
+            actions.append(getattr(cls, name).set(value))
+
+        cls(job_id).update(actions=actions)
+
+    # ジョブの状態を取得する（存在しない場合はNoneを返す）
+    @classmethod
+    def select_job(cls, job_id: str) -> dict[str, any] | None:
+        try:
+            item = cls.get(job_id)
+        except cls.DoesNotExist:
+            return None
+
+        return {
+            "jobId": item.job_id,
+            "kind": item.kind,
+            "status": item.status,
+            "attempt": item.attempt,
+            "progress": item.progress,
+            "findings": json.loads(item.findings),
+            "result": json.loads(item.result) if item.result else None,
+            "error": item.error,
+            "createdAt": item.created_at,
+            "updatedAt": item.updated_at
+        }
@@ -0,0 +1,86 @@
+import hashlib
+from datetime import datetime, timezone
+from pynamodb.models import Model
+from pynamodb.attributes import UnicodeAttribute, UTCDateTimeAttribute
+from .app_config import AppConfig
+from .metrics import Metrics
+
+
+IS_DEV = AppConfig.is_dev()
+# DynamoDB Localなどの接続先（Noneの場合はAWSに接続する）
+HOST = AppConfig.get()["dynamoDb"]["host"]
+
+
+# user_idごとに、最新の返答から抽出したソースコードを保存するテーブル
+# （/getLastSourceCodeでやりとりを全て読み込まず、1回の取得で返すために使用する）
+class TableLatest(Model):
+    # テーブルの基本情報
+    class Meta:
+        table_name = f"Generating3dcg-Latest{'-dev' if IS_DEV else ''}"
+        # 東京リージョン
+        region = "ap-northeast-1"
+        primary_key = "user_id"
+        # リード・ライトの単位
+        read_capacity_units = 5
+        write_capacity_units = 5
+        host = HOST
+
+    # 列の定義
+    user_id = UnicodeAttribute(hash_key=True, null=False)
+    # ソースコード（コメント、改行コード付き）
+    content = UnicodeAttribute(null=False)
+    # ソースコード（コメント、改行コードを削除したもの）
+    source_code = UnicodeAttribute(null=False)
+    # 内容から作成したETag
+    etag = UnicodeAttribute(null=False)
+    updated_at = UTCDateTimeAttribute(null=False)
+
+    # 内容からETagを作成する
+    @classmethod
+    def make_etag(cls, content: str, source_code: str) -> str:
+        return hashlib.sha256(f"{content}\0{source_code}".encode("utf-8")).hexdigest()[:32]
+
+    # 最新のソースコードを取得する（存在しない場合はNoneを返す）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="get_latest")
+    def get_latest(cls, user_id: str) -> dict[str, str] | None:
+        try:
+            item = cls.get(user_id)
+        except cls.DoesNotExist:
+            return None
+
+        return {
+            "userId": item.user_id,
+            "content": item.content,
+            "sourceCode": item.source_code,
+            "etag": item.etag
+        }
+
+    # 最新のソースコードを保存し、ETagを返す
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="set_latest")
+    def set_latest(cls, user_id: str, content: str, source_code: str) -> str:
+        etag = cls.make_etag(content, source_code)
+        cls(
+            user_id,
+            content=content,
+            source_code=source_code,
+            etag=etag,
+            updated_at=datetime.now(timezone.utc)
+        ).save()
+
+        return etag
+
+    # 最新のソースコードを削除する（次回の取得時に、やりとりから作成し直される）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="delete_latest")
+    def delete_latest(cls, user_id: str) -> None:
+        cls(user_id).delete()
+
+    # 全てのuser_idの最新のソースコードを削除する
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="delete_all_latest")
+    def delete_all_latest(cls) -> None:
+        with cls.batch_write() as batch:
+            for item in cls.scan(attributes_to_get=["user_id"]):
+                batch.delete(item)
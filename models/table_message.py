@@ -1,14 +1,50 @@
 from pynamodb.models import Model
+from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
 from pynamodb.attributes import (
     UnicodeAttribute,
     NumberAttribute,
+    BinaryAttribute,
+    BooleanAttribute,
     UTCDateTimeAttribute
 )
 from datetime import datetime
-from main import APP_CONFIG
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+from .app_config import AppConfig
+from .table_counter import TableCounter
+from .metrics import Metrics
+from .message_codec import MessageCodec
 
 
-IS_DEV = APP_CONFIG["environment"]["value"] == "development"
+IS_DEV = AppConfig.is_dev()
+# DynamoDB Localなどの接続先（Noneの場合はAWSに接続する）
+HOST = AppConfig.get()["dynamoDb"]["host"]
+# 並列スキャンのセグメント数
+TOTAL_SEGMENTS = AppConfig.get()["dynamoDb"]["totalSegments"]
+# id列の連番を管理するカウンターの名称
+COUNTER_NAME_ID = "message_id"
+# user_idの件数を管理するカウンターの名称
+COUNTER_NAME_USER_ID = "user_id"
+# レコードを取得するときに指定できる列
+FIELDS_RECORD = ("id", "user_id", "role", "content", "aborted", "created_at")
+# contentを展開するために取得する列
+FIELDS_CONTENT = ("id", "content", "content_encoded", "codec", "base_id")
+# contentの圧縮・差分化の設定
+CODEC = MessageCodec.from_config(AppConfig.get()["messageCodec"])
+
+
+# user_idで検索するためのインデックス
+class UserIdIndex(GlobalSecondaryIndex):
+    class Meta:
+        index_name = "user_id-id-index"
+        projection = AllProjection()
+        # リード・ライトの単位
+        read_capacity_units = 5
+        write_capacity_units = 5
+
+    # user_idをパーティションキー、idをソートキーとする
+    user_id = UnicodeAttribute(hash_key=True)
+    id = NumberAttribute(range_key=True)
 
 
 # ChatGPTとのやり取りを保存するテーブル
@@ -22,18 +58,67 @@ class TableMessage(Model):
         # リード・ライトの単位
         read_capacity_units = 5
         write_capacity_units = 5
-        # host = "http://localhost:5050"
+        host = HOST
 
     # 列の定義
     id = NumberAttribute(hash_key=True, null=False)
     user_id = UnicodeAttribute(null=False)
     role = UnicodeAttribute(null=False)
-    content = UnicodeAttribute(null=False)
+    # 圧縮していないcontent（圧縮した場合はNone）
+    content = UnicodeAttribute(null=True)
+    # 圧縮したcontent（圧縮していない場合、及び圧縮を導入する前のレコードはNone）
+    content_encoded = BinaryAttribute(null=True)
+    # contentの圧縮方式（"zlib"、"zstd"、差分の場合は末尾に"+delta"が付く）
+    codec = UnicodeAttribute(null=True)
+    # 差分の基準となるレコードのid
+    base_id = NumberAttribute(null=True)
+    # ルールに違反することが確定したため、受信を途中で打ち切った返答かどうか（打ち切っていない場合はNone）
+    aborted = BooleanAttribute(null=True)
     created_at = UTCDateTimeAttribute(null=False, default=datetime.now())
+    # インデックスの定義
+    user_id_index = UserIdIndex()
+
+    # 既存のテーブルにインデックスを追加する（既存のレコードはDynamoDB側で自動的に登録される）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="update_table")
+    def update_table(cls) -> bool:
+        connection = cls._get_connection()
+        index_name = UserIdIndex.Meta.index_name
+        table = connection.describe_table()
 
-    # id列の最大値を取得する
+        # インデックスが既に存在する場合は何もしない
+        for index in table.get("GlobalSecondaryIndexes", []):
+            if index["IndexName"] == index_name:
+                return False
+
+        connection.connection.client.update_table(
+            TableName=cls.Meta.table_name,
+            AttributeDefinitions=[
+                {"AttributeName": "user_id", "AttributeType": "S"},
+                {"AttributeName": "id", "AttributeType": "N"}
+            ],
+            GlobalSecondaryIndexUpdates=[{
+                "Create": {
+                    "IndexName": index_name,
+                    "KeySchema": [
+                        {"AttributeName": "user_id", "KeyType": "HASH"},
+                        {"AttributeName": "id", "KeyType": "RANGE"}
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                    "ProvisionedThroughput": {
+                        "ReadCapacityUnits": UserIdIndex.Meta.read_capacity_units,
+                        "WriteCapacityUnits": UserIdIndex.Meta.write_capacity_units
+                    }
+                }
+            }]
+        )
+
+        return True
+
+    # id列の最大値を取得する（テーブルを全件走査するため、移行時のみ使用する）
     @classmethod
-    def __get_max_id(cls) -> int:
+    @Metrics.timed("dynamodb_seconds", operation="get_max_id")
+    def get_max_id(cls) -> int:
         max_id = 0
 
         for item in cls.scan():
@@ -42,98 +127,290 @@ class TableMessage(Model):
 
         return max_id
 
+    # 連番のカウンターを、id列の最大値より小さい場合のみ合わせる（移行を繰り返しても値を戻さない）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="update_counter_id")
+    def update_counter_id(cls) -> int:
+        max_id = cls.get_max_id()
+        TableCounter.set_max(COUNTER_NAME_ID, max_id)
+
+        return max_id
+
+    # 指定した件数のidを確保し、先頭のidを返す（複数のインスタンスから同時に呼ばれても重複しない）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", operation="allocate_ids")
+    def __allocate_ids(cls, count: int) -> int:
+        return TableCounter.increment(COUNTER_NAME_ID, count) - count + 1
+
     # レコードを追加する
     @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="insert_record")
     def insert_record(cls, user_id: str, role: str, content: str) -> None:
-        # id列の最大値を取得
-        max_id = cls.__get_max_id()
+        # idを確保
+        new_id = cls.__allocate_ids(1)
         # レコードを追加
-        record = cls(
-            id=max_id+1,
-            user_id=user_id,
-            role=role,
-            content=content
-        )
+        record = cls(id=new_id, user_id=user_id, role=role)
+        cls.__set_content(record, content)
         record.save()
 
-    # レコードを複数追加する
+    # レコードを複数追加する（messagesには、roleとcontent、受信を打ち切った返答はabortedを含む辞書を渡す）
+    # baseには、差分の基準となる返答（idとcontent）を渡す。次回の追加で使用する基準を返す
     @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="insert_records")
     def insert_records(
-        cls, user_id: str, messages: list[dict[str, str]]
+        cls, user_id: str, messages: list[dict[str, any]], base: dict | None = None
+    ) -> dict | None:
+        # 追加する件数分のidを確保
+        new_id = cls.__allocate_ids(len(messages))
+
+        # バッチ書き込みでレコードを追加（25件ごとに送信され、未処理のレコードは再送される）
+        with cls.batch_write() as batch:
+            for message in messages:
+                role = message["role"]
+                content = message["content"]
+                # レコードを追加（返答のみ差分で保存する。受信を打ち切った返答は、abortedがTrueとなる）
+                record = cls(id=new_id, user_id=user_id, role=role, aborted=message.get("aborted"))
+                cls.__set_content(record, content, base if role == "assistant" else None)
+                batch.save(record)
+
+                # 差分ではない返答は、以降の返答の基準とする
+                if role == "assistant" and not MessageCodec.is_delta(record.codec):
+                    base = {"id": new_id, "content": content}
+
+                # idを更新
+                new_id += 1
+
+        return base
+
+    # contentを圧縮してレコードに設定する（baseを渡した場合は、差分で保存することがある）
+    @classmethod
+    def __set_content(
+        cls, record: "TableMessage", content: str, base: dict | None = None
     ) -> None:
-        # id列の最大値を取得
-        max_id = cls.__get_max_id()
-
-        # レコードを1件ずつ追加
-        for message in messages:
-            # アンパック代入
-            role, content = message.values()
-            # レコードを追加
-            record = cls(
-                id=max_id+1,
-                user_id=user_id,
-                role=role,
-                content=content
-            )
-            record.save()
-            # id列の最大値を更新
-            max_id += 1
+        codec, payload = CODEC.encode(content, base["content"] if base else None)
+
+        if codec is None:
+            record.content = content
+        else:
+            record.content_encoded = payload
+            record.codec = codec
+
+            if MessageCodec.is_delta(codec):
+                record.base_id = base["id"]
 
     # レコードを削除する
     @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="delete_record")
     def delete_record(cls, user_id: str) -> int:
         # 削除したレコード件数
         count = 0
 
-        # user_idが一致するレコードを削除
-        for item in cls.scan(cls.user_id == user_id):
-            item.delete()
-            count += 1
+        # user_idが一致するレコードをバッチ削除
+        with cls.batch_write() as batch:
+            for item in cls.user_id_index.query(user_id):
+                batch.delete(item)
+                count += 1
+
+        # user_idのレコードが全て削除されたため、user_idの件数を1件減らす
+        if count > 0:
+            TableCounter.increment(COUNTER_NAME_USER_ID, -1)
 
         return count
 
+    # テーブルをセグメントに分割して並列にスキャンし、セグメントごとの処理結果を返す
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", operation="scan_parallel")
+    def scan_parallel(
+        cls,
+        handler: Callable[[Iterator["TableMessage"]], any],
+        total_segments: int = TOTAL_SEGMENTS,
+        **kwargs
+    ) -> list[any]:
+        # セグメントごとにスキャンし、handlerに渡す
+        def scan_segment(segment: int) -> any:
+            return handler(cls.scan(
+                segment=segment, total_segments=total_segments, **kwargs
+            ))
+
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            return list(executor.map(scan_segment, range(total_segments)))
+
+    # テーブルのセグメントをlimit件までスキャンし、レコードと続きを取得するためのキーを返す（続きがない場合、キーはNone）
+    # （basesには差分の基準となる返答を保持する辞書を渡す。ページを跨いで使い回すと、基準の取得を省略できる）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", operation="scan_segment_page")
+    def scan_segment_page(
+        cls,
+        segment: int,
+        total_segments: int,
+        limit: int,
+        last_evaluated_key: dict | None = None,
+        bases: dict[int, str] | None = None
+    ) -> tuple[list[dict[str, any]], dict | None]:
+        results = cls.scan(
+            segment=segment,
+            total_segments=total_segments,
+            limit=limit,
+            last_evaluated_key=last_evaluated_key
+        )
+        bases = {} if bases is None else bases
+        records = [cls.__to_record(item, FIELDS_RECORD, bases) for item in results]
+
+        return records, results.last_evaluated_key
+
+    # 書き出したレコードを、idと作成日時を変えずにバッチ書き込みで追加し、追加した件数とidの最大値を返す
+    # （同じidのレコードは上書きする。contentは圧縮の設定に従うが、差分では保存しない）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", operation="import_records")
+    def import_records(cls, records: Iterable[dict[str, any]]) -> tuple[int, int]:
+        count = 0
+        max_id = 0
+
+        with cls.batch_write() as batch:
+            for record in records:
+                item = cls(
+                    id=record["id"],
+                    user_id=record["user_id"],
+                    role=record["role"],
+                    aborted=record.get("aborted"),
+                    created_at=record["created_at"]
+                )
+                cls.__set_content(item, record["content"])
+                batch.save(item)
+                count += 1
+                max_id = max(max_id, record["id"])
+
+        return count, max_id
+
+    # 連番のカウンターを、指定したidより小さい場合のみ合わせる（読み込んだレコードとidが重複しないようにする）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", operation="raise_counter_id")
+    def raise_counter_id(cls, max_id: int) -> None:
+        TableCounter.set_max(COUNTER_NAME_ID, max_id)
+
     # レコードを全件削除する
     @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="delete_all_records")
     def delete_all_records(cls) -> int:
-        # 削除したレコード件数
-        count = 0
+        # セグメント内のレコードをバッチ削除し、削除した件数を返す
+        def delete_segment(items: Iterator[TableMessage]) -> int:
+            count = 0
 
-        # レコードを削除
-        for item in cls.scan():
-            item.delete()
-            count += 1
+            with cls.batch_write() as batch:
+                for item in items:
+                    batch.delete(item)
+                    count += 1
+
+            return count
+
+        # キーのみを取得し、セグメントごとに並列で削除
+        count = sum(cls.scan_parallel(delete_segment, attributes_to_get=["id"]))
+        # user_idが存在しなくなったため、user_idの件数を0件にする
+        TableCounter.set_value(COUNTER_NAME_USER_ID, 0)
 
         return count
 
     # レコードを検索する
     @classmethod
     def select_records(cls, user_id: str) -> list[dict[str, any]]:
-        # 検索結果
+        return cls.select_conversation(user_id)[0]
+
+    # レコードを検索し、検索結果と差分の基準となる最後の返答（idとcontent、存在しない場合はNone）を返す
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="select_records")
+    def select_conversation(cls, user_id: str) -> tuple[list[dict[str, any]], dict | None]:
+        # 展開したcontentのうち、差分の基準となり得るもの
+        bases: dict[int, str] = {}
         records: list[dict[str, any]] = []
+        base = None
+
+        # インデックスからレコードを検索し、listに格納（id列の昇順で取得される）
+        for item in cls.user_id_index.query(user_id):
+            record = cls.__to_record(item, FIELDS_RECORD, bases)
+            records.append(record)
 
-        # レコードを検索し、listに格納
-        for item in cls.scan(cls.user_id == user_id):
-            records.append({
-                "id": item.id,
-                "user_id": item.user_id,
-                "role": item.role,
-                "content": item.content,
-                "created_at": item.created_at
-            })
-        # id列の昇順にソート
-        records.sort(key=lambda x: x["id"])
+            if item.role == "assistant" and item.id in bases:
+                base = {"id": item.id, "content": record["content"]}
 
-        return records
+        return records, base
+
+    # user_idでレコードをlimit件まで検索し、検索結果と続きを取得するためのキーを返す（続きがない場合、キーはNone）
+    # （fieldsを指定した場合は、その列のみ取得する）
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="select_records_page")
+    def select_records_page(
+        cls,
+        user_id: str,
+        limit: int,
+        last_evaluated_key: dict | None = None,
+        fields: tuple[str, ...] = FIELDS_RECORD
+    ) -> tuple[list[dict[str, any]], dict | None]:
+        # contentを取得する場合は、展開に必要な列も取得する
+        attributes = set(fields) | (set(FIELDS_CONTENT) if "content" in fields else set())
+        results = cls.user_id_index.query(
+            user_id,
+            limit=limit,
+            last_evaluated_key=last_evaluated_key,
+            attributes_to_get=list(attributes)
+        )
+        bases: dict[int, str] = {}
+        records = [cls.__to_record(item, fields, bases) for item in results]
+
+        return records, results.last_evaluated_key
+
+    # 検索結果を指定した列のみの辞書に変換する
+    @classmethod
+    def __to_record(
+        cls, item: "TableMessage", fields: tuple[str, ...], bases: dict[int, str]
+    ) -> dict[str, any]:
+        return {
+            field: cls.__decode_content(item, bases) if field == "content" else getattr(item, field)
+            for field in fields
+        }
+
+    # レコードのcontentを展開する（以前の形式のレコードは、そのまま返す）
+    # 差分の場合は、basesから基準となる返答を取得する（存在しない場合はテーブルから取得する）
+    @classmethod
+    def __decode_content(cls, item: "TableMessage", bases: dict[int, str]) -> str:
+        if item.codec is None:
+            content = item.content
+        elif MessageCodec.is_delta(item.codec):
+            if item.base_id not in bases:
+                cls.__decode_content(cls.get(item.base_id), bases)
+
+            return MessageCodec.decode(item.codec, item.content_encoded, bases[item.base_id])
+        else:
+            content = MessageCodec.decode(item.codec, item.content_encoded)
+
+        # 差分ではないものは、差分の基準となり得るため保持する
+        bases[item.id] = content
+
+        return content
+
+    # 新しいuser_idを登録し、user_idの件数を1件増やす
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="register_user_id")
+    def register_user_id(cls) -> None:
+        TableCounter.increment(COUNTER_NAME_USER_ID)
 
     # user_idの件数を取得する（重複を除く）
     @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="count_user_id")
     def count_user_id(cls) -> int:
-        # user_idのリスト
-        user_ids: list[str] = []
+        return TableCounter.get_value(COUNTER_NAME_USER_ID)
 
-        # user_idをリストに格納
-        for item in cls.scan():
-            if item.user_id not in user_ids:
-                user_ids.append(item.user_id)
+    # テーブルを全件走査してuser_idの件数を数え直し、カウンターを更新する
+    @classmethod
+    @Metrics.timed("dynamodb_seconds", "dynamodb", operation="recount_user_id")
+    def recount_user_id(cls) -> int:
+        # セグメント内のuser_idを集合に格納する
+        def collect_user_ids(items: Iterator[TableMessage]) -> set[str]:
+            return {item.user_id for item in items}
+
+        # user_idのみを取得し、セグメントごとに並列で集計
+        user_ids: set[str] = set().union(
+            *cls.scan_parallel(collect_user_ids, attributes_to_get=["user_id"])
+        )
+        TableCounter.set_value(COUNTER_NAME_USER_ID, len(user_ids))
 
         return len(user_ids)
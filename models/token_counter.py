@@ -0,0 +1,55 @@
+import threading
+
+
+# ネットワークに接続せずに、ChatGPTに送信するメッセージのトークン数を見積もるためのクラス
+class TokenCounter:
+    # ASCII文字は約4文字で1トークン、それ以外（日本語など）は約1文字で1トークンとする
+    CHARS_PER_TOKEN_ASCII = 4.0
+    TOKENS_PER_CHAR_OTHER = 1.0
+    # メッセージ1件あたり、及び返答の開始に加算されるトークン数
+    TOKENS_PER_MESSAGE = 4
+    TOKENS_PER_REPLY = 3
+    # 補正係数の更新に使用する重み（指数移動平均）と、補正係数の範囲
+    WEIGHT_CALIBRATION = 0.2
+    RATIO_MIN = 0.5
+    RATIO_MAX = 2.0
+
+    # 見積もりに掛ける補正係数（APIが返した実際のトークン数との比率から更新する）
+    __ratio = 1.0
+    __lock = threading.Lock()
+
+    # 文字列のトークン数を見積もる（補正前）
+    @classmethod
+    def __estimate_text(cls, text: str) -> float:
+        count_ascii = sum(1 for char in text if char.isascii())
+        count_other = len(text) - count_ascii
+
+        return (
+            count_ascii / cls.CHARS_PER_TOKEN_ASCII
+            + count_other * cls.TOKENS_PER_CHAR_OTHER
+        )
+
+    # メッセージのリストのトークン数を見積もる（補正前）
+    @classmethod
+    def __estimate_messages(cls, messages: list[dict[str, str]]) -> float:
+        return sum(
+            cls.__estimate_text(message["content"]) + cls.TOKENS_PER_MESSAGE
+            for message in messages
+        ) + cls.TOKENS_PER_REPLY
+
+    # メッセージのリストのトークン数を見積もる
+    @classmethod
+    def count_messages(cls, messages: list[dict[str, str]]) -> int:
+        return int(cls.__estimate_messages(messages) * cls.__ratio) + 1
+
+    # APIが返した実際のトークン数で補正係数を更新する
+    @classmethod
+    def calibrate(cls, messages: list[dict[str, str]], prompt_tokens: int) -> None:
+        estimated = cls.__estimate_messages(messages)
+
+        if estimated <= 0 or prompt_tokens <= 0:
+            return
+
+        with cls.__lock:
+            ratio = cls.__ratio + cls.WEIGHT_CALIBRATION * (prompt_tokens / estimated - cls.__ratio)
+            cls.__ratio = min(max(ratio, cls.RATIO_MIN), cls.RATIO_MAX)
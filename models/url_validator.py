@@ -0,0 +1,185 @@
+import time
+import asyncio
+import aiohttp
+import threading
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from requests.adapters import HTTPAdapter
+
+from .metrics import Metrics
+
+
+# URLが有効であるかを並列に確認し、結果をキャッシュするためのクラス
+class UrlValidator:
+    def __init__(
+        self,
+        timeout: float = 5,
+        deadline: float = 10,
+        max_workers: int = 8,
+        cache_ttl: float = 3600,
+        cache_size: int = 1024
+    ) -> None:
+        # 1件あたりのタイムアウト（秒）
+        self.timeout = timeout
+        # 全件の確認を打ち切るまでの時間（秒）
+        self.deadline = deadline
+        # キャッシュの有効期間（秒）と最大件数
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # URLをキーとし、確認結果と有効期限を値とするキャッシュ（古い順に並ぶ）
+        self.__cache: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self.__lock = threading.Lock()
+        # 接続を使い回すためのセッション
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        # 非同期で確認する場合の同時接続数と、接続を使い回すためのセッション
+        self.max_workers = max_workers
+        self.__session_async: aiohttp.ClientSession | None = None
+
+    # キャッシュから確認結果を取得する（存在しない、または期限切れの場合はNoneを返す）
+    def __get_cache(self, url: str) -> bool | None:
+        with self.__lock:
+            if url not in self.__cache:
+                return None
+
+            is_valid, expires_at = self.__cache[url]
+
+            # 期限切れの場合は削除する
+            if expires_at < time.monotonic():
+                del self.__cache[url]
+                return None
+
+            # 最近使用したものとして末尾に移動する
+            self.__cache.move_to_end(url)
+
+            return is_valid
+
+    # キャッシュに確認結果を格納する（最大件数を超えた場合は最も古いものを削除する）
+    def __set_cache(self, url: str, is_valid: bool) -> None:
+        with self.__lock:
+            self.__cache[url] = (is_valid, time.monotonic() + self.cache_ttl)
+            self.__cache.move_to_end(url)
+
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+
+    # HEADリクエストを送信し、URLが有効であるか確認する
+    def __request(self, url: str) -> bool:
+        try:
+            response = self.__session.head(url, timeout=self.timeout)
+            # 200番代のステータスコードであれば有効とする
+            is_valid = response.status_code // 100 == 2
+        # タイムアウトや接続エラーが発生した場合は、無効とみなす
+        except requests.RequestException:
+            is_valid = False
+
+        self.__set_cache(url, is_valid)
+
+        return is_valid
+
+    # URLが有効であるか確認する
+    def validate_url(self, url: str) -> bool:
+        return self.validate_urls([url])[url]
+
+    # URLの確認を開始し、確認結果を受け取るFutureを返す（キャッシュに存在する場合は完了したFutureを返す）
+    # （ChatGPTの返答を受信しながら、URLを受信した順に確認するために使用する）
+    def submit(self, url: str) -> Future:
+        is_valid = self.__get_cache(url)
+
+        if is_valid is None:
+            return self.__executor.submit(self.__request, url)
+
+        future = Future()
+        future.set_result(is_valid)
+
+        return future
+
+    # 複数のURLが有効であるか並列に確認し、URLをキーとする確認結果を返す
+    @Metrics.timed("url_validation_seconds", "url", mode="blocking")
+    def validate_urls(self, urls: list[str]) -> dict[str, bool]:
+        results: dict[str, bool] = {}
+        futures = {}
+
+        for url in urls:
+            if url in results or url in futures:
+                continue
+
+            is_valid = self.__get_cache(url)
+
+            # キャッシュに存在しない場合のみリクエストを送信する
+            if is_valid is None:
+                futures[url] = self.__executor.submit(self.__request, url)
+            else:
+                results[url] = is_valid
+
+        # 期限内に確認が終わらなかったURLは無効とみなす（キャッシュはしない）
+        wait(futures.values(), timeout=self.deadline)
+
+        for url, future in futures.items():
+            results[url] = future.result() if future.done() else False
+
+        return results
+
+    # 非同期でHEADリクエストを送信し、URLが有効であるか確認する
+    async def __request_async(self, url: str) -> bool:
+        # セッションは最初に使用するときに作成する（イベントループの中で作成する必要があるため）
+        if self.__session_async is None or self.__session_async.closed:
+            self.__session_async = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+        try:
+            async with self.__session_async.head(url) as response:
+                # 200番代のステータスコードであれば有効とする
+                is_valid = response.status // 100 == 2
+        # タイムアウトや接続エラーが発生した場合は、無効とみなす
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            is_valid = False
+
+        self.__set_cache(url, is_valid)
+
+        return is_valid
+
+    # 複数のURLが有効であるか非同期で並列に確認し、URLをキーとする確認結果を返す
+    async def validate_urls_async(self, urls: list[str]) -> dict[str, bool]:
+        with Metrics.timer("url_validation_seconds", "url", mode="async"):
+            return await self.__validate_urls_async(urls)
+
+    async def __validate_urls_async(self, urls: list[str]) -> dict[str, bool]:
+        results: dict[str, bool] = {}
+        tasks = {}
+
+        for url in urls:
+            if url in results or url in tasks:
+                continue
+
+            is_valid = self.__get_cache(url)
+
+            # キャッシュに存在しない場合のみリクエストを送信する
+            if is_valid is None:
+                tasks[url] = asyncio.ensure_future(self.__request_async(url))
+            else:
+                results[url] = is_valid
+
+        if tasks:
+            # 期限内に確認が終わらなかったURLは無効とみなす（キャッシュはしない）
+            await asyncio.wait(tasks.values(), timeout=self.deadline)
+
+        for url, task in tasks.items():
+            if task.done():
+                results[url] = task.result()
+            else:
+                task.cancel()
+                results[url] = False
+
+        return results
+
+    # 非同期で確認する場合のセッションを閉じる
+    async def close_async(self) -> None:
+        if self.__session_async is not None:
+            await self.__session_async.close()
@@ -1,6 +1,7 @@
+import json
+import base64
 import string
 import random
-import requests
 from datetime import datetime
 
 
@@ -32,14 +33,28 @@ class Utility:
 
         return result
 
-    # URLが有効であるか確認する
+    # Server-Sent Events形式のメッセージを作成する
     @classmethod
-    def validate_url(cls, url: str) -> bool:
-        # HEADリクエストを送信し、ステータスコードが200以上400未満であれば有効とする
-        try:  
-            response = requests.head(url, timeout=5)
-            # 200番代のステータスコードであれば有効とする
-            return response.status_code // 100 == 2
-        # タイムアウトや接続エラーが発生した場合は、無効とみなす
-        except requests.RequestException:
-            return False
\ No newline at end of file
+    def format_sse(cls, event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # 続きを取得するためのキー（DynamoDBのLastEvaluatedKey）を、URLに含められる文字列に変換する
+    @classmethod
+    def encode_cursor(cls, key: dict) -> str:
+        source = json.dumps(key, separators=(",", ":"), sort_keys=True)
+
+        return base64.urlsafe_b64encode(source.encode("utf-8")).decode("ascii").rstrip("=")
+
+    # encode_cursorで変換した文字列を、キーに戻す（不正な文字列の場合はValueErrorを発生させる）
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> dict:
+        try:
+            source = base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True)
+            key = json.loads(source.decode("utf-8"))
+        except (ValueError, UnicodeDecodeError) as error:
+            raise ValueError("cursorが不正です。") from error
+
+        if not isinstance(key, dict):
+            raise ValueError("cursorが不正です。")
+
+        return key
@@ -0,0 +1,40 @@
+# テストで使用する共通の部品
+# ・設定ファイルはベンチマークと同じく一時ディレクトリに作成し、DynamoDBはmotoで置き換える
+# （テーブルのモジュールは読み込み時に設定を参照するため、テストのモジュールを読み込む前に設定する）
+import os
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from benchmarks.harness import get_free_port, write_config
+
+
+os.environ["APP_CONFIG_FILE"] = write_config(None, get_free_port())
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+# テストの実行中は、DynamoDBへのリクエストを全てmotoで処理する
+MOCK_DYNAMODB = mock_dynamodb()
+MOCK_DYNAMODB.start()
+
+
+# テストの終了時に、DynamoDBの置き換えを元に戻す
+def pytest_unconfigure(config: pytest.Config) -> None:
+    MOCK_DYNAMODB.stop()
+
+
+# テストごとに、作成したテーブルを全て削除する
+@pytest.fixture(autouse=True)
+def delete_tables():
+    yield
+
+    client = boto3.client("dynamodb", region_name="ap-northeast-1")
+
+    for table_name in client.list_tables()["TableNames"]:
+        client.delete_table(TableName=table_name)
+
+
+# Flaskアプリのテスト用のクライアント
+@pytest.fixture
+def client():
+    from main import app
+
+    return app.test_client()
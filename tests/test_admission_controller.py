@@ -0,0 +1,203 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from models.admission_controller import (
+    AdmissionBackend,
+    AdmissionController,
+    DynamoDbAdmissionBackend,
+    MemoryAdmissionBackend
+)
+
+
+# テスト用のインスタンスを作成する（/sendFirstMessageの優先度が高く、/sendMessageが低い）
+def make_controller(
+    backend: AdmissionBackend | None = None,
+    max_queue: int = 8,
+    queue_timeout: float = 5
+) -> AdmissionController:
+    return AdmissionController(
+        backend or MemoryAdmissionBackend(1),
+        max_queue,
+        queue_timeout,
+        7,
+        0.05,
+        {"/sendFirstMessage": 0, "/sendMessage": 1}
+    )
+
+
+# 待っているリクエストの件数が指定した件数になるまで待つ
+def wait_queued(controller: AdmissionController, count: int) -> None:
+    for _ in range(100):
+        if controller.get_stats()["queued"] == count:
+            return
+
+        time.sleep(0.01)
+
+    raise AssertionError(f"待っているリクエストが{count}件になりませんでした。")
+
+
+# 指定したエンドポイントで枠を確保し、確保した順にエンドポイントを記録してから解放するスレッドを開始する
+def start_acquire(controller: AdmissionController, endpoint: str, order: list[str]) -> threading.Thread:
+    def run() -> None:
+        lease = controller.acquire(endpoint)
+        order.append(endpoint)
+        controller.release(lease)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+
+    return thread
+
+
+# 保存先の基底クラスはインスタンス化できない
+def test_backend_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        AdmissionBackend(1)
+
+
+# 枠が空くと、到着順に関わらず優先度の高いリクエストから実行する（同じ優先度は到着順）
+def test_acquire_in_priority_order() -> None:
+    controller = make_controller()
+    lease = controller.acquire("/sendMessage")
+    order: list[str] = []
+    threads = []
+
+    for count, endpoint in enumerate(["/sendMessage", "/other", "/sendFirstMessage", "/sendMessage"], 1):
+        threads.append(start_acquire(controller, endpoint, order))
+        wait_queued(controller, count)
+
+    controller.release(lease)
+
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["/sendFirstMessage", "/sendMessage", "/sendMessage", "/other"]
+    assert controller.get_stats() == {"limit": 1, "inFlight": 0, "queued": 0}
+
+
+# queue_timeout秒待っても枠が空かない場合はNoneを返し、待っているリクエストから取り除く
+def test_acquire_times_out() -> None:
+    controller = make_controller(queue_timeout=0.2)
+    lease = controller.acquire("/sendMessage")
+    started_at = time.monotonic()
+
+    assert controller.acquire("/sendFirstMessage") is None
+    assert 0.2 <= time.monotonic() - started_at < 1
+    assert controller.get_stats()["queued"] == 0
+
+    controller.release(lease)
+
+    assert controller.get_stats()["inFlight"] == 0
+
+
+# 待っているリクエストが上限に達している場合は、待たずにNoneを返す
+def test_acquire_rejects_when_queue_is_full() -> None:
+    controller = make_controller(max_queue=0)
+    lease = controller.acquire("/sendMessage")
+    started_at = time.monotonic()
+
+    assert controller.acquire("/sendFirstMessage") is None
+    assert time.monotonic() - started_at < 0.1
+
+    controller.release(lease)
+
+
+# 待っている間に中断された場合は、待っているリクエストから取り除き、枠を残さない
+def test_acquire_async_cancelled() -> None:
+    async def run() -> None:
+        controller = make_controller()
+        lease = await controller.acquire_async("/sendMessage")
+        task = asyncio.create_task(controller.acquire_async("/sendFirstMessage"))
+
+        while controller.get_stats()["queued"] == 0:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert controller.get_stats()["queued"] == 0
+
+        await controller.release_async(lease)
+
+        assert controller.get_stats() == {"limit": 1, "inFlight": 0, "queued": 0}
+        assert await controller.acquire_async("/sendMessage") is not None
+
+    asyncio.run(run())
+
+
+# 保存先が枠を確保している間も、他のリクエストは待たされない（保存先へのアクセスをロックの外で行う）
+def test_backend_is_called_outside_lock() -> None:
+    class SlowBackend(MemoryAdmissionBackend):
+        def __init__(self) -> None:
+            super().__init__(1)
+            self.gate = threading.Event()
+            self.blocking = False
+
+        def try_acquire(self, weight: int) -> any:
+            if self.blocking:
+                self.gate.wait(5)
+
+            return super().try_acquire(weight)
+
+    backend = SlowBackend()
+    controller = make_controller(backend, max_queue=1)
+    lease = controller.acquire("/sendMessage")
+    order: list[str] = []
+    thread = start_acquire(controller, "/sendFirstMessage", order)
+    wait_queued(controller, 1)
+
+    # 解放したスレッドが、待っているリクエストの枠を確保している途中で止まる
+    backend.blocking = True
+    releaser = threading.Thread(target=controller.release, args=(lease,))
+    releaser.start()
+    time.sleep(0.1)
+    started_at = time.monotonic()
+
+    assert controller.acquire("/sendMessage") is None
+    assert time.monotonic() - started_at < 0.5
+
+    backend.gate.set()
+    releaser.join(5)
+    thread.join(5)
+
+    assert order == ["/sendFirstMessage"]
+
+
+# 枠を確保できない場合は、503とRetry-Afterを返す
+def test_endpoint_returns_503_with_retry_after(client, monkeypatch) -> None:
+    import main
+
+    controller = make_controller(max_queue=0)
+    monkeypatch.setattr(main, "ADMISSION", controller)
+    lease = controller.acquire("/sendMessage")
+
+    response = client.post("/sendFirstMessageStream", data={"content": "cube"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert response.get_json()["error"]["name"] == "Service Unavailable"
+
+    controller.release(lease)
+
+
+# DynamoDBの枠は、lease_ttlより長く確保しても延長され、他のインスタンスに渡らない
+def test_dynamodb_lease_is_renewed(client) -> None:
+    client.get("/createTable")
+    backend = DynamoDbAdmissionBackend("test", 1, 0.3)
+    other = DynamoDbAdmissionBackend("test", 1, 0.3)
+    lease = backend.try_acquire(1)
+
+    time.sleep(0.8)
+
+    assert other.try_acquire(1) is None
+    assert backend.count() == 1
+
+    backend.release(lease)
+
+    assert backend.count() == 0
+    assert other.try_acquire(1) is not None
@@ -0,0 +1,111 @@
+from models.code_repairer import CodeRepairer
+from models.ng_word_matcher import NgWordMatcher
+from models.source_code_analysis import SourceCodeAnalysis
+
+
+NO_VIOLATIONS = {"importModules": [], "ngWords": [], "invalidUrls": []}
+
+
+# ソースコードをコードブロックで囲んだ返答を作成する
+def make_content(source_code: str) -> str:
+    return f"説明です。\n```javascript\n{source_code}```\n補足です。"
+
+
+# 返答の違反を修正する
+def repair(
+    source_code: str,
+    violations: dict[str, list[str]],
+    words: list[dict[str, str]] | None = None
+) -> str | None:
+    repairer = CodeRepairer(NgWordMatcher(words or []), ["THREE"])
+
+    return repairer.repair(
+        SourceCodeAnalysis(make_content(source_code)), {**NO_VIOLATIONS, **violations}
+    )
+
+
+# NGワードは識別子の区切りでのみ置き換え、返答のコードブロック以外は変更しない
+def test_replace_ng_words() -> None:
+    source_code = (
+        "const a = new THREE.Geometry();\n"
+        "const b = THREE.GeometryUtils;\n"
+    )
+    words = [{"NG": "THREE.Geometry", "OK": "THREE.BufferGeometry"}]
+
+    assert repair(source_code, {"ngWords": ["THREE.Geometry"]}, words) == make_content(
+        "const a = new THREE.BufferGeometry();\n"
+        "const b = THREE.GeometryUtils;\n"
+    )
+
+
+# 代わりに使用するワードのバックスラッシュや\g<...>は、そのまま置き換える
+def test_replace_ng_words_with_literal_ok_word() -> None:
+    words = [{"NG": "eval", "OK": r"safe\g<0>\1\\n"}]
+
+    assert repair("eval(x);\n", {"ngWords": ["eval"]}, words) == make_content(
+        r"safe\g<0>\1\\n" + "(x);\n"
+    )
+
+
+# 代わりに使用するワードがないNGワードは修正できない
+def test_ng_word_without_ok_word_is_not_repaired() -> None:
+    words = [{"NG": "eval", "OK": ""}]
+
+    assert repair("eval(x);\n", {"ngWords": ["eval"]}, words) is None
+
+
+# importした名前を使用していない場合は、使用できないモジュールのimport文を削除する
+def test_remove_unused_import() -> None:
+    source_code = (
+        "import * as THREE from 'three';\n"
+        "import { GUI } from 'lil-gui'; // GUI\n"
+        "const scene = new THREE.Scene();\n"
+    )
+
+    assert repair(source_code, {"importModules": ["GUI"]}) == make_content(
+        "import * as THREE from 'three';\n"
+        "const scene = new THREE.Scene();\n"
+    )
+
+
+# importした名前を使用している場合や、使用できるモジュールと同じ文でimportしている場合は修正できない
+def test_used_import_is_not_repaired() -> None:
+    used = "import { GUI } from 'lil-gui';\nconst gui = new GUI();\n"
+    mixed = "import { THREE, GUI } from 'bundle';\nconst scene = new THREE.Scene();\n"
+
+    assert repair(used, {"importModules": ["GUI"]}) is None
+    assert repair(mixed, {"importModules": ["GUI"]}) is None
+
+
+# 無効なURLのテクスチャは、マテリアルのプロパティとしてのみ使用している場合にnullに置き換える
+def test_remove_invalid_texture() -> None:
+    source_code = (
+        "const texture = new THREE.TextureLoader().load('https://example.com/a.png');\n"
+        "const material = new THREE.MeshBasicMaterial({ map: texture });\n"
+    )
+
+    assert repair(source_code, {"invalidUrls": ["https://example.com/a.png"]}) == make_content(
+        "const texture = null;\n"
+        "const material = new THREE.MeshBasicMaterial({ map: texture });\n"
+    )
+
+
+# テクスチャを他の使い方をしている場合や、URLを読み込み以外で使用している場合は修正できない
+def test_unsafe_texture_is_not_repaired() -> None:
+    url = "https://example.com/a.png"
+    used = (
+        f"const texture = new THREE.TextureLoader().load('{url}');\n"
+        "texture.wrapS = THREE.RepeatWrapping;\n"
+    )
+    other = f"const url = '{url}';\nconst texture = new THREE.TextureLoader().load('{url}');\n"
+
+    assert repair(used, {"invalidUrls": [url]}) is None
+    assert repair(other, {"invalidUrls": [url]}) is None
+
+
+# 1つでも修正できない違反がある場合は、他の違反も修正しない
+def test_partial_repair_is_not_applied() -> None:
+    source_code = "import { GUI } from 'lil-gui';\nconst gui = new GUI();\neval(x);\n"
+    words = [{"NG": "eval", "OK": "run"}]
+
+    assert repair(source_code, {"ngWords": ["eval"], "importModules": ["GUI"]}, words) is None
@@ -0,0 +1,97 @@
+import pytest
+
+from models.chat_gpt import ChatGpt
+from models.conversation_session import ConversationSession
+from models.table_message import TableMessage
+
+
+FIRST = [
+    {"role": "system", "content": "コーディングルール"},
+    {"role": "user", "content": "cube"},
+    {"role": "assistant", "content": "```javascript\nconst a = 0;\n```"}
+]
+CONTENTS = ["red", "bigger", "rotate"]
+
+
+# 返答を受信したものとして、ChatGPTクラスに返答を追加する
+def reply(chat_gpt: ChatGpt, index: int) -> None:
+    chat_gpt.messages.append({"role": "assistant", "content": f"```javascript\nconst a = {index};\n```"})
+
+
+# 以前の方法（やりとりごとにテーブルへ保存し、送信する前にテーブルから全て読み直す）でメッセージを作成する
+def make_chat_gpt_old(user_id: str, content: str) -> ChatGpt:
+    chat_gpt = ChatGpt("sk-test")
+    chat_gpt.set_messages_past(TableMessage.select_records(user_id))
+    chat_gpt.compress_message()
+    chat_gpt.add_message_user(content)
+
+    return chat_gpt
+
+
+# やりとりの内容（idや日時を除く）
+def read_messages(user_id: str) -> list[tuple[str, str]]:
+    return [(record["role"], record["content"]) for record in TableMessage.select_records(user_id)]
+
+
+# 1回だけ読み込んだ履歴から作成したメッセージが、やりとりごとに読み直した場合と一致し、
+# 終了時にまとめて保存したやりとりが、やりとりごとに保存した場合と一致する
+@pytest.mark.parametrize("checkpoint", ["end", "turn"])
+def test_session_matches_per_message_reads(client, checkpoint: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    client.get("/createTable")
+    TableMessage.insert_records("new", FIRST)
+    TableMessage.insert_records("old", FIRST)
+    reads = []
+    query = TableMessage.user_id_index.query
+
+    # セッションのuser_idを読み込んだ回数を数える
+    def query_counting(hash_key, *args, **kwargs):
+        if hash_key == "new":
+            reads.append(hash_key)
+
+        return query(hash_key, *args, **kwargs)
+
+    monkeypatch.setattr(TableMessage.user_id_index, "query", query_counting)
+
+    with ConversationSession("new", "sk-test", checkpoint) as session:
+        for index, content in enumerate(CONTENTS, 1):
+            chat_gpt_old = make_chat_gpt_old("old", content)
+            reply(chat_gpt_old, index)
+            TableMessage.insert_records("old", chat_gpt_old.messages[-2:])
+
+            chat_gpt = session.make_chat_gpt(content)
+
+            assert chat_gpt.messages[:-1] == chat_gpt_old.messages[:-2]
+            assert chat_gpt.messages[-1] == chat_gpt_old.messages[-2]
+
+            reply(chat_gpt, index)
+            session.add_turn(chat_gpt)
+
+        # 履歴はセッションの開始時に1回だけ読み込む
+        assert len(reads) == 1
+
+        # "end"の場合は、終了するまで保存しない
+        if checkpoint == "end":
+            assert read_messages("new") == read_messages("old")[:3]
+
+        assert session.count_message_user() == 1 + len(CONTENTS)
+
+    assert read_messages("new") == read_messages("old")
+    assert len(read_messages("new")) == len(FIRST) + 2 * len(CONTENTS)
+
+
+# 途中でエラーが発生した場合も、それまでのやりとりを保存する
+def test_session_flushes_on_error(client) -> None:
+    client.get("/createTable")
+    TableMessage.insert_records("a", FIRST)
+
+    with pytest.raises(RuntimeError):
+        with ConversationSession("a", "sk-test") as session:
+            chat_gpt = session.make_chat_gpt("red")
+            reply(chat_gpt, 1)
+            session.add_turn(chat_gpt)
+
+            raise RuntimeError("中断")
+
+    assert read_messages("a")[-2:] == [
+        ("user", "red"), ("assistant", "```javascript\nconst a = 1;\n```")
+    ]
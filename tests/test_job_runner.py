@@ -0,0 +1,170 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import main
+from models import chat_gpt as chat_gpt_module
+from models.job_runner import JobRunner
+from models.table_job import TableJob
+
+
+# ChatGPTの代わりに、ソースコードを返答するクライアント
+class ReplyClient:
+    def create(self, api_key: str, **params) -> dict:
+        return {
+            "choices": [{"message": {"content": "```javascript\nconst a = 1;\n```"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }
+
+
+# ジョブが終了する（succeededまたはfailedになる）まで待つ
+def wait_done(job_id: str, timeout: float = 5) -> dict[str, any]:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        job = TableJob.select_job(job_id)
+
+        if job["status"] in ("succeeded", "failed"):
+            return job
+
+        time.sleep(0.02)
+
+    raise AssertionError(f"ジョブが終了しませんでした：{job_id}")
+
+
+# イベントが設定されるまで待ってから、進捗を保存して結果を返すジョブ
+def make_func(started: threading.Event, release: threading.Event):
+    def func(value: int, on_progress) -> dict:
+        started.set()
+        release.wait(5)
+        on_progress(attempt=1, findings={"ngWords": ["eval"]}, progress=value)
+
+        return {"value": value * 2}
+
+    return func
+
+
+# ジョブの状態は、実行待ち、実行中、成功の順に変わり、進捗と結果を保存する
+def test_status_changes(client) -> None:
+    client.get("/createTable")
+    runner = JobRunner(1, 4, 60)
+    started, release = threading.Event(), threading.Event()
+
+    job_id = runner.submit("export", {"value": 3}, make_func(started, release))
+    started.wait(5)
+    # 同時に実行できるジョブは1件のため、2件目は実行待ちのままとなる
+    job_id_queued = runner.submit("export", {"value": 5}, make_func(threading.Event(), release))
+
+    assert TableJob.select_job(job_id)["status"] == "running"
+    assert TableJob.select_job(job_id_queued)["status"] == "queued"
+
+    release.set()
+    job = wait_done(job_id)
+
+    assert job["status"] == "succeeded"
+    assert (job["kind"], job["attempt"], job["progress"]) == ("export", 1, 3)
+    assert job["findings"] == {"ngWords": ["eval"]}
+    assert job["result"] == {"value": 6}
+    assert job["error"] is None
+    assert job["createdAt"] <= job["updatedAt"]
+    assert wait_done(job_id_queued)["result"] == {"value": 10}
+
+
+# エラーが発生したジョブは失敗とし、エラーの内容（HTTPのエラーの場合は説明）を保存する
+def test_failed_job(client) -> None:
+    client.get("/createTable")
+    runner = JobRunner(1, 4, 60)
+
+    def func(on_progress) -> dict:
+        raise BadRequest("パスワードが不正です。")
+
+    job = wait_done(runner.submit("import", {}, func))
+
+    assert job["status"] == "failed"
+    assert job["error"] == "パスワードが不正です。"
+    assert job["result"] is None
+
+
+# 実行中及び実行待ちのジョブが上限に達している場合は登録せず、終了すると再度登録できる
+def test_is_full(client) -> None:
+    client.get("/createTable")
+    runner = JobRunner(1, 1, 60)
+    started, release = threading.Event(), threading.Event()
+
+    job_id = runner.submit("export", {"value": 1}, make_func(started, release))
+
+    assert runner.is_full()
+    assert runner.submit("export", {"value": 2}, make_func(started, release)) is None
+
+    release.set()
+    wait_done(job_id)
+
+    # 件数は状態を保存した後に減らすため、少し待つ
+    deadline = time.monotonic() + 5
+
+    while runner.is_full() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert not runner.is_full()
+
+    job_id = runner.submit("export", {"value": 2}, make_func(started, release))
+
+    assert job_id is not None
+    assert wait_done(job_id)["status"] == "succeeded"
+
+
+# ジョブの有効期限は登録した時点からttl秒後とし、テーブルのTTLに設定する
+def test_ttl(client) -> None:
+    client.get("/createTable")
+    runner = JobRunner(1, 4, 3600)
+    before = datetime.now(timezone.utc).replace(microsecond=0)
+
+    job_id = runner.submit("import", {}, lambda on_progress: {})
+    wait_done(job_id)
+    after = datetime.now(timezone.utc)
+    expires_at = TableJob.get(job_id).expires_at
+    description = TableJob._get_connection().connection.client.describe_time_to_live(
+        TableName=TableJob.Meta.table_name
+    )["TimeToLiveDescription"]
+
+    assert before + timedelta(seconds=3600) <= expires_at <= after + timedelta(seconds=3600)
+    assert description == {"TimeToLiveStatus": "ENABLED", "AttributeName": "expires_at"}
+
+
+# /submitFirstMessageで登録したジョブは、/getJobStatusで結果を取得できる
+def test_submit_first_message(client, monkeypatch: pytest.MonkeyPatch) -> None:
+    client.get("/createTable")
+    monkeypatch.setattr(chat_gpt_module, "CLIENT", ReplyClient())
+
+    job_id = client.post("/submitFirstMessage", data={"content": "cube"}).json["jobId"]
+    wait_done(job_id)
+    job = client.get("/getJobStatus", query_string={"jobId": job_id}).json
+
+    assert (job["kind"], job["status"]) == ("firstMessage", "succeeded"), job["error"]
+    assert job["result"]["sourceCode"] == "const a = 1;"
+
+
+# 存在しないジョブは404、実行待ちのジョブが上限に達している場合は503を返す
+def test_job_endpoint_errors(client, monkeypatch: pytest.MonkeyPatch) -> None:
+    client.get("/createTable")
+    monkeypatch.setattr(main, "JOB_RUNNER", JobRunner(1, 0, 60))
+
+    assert client.get("/getJobStatus", query_string={"jobId": "none"}).status_code == 404
+    assert client.post("/submitFirstMessage", data={"content": "cube"}).status_code == 503
+
+
+# 実行中のまま一定時間更新されていないジョブは、失敗したとみなす
+def test_stale_job_is_failed(client) -> None:
+    client.get("/createTable")
+    TableJob.insert_job("stale", "message", {}, 60)
+    updated_at = datetime.now(timezone.utc) - timedelta(seconds=main.APP_CONFIG["job"]["timeout"] + 1)
+    TableJob("stale").update(actions=[TableJob.status.set("running"), TableJob.updated_at.set(updated_at)])
+
+    job = client.get("/getJobStatus", query_string={"jobId": "stale"}).json
+
+    assert job["status"] == "failed"
+    assert job["error"] == "ジョブが時間内に完了しませんでした。"
+    assert TableJob.select_job("stale")["status"] == "running"
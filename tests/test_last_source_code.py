@@ -0,0 +1,96 @@
+import pytest
+
+from models import chat_gpt as chat_gpt_module
+from models.table_latest import TableLatest
+from models.table_message import TableMessage
+
+
+# ChatGPTの代わりに、指定したソースコードを返答するクライアント
+class ReplyClient:
+    def __init__(self, source_code: str) -> None:
+        self.source_code = source_code
+
+    def create(self, api_key: str, **params) -> dict:
+        return {
+            "choices": [{"message": {"content": f"```javascript\n{self.source_code}\n```"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }
+
+
+# 最新のソースコードを取得する（etagを指定した場合は、If-None-Matchに指定する）
+def get_last_source_code(client, user_id: str, etag: str | None = None):
+    headers = {"If-None-Match": f'"{etag}"'} if etag else {}
+
+    return client.get("/getLastSourceCode", query_string={"userId": user_id}, headers=headers)
+
+
+# テーブルにやりとりを保存する
+def insert_conversation(user_id: str) -> None:
+    TableMessage.insert_records(user_id, [
+        {"role": "system", "content": "コーディングルール"},
+        {"role": "user", "content": "cube"},
+        {"role": "assistant", "content": "```javascript\nconst a = 1;\n```"}
+    ])
+
+
+# やりとりが変わっていない場合は、ETagが同じで、If-None-Matchに対して304を返す
+def test_unchanged_conversation_returns_304(client) -> None:
+    client.get("/createTable")
+    insert_conversation("a")
+
+    response = get_last_source_code(client, "a")
+    etag, _ = response.get_etag()
+
+    assert response.status_code == 200
+    assert response.json["sourceCode"] == "const a = 1;"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert TableLatest.get_latest("a")["etag"] == etag
+
+    response = get_last_source_code(client, "a", etag)
+
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.get_etag() == (etag, False)
+    assert get_last_source_code(client, "a").get_etag() == (etag, False)
+
+    # 別のETagを指定した場合は、内容を返す
+    assert get_last_source_code(client, "a", "other").status_code == 200
+
+
+# 返答を追加すると、ETagが変わり、以前のETagに対しては新しい内容を返す
+def test_new_message_changes_etag(client) -> None:
+    client.get("/createTable")
+    insert_conversation("a")
+    etag, _ = get_last_source_code(client, "a").get_etag()
+
+    client.post("/insertRecord", data={"userId": "a", "role": "user", "content": "red"})
+    client.post("/insertRecord", data={
+        "userId": "a", "role": "assistant", "content": "```javascript\nconst a = 2;\n```"
+    })
+    response = get_last_source_code(client, "a", etag)
+    etag_new, _ = response.get_etag()
+
+    assert response.status_code == 200
+    assert response.json["sourceCode"] == "const a = 2;"
+    assert etag_new != etag
+    assert get_last_source_code(client, "a", etag_new).status_code == 304
+
+
+# /sendMessageで返答を受け取った場合も、最新のソースコードとETagを更新する
+def test_send_message_changes_etag(client, monkeypatch: pytest.MonkeyPatch) -> None:
+    client.get("/createTable")
+    insert_conversation("a")
+    etag, _ = get_last_source_code(client, "a").get_etag()
+
+    monkeypatch.setattr(chat_gpt_module, "CLIENT", ReplyClient("const a = 3;"))
+    response = client.post("/sendMessage", data={"userId": "a", "content": "red"})
+
+    assert response.status_code == 200
+
+    response = get_last_source_code(client, "a", etag)
+    etag_new, _ = response.get_etag()
+
+    assert response.status_code == 200
+    assert response.json["sourceCode"] == "const a = 3;"
+    assert etag_new != etag
+    assert get_last_source_code(client, "a", etag_new).status_code == 304
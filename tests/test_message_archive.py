@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from models.message_archive import ArchiveWriter, MessageArchive
+from models.table_counter import TableCounter
+from models.table_latest import TableLatest
+from models.table_message import TableMessage
+
+
+USER_IDS = [f"u{index}" for index in range(6)]
+
+
+# user_idごとに、ユーザーのメッセージと返答を交互に保存する
+def insert_conversations() -> dict[str, list[dict[str, any]]]:
+    for user_id in USER_IDS:
+        TableMessage.insert_records(user_id, [
+            {"role": "user", "content": f"cube {user_id}"},
+            {"role": "assistant", "content": f"```javascript\nconst a = '{user_id}';\n```"},
+            {"role": "user", "content": "more"},
+            {"role": "assistant", "content": f"```javascript\nconst b = '{user_id}';\n```"}
+        ])
+        TableMessage.register_user_id()
+
+    return {user_id: TableMessage.select_records(user_id) for user_id in USER_IDS}
+
+
+# 5件ずつスキャンし、8件以上書き込んだ時点でファイルを閉じる設定で作成する
+# （motoはセグメントを区別しないため、1セグメントとする）
+def make_archive(directory: str) -> MessageArchive:
+    return MessageArchive(directory, "jsonl", 1, page_size=5, part_size=8, max_bases=2, max_workers=2)
+
+
+# 書き出した全てのファイルのレコードのid
+def read_ids(archive: MessageArchive) -> list[int]:
+    return [
+        record["id"]
+        for path in archive.list_files()
+        for records in MessageArchive.read_file(path, 100)
+        for record in records
+    ]
+
+
+# 書き出すファイルの形式の基底クラスはインスタンス化できない
+def test_archive_writer_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        ArchiveWriter()
+
+
+# 書き出したファイルを空のテーブルに読み込むと、レコードとカウンターが元に戻る
+def test_export_and_import(client, tmp_path) -> None:
+    client.get("/createTable")
+    records = insert_conversations()
+    archive = make_archive(str(tmp_path))
+    progress: list[int] = []
+
+    result = archive.export(progress.append)
+
+    assert result["count"] == 24
+    assert result["files"] == 3
+    assert progress == [10, 20, 24]
+    assert sorted(read_ids(archive)) == list(range(1, 25))
+
+    TableMessage.delete_all_records()
+    TableCounter.set_value("message_id", 0)
+    progress = []
+
+    result = make_archive(str(tmp_path)).import_files(progress.append)
+
+    assert result == {"directory": str(tmp_path), "count": 24, "files": 3, "userIds": 6}
+    assert progress[-1] == 24
+    assert TableCounter.get_value("message_id") == 24
+    assert {user_id: TableMessage.select_records(user_id) for user_id in USER_IDS} == records
+
+
+# 書き出しが中断した場合は、checkpoint.jsonの位置から再開し、重複なく書き出す
+def test_export_resumes_from_checkpoint(client, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    client.get("/createTable")
+    insert_conversations()
+    scan_segment_page = TableMessage.scan_segment_page
+    calls = []
+
+    # 4回目のスキャンで中断する
+    def scan_segment_page_failing(*args, **kwargs):
+        calls.append(args)
+
+        if len(calls) == 4:
+            raise RuntimeError("中断")
+
+        return scan_segment_page(*args, **kwargs)
+
+    monkeypatch.setattr(TableMessage, "scan_segment_page", scan_segment_page_failing)
+
+    with pytest.raises(RuntimeError):
+        make_archive(str(tmp_path)).export()
+
+    with open(tmp_path / "checkpoint.json", encoding="utf-8") as file:
+        segment = json.load(file)["segments"][0]
+
+    assert (segment["part"], segment["count"], segment["done"]) == (1, 10, False)
+    assert segment["lastEvaluatedKey"] is not None
+
+    monkeypatch.setattr(TableMessage, "scan_segment_page", scan_segment_page)
+    archive = make_archive(str(tmp_path))
+    result = archive.export()
+    ids = read_ids(archive)
+
+    assert result["count"] == 24
+    assert sorted(ids) == list(range(1, 25))
+
+    # 書き出し終えたディレクトリで再度書き出しても、スキャンせずに同じ結果を返す
+    assert make_archive(str(tmp_path)).export()["count"] == 24
+    assert sorted(read_ids(archive)) == list(range(1, 25))
+
+
+# 形式やセグメント数が異なる場合は、続きから書き出せないためエラーとする
+def test_export_rejects_different_segments(client, tmp_path) -> None:
+    client.get("/createTable")
+    insert_conversations()
+    make_archive(str(tmp_path)).export()
+    archive = MessageArchive(str(tmp_path), "jsonl", 2)
+
+    with pytest.raises(ValueError):
+        archive.export()
+
+
+# 読み込むと、返答を上書きしたuser_idの最新のソースコードを削除する
+def test_import_invalidates_latest(client, tmp_path) -> None:
+    client.get("/createTable")
+    insert_conversations()
+    make_archive(str(tmp_path)).export()
+    TableLatest.set_latest("u1", "content", "source")
+    TableLatest.set_latest("other", "content", "source")
+
+    make_archive(str(tmp_path)).import_files()
+
+    assert TableLatest.get_latest("u1") is None
+    assert TableLatest.get_latest("other") is not None
@@ -0,0 +1,125 @@
+import pytest
+
+from models import table_message
+from models.message_codec import MessageCodec
+from models.table_message import TableMessage
+
+
+# 差分で保存されやすい、少しずつ変更した返答
+BASE = "```javascript\nimport * as THREE from 'three';\n" + "".join(
+    f"const v{index} = {index * 7919 % 1000};\n" for index in range(60)
+) + "```"
+REPLIES = [
+    BASE,
+    BASE.replace("const v3 =", "let v3 ="),
+    BASE.replace("const v10 =", "let v10 =") + "\n説明",
+    BASE.replace("const v20 =", "let v20 =")
+]
+
+
+# テーブルに保存するメッセージを、圧縮・差分化する設定にする
+@pytest.fixture
+def codec(monkeypatch: pytest.MonkeyPatch) -> MessageCodec:
+    codec = MessageCodec("zlib", 10, True, 0.5)
+    monkeypatch.setattr(table_message, "CODEC", codec)
+
+    return codec
+
+
+# user_idのやりとりを保存する（ユーザーのメッセージと返答を交互に保存する）
+def insert_conversation(user_id: str) -> None:
+    messages = []
+
+    for index, reply in enumerate(REPLIES):
+        messages.append({"role": "user", "content": f"message {index}"})
+        messages.append({"role": "assistant", "content": reply})
+
+    TableMessage.insert_records(user_id, messages)
+
+
+# 圧縮したメッセージと差分は、展開すると元に戻る
+def test_encode_decode_round_trip(codec: MessageCodec) -> None:
+    name, payload = codec.encode(REPLIES[0])
+    name_delta, payload_delta = codec.encode(REPLIES[1], REPLIES[0])
+
+    assert name == "zlib"
+    assert name_delta == "zlib+delta"
+    assert len(payload_delta) < len(payload)
+    assert MessageCodec.decode(name, payload) == REPLIES[0]
+    assert MessageCodec.decode(name_delta, payload_delta, REPLIES[0]) == REPLIES[1]
+
+    with pytest.raises(ValueError):
+        MessageCodec.decode(name_delta, payload_delta)
+
+
+# 短いメッセージや、圧縮しない設定の場合は圧縮しない
+def test_encode_skips_short_or_disabled() -> None:
+    assert MessageCodec("zlib", 512).encode("short") == (None, None)
+    assert MessageCodec("none", 0).encode(BASE) == (None, None)
+
+
+# 差分で保存した返答は、基準となる返答を通して元の返答に戻る
+def test_select_conversation_decodes_deltas(client, codec: MessageCodec) -> None:
+    client.get("/createTable")
+    insert_conversation("a")
+
+    items = list(TableMessage.user_id_index.query("a"))
+    records, base = TableMessage.select_conversation("a")
+
+    assert [MessageCodec.is_delta(item.codec) for item in items if item.role == "assistant"] == [
+        False, True, True, True
+    ]
+    assert [record["content"] for record in records if record["role"] == "assistant"] == REPLIES
+    assert base == {"id": items[1].id, "content": REPLIES[0]}
+
+
+# 基準となる返答を含まないページでも、テーブルから基準を取得して展開する
+def test_select_records_page_fetches_missing_base(client, codec: MessageCodec) -> None:
+    client.get("/createTable")
+    insert_conversation("a")
+
+    contents = []
+    last_evaluated_key = None
+
+    while True:
+        records, last_evaluated_key = TableMessage.select_records_page("a", 1, last_evaluated_key)
+        contents.extend(record["content"] for record in records)
+
+        if last_evaluated_key is None:
+            break
+
+    assert contents[1::2] == REPLIES
+
+    # contentのみを指定した場合も、展開に必要な列を取得する
+    records, _ = TableMessage.select_records_page("a", 8, None, ("content",))
+
+    assert [record["content"] for record in records][1::2] == REPLIES
+
+
+# 圧縮を導入する前の形式のレコードは、設定に関わらずそのまま読み込める
+def test_legacy_uncompressed_rows_are_read(client, codec: MessageCodec) -> None:
+    client.get("/createTable")
+    connection = TableMessage._get_connection().connection.client
+
+    for id, role, content in [(1, "user", "cube"), (2, "assistant", BASE)]:
+        connection.put_item(TableName=TableMessage.Meta.table_name, Item={
+            "id": {"N": str(id)},
+            "user_id": {"S": "a"},
+            "role": {"S": role},
+            "content": {"S": content},
+            "created_at": {"S": "2023-03-20T00:00:00.000000+0000"}
+        })
+
+    records, base = TableMessage.select_conversation("a")
+
+    assert [record["content"] for record in records] == ["cube", BASE]
+    assert base == {"id": 2, "content": BASE}
+
+    # 以前の形式の返答を基準として、差分で追加できる（idのカウンターは移行時と同じく既存のレコードに合わせる）
+    TableMessage.update_counter_id()
+    TableMessage.insert_records("a", [
+        {"role": "user", "content": "more"}, {"role": "assistant", "content": REPLIES[1]}
+    ], base)
+
+    assert MessageCodec.is_delta(TableMessage.get(4).codec)
+    assert TableMessage.select_records("a")[-1]["content"] == REPLIES[1]
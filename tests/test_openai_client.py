@@ -0,0 +1,139 @@
+import time
+import asyncio
+import openai
+import pytest
+from openai import error
+
+from benchmarks.harness import FakeOpenAiServer
+from models.openai_client import OpenAiClient
+
+
+MESSAGES = [{"role": "user", "content": "cube"}]
+
+
+# ChatGPTのAPIを模したサーバーを起動し、openaiの接続先にする
+@pytest.fixture
+def server():
+    server = FakeOpenAiServer(latency=0.01, retry_after=0.05).start()
+    api_base = openai.api_base
+    openai.api_base = server.api_base
+
+    yield server
+
+    openai.api_base = api_base
+    server.stop()
+
+
+# リクエストを送信し、返答の内容を返す（is_asyncがTrueの場合は非同期で送信する）
+def create(client: OpenAiClient, is_async: bool = False) -> str:
+    kwargs = {"model": "gpt-4o", "temperature": 1.0, "messages": MESSAGES}
+
+    if is_async:
+        response = asyncio.run(client.acreate("sk-test", **kwargs))
+    else:
+        response = client.create("sk-test", **kwargs)
+
+    return response["choices"][0]["message"]["content"]
+
+
+# 429と5xxのエラーは、再送信して成功する
+@pytest.mark.parametrize("error_status", [429, 500, 503])
+@pytest.mark.parametrize("is_async", [False, True])
+def test_retry_on_error(server: FakeOpenAiServer, error_status: int, is_async: bool) -> None:
+    server.error_status = error_status
+    server.error_next = 2
+
+    assert create(OpenAiClient(max_retries=3, backoff_base=0.01), is_async)
+    assert (server.count_error, server.count) == (2, 1)
+
+
+# 再送信の回数を超えた場合は、エラーを発生させる
+def test_retry_gives_up_after_max_retries(server: FakeOpenAiServer) -> None:
+    server.error_next = 3
+
+    with pytest.raises(error.RateLimitError):
+        create(OpenAiClient(max_retries=2, backoff_base=0.01))
+
+    assert (server.count_error, server.count) == (3, 0)
+
+
+# 再送信しないエラーは、そのままエラーを発生させる
+def test_no_retry_on_client_error(server: FakeOpenAiServer) -> None:
+    server.error_status = 400
+    server.error_next = 1
+
+    with pytest.raises(error.InvalidRequestError):
+        create(OpenAiClient(max_retries=3, backoff_base=0.01))
+
+    assert server.count_error == 1
+
+
+# Retry-Afterがある場合は、バックオフより長くても、その時間以上待ってから再送信する
+@pytest.mark.parametrize("is_async", [False, True])
+def test_retry_after_is_honoured(server: FakeOpenAiServer, is_async: bool) -> None:
+    server.retry_after = 0.3
+    server.error_next = 1
+    start = time.monotonic()
+
+    assert create(OpenAiClient(max_retries=3, backoff_base=0.001, backoff_max=0.001), is_async)
+    assert time.monotonic() - start >= 0.3
+
+
+# 全体の期限までに再送信できない場合は、再送信の回数が残っていてもエラーを発生させる
+@pytest.mark.parametrize("is_async", [False, True])
+def test_deadline_cuts_off_retries(server: FakeOpenAiServer, is_async: bool) -> None:
+    server.retry_after = 0.3
+    server.error_next = 100
+    start = time.monotonic()
+
+    with pytest.raises(error.RateLimitError):
+        create(OpenAiClient(deadline=0.5, max_retries=10, backoff_base=0.001), is_async)
+
+    assert time.monotonic() - start < 0.5
+    assert server.count_error == 2
+
+
+# 応答が返らない場合は、全体の期限で打ち切る
+@pytest.mark.parametrize("is_async", [False, True])
+def test_deadline_cuts_off_stalled_request(server: FakeOpenAiServer, is_async: bool) -> None:
+    server.latency = 2.0
+    start = time.monotonic()
+
+    with pytest.raises(error.Timeout):
+        create(OpenAiClient(timeout=0.2, deadline=0.5, backoff_base=0.01), is_async)
+
+    assert time.monotonic() - start < 1.5
+
+
+# 応答が遅い場合は追加のリクエストを送信し、先に返った方を使用する
+@pytest.mark.parametrize("is_async", [False, True])
+def test_hedge_wins_when_first_request_stalls(server: FakeOpenAiServer, is_async: bool) -> None:
+    hedge = {"enabled": True, "percentile": 0.9, "minSamples": 5, "window": 20}
+    client = OpenAiClient(hedge=hedge)
+
+    # 追加のリクエストは応答時間の記録が揃ってから送信されるため、事前に記録を溜める
+    for _ in range(hedge["minSamples"]):
+        create(client, is_async)
+
+    assert client.get_hedge_delay() is not None
+
+    server.slow_latency = 2.0
+    server.slow_next = 1
+    start = time.monotonic()
+
+    assert create(client, is_async)
+    assert time.monotonic() - start < 1.0
+    assert server.count == hedge["minSamples"] + 2
+
+
+# 追加のリクエストが無効な場合は、遅い応答を待つ
+def test_no_hedge_when_disabled(server: FakeOpenAiServer) -> None:
+    client = OpenAiClient()
+    server.slow_latency = 0.5
+    server.slow_next = 1
+    start = time.monotonic()
+
+    assert create(client)
+    assert client.get_hedge_delay() is None
+    assert time.monotonic() - start >= 0.5
+    assert server.count == 1
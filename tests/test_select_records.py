@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from models.table_message import TableMessage
+from models.utility import Utility
+
+
+# user_idごとに、ユーザーのメッセージと返答をcount件ずつ保存する
+def insert_conversation(user_id: str, count: int) -> list[int]:
+    TableMessage.insert_records(user_id, [
+        {"role": "user" if index % 2 == 0 else "assistant", "content": f"{user_id} {index}"}
+        for index in range(count)
+    ])
+
+    return [record["id"] for record in TableMessage.select_records(user_id)]
+
+
+# nextCursorがなくなるまで、limit件ずつ取得する
+def read_pages(client, user_id: str, limit: int) -> list[list[int]]:
+    pages = []
+    params = {"userId": user_id, "limit": limit}
+
+    while True:
+        response = client.get("/selectRecords", query_string=params)
+        pages.append([record["id"] for record in response.json["records"]])
+
+        if response.json["nextCursor"] is None:
+            return pages
+
+        params["cursor"] = response.json["nextCursor"]
+
+
+# cursorは元のキーに戻り、URLに含められる文字列となる
+def test_cursor_round_trip() -> None:
+    key = {"id": {"N": "12"}, "user_id": {"S": "a/b+c"}}
+    cursor = Utility.encode_cursor(key)
+
+    assert Utility.decode_cursor(cursor) == key
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+# 不正な文字列や、辞書以外の値を変換した文字列はキーに戻せない
+@pytest.mark.parametrize("cursor", ["!!!", "YWJj", "W10", Utility.encode_cursor({"a": 1})[:-2] + "$$"])
+def test_decode_invalid_cursor(cursor: str) -> None:
+    with pytest.raises(ValueError):
+        Utility.decode_cursor(cursor)
+
+
+# limit件ごとに、重複や抜けなく順に取得し、最後のページではnextCursorがない
+@pytest.mark.parametrize("count, limit, sizes", [(7, 3, [3, 3, 1]), (7, 7, [7]), (7, 10, [7])])
+def test_pages(client, count: int, limit: int, sizes: list[int]) -> None:
+    client.get("/createTable")
+    ids = insert_conversation("a", count)
+    insert_conversation("b", 4)
+
+    pages = read_pages(client, "a", limit)
+
+    assert sum(pages, []) == ids
+    assert [len(page) for page in pages if page] == sizes
+    assert all(pages[:-1])
+
+
+# 件数がlimitの倍数の場合も、最後のページの後に重複して取得しない
+def test_pages_exact_multiple(client) -> None:
+    client.get("/createTable")
+    ids = insert_conversation("a", 6)
+
+    pages = read_pages(client, "a", 3)
+
+    assert sum(pages, []) == ids
+    assert pages[:2] == [ids[:3], ids[3:]]
+    assert pages[2:] in ([], [[]])
+
+
+# ndjson形式の場合も、最後の行のnextCursorで続きを取得できる
+def test_pages_ndjson(client) -> None:
+    client.get("/createTable")
+    ids = insert_conversation("a", 5)
+    params = {"userId": "a", "limit": 3, "format": "ndjson"}
+
+    lines = [json.loads(line) for line in client.get("/selectRecords", query_string=params).text.splitlines()]
+    params["cursor"] = lines[-1]["nextCursor"]
+    lines_next = [json.loads(line) for line in client.get("/selectRecords", query_string=params).text.splitlines()]
+
+    assert [line["id"] for line in lines[:-1] + lines_next[:-1]] == ids
+    assert lines_next[-1] == {"nextCursor": None}
+
+
+# 改ざんしたcursorや、別のuser_idのcursor、キーの形式が異なるcursorはエラーとする
+def test_tampered_cursor(client) -> None:
+    client.get("/createTable")
+    insert_conversation("a", 5)
+    insert_conversation("b", 5)
+    cursor = client.get("/selectRecords", query_string={"userId": "a", "limit": 2}).json["nextCursor"]
+    key = Utility.decode_cursor(cursor)
+
+    for cursor_invalid in [
+        cursor[:-3],
+        cursor + "!",
+        Utility.encode_cursor({**key, "user_id": {"S": "b"}}),
+        Utility.encode_cursor({"id": key["id"]}),
+        Utility.encode_cursor({**key, "id": {"N": "x"}}),
+        Utility.encode_cursor({**key, "id": {"S": key["id"]["N"]}}),
+        Utility.encode_cursor({**key, "id": key["id"]["N"]}),
+        Utility.encode_cursor({**key, "created_at": {"S": "2023"}})
+    ]:
+        response = client.get(
+            "/selectRecords", query_string={"userId": "a", "limit": 2, "cursor": cursor_invalid}
+        )
+
+        assert response.status_code == 400, cursor_invalid
+        assert response.json["error"]["description"] == "cursorが不正です。"
+
+    # 別のuser_idのcursorを、そのuser_idで使用した場合は取得できる
+    response = client.get("/selectRecords", query_string={
+        "userId": "b", "limit": 2, "cursor": Utility.encode_cursor({**key, "user_id": {"S": "b"}})
+    })
+
+    assert response.status_code == 200
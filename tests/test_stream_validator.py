@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+from models import chat_gpt as chat_gpt_module
+from models.chat_gpt import ChatGpt
+from models.ng_word_matcher import NgWordMatcher
+from models.source_code_analysis import SourceCodeAnalysis
+from models.stream_validator import StreamValidator
+from models.table_message import TableMessage
+
+
+MATCHER = NgWordMatcher([
+    {"NG": "THREE.Geometry", "OK": "THREE.BufferGeometry"},
+    {"NG": "Geo", "OK": ""},
+    {"NG": "eval", "OK": ""}
+])
+# 返答を組み立てる部品（import文、コメント、URL、NGワードと、受信の区切りをまたぎやすい記号）
+PIECES = [
+    "import * as THREE from 'three';", "import { A, B as C } from 'x'", "import D from 'd';",
+    ";", "\n", "// c\n", "/* multi\nline */", "/*", "*/", "'https://a.b/c.png'", "'http://x'",
+    "'", "https://q", "THREE.", "Geometry", "Geo", "ev", "al", "const a = 1;", " ",
+    "http://e.f", "```", "```\n", "x://y", ":", "//", "*"
+]
+
+
+# 部品をランダムに組み合わせて、javascriptのコードブロックを含む返答を作成する（コードブロックは閉じる）
+def make_contents(seed: int, count: int) -> list[str]:
+    rnd = random.Random(seed)
+    contents = []
+
+    while len(contents) < count:
+        body = "".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 25)))
+        prefix = rnd.choice(["", "text ", "a"])
+        suffix = rnd.choice(["\n```", "\n```\nmore", "\n```javascript\n1\n```"])
+        contents.append(f"{prefix}```javascript\n{body}{suffix}")
+
+    return contents
+
+
+# 返答をランダムな長さに分割して受信する
+def feed(validator: StreamValidator, content: str, rnd: random.Random) -> bool:
+    index = 0
+
+    while index < len(content):
+        size = rnd.randint(1, 7)
+
+        if validator.feed(content[index:index + size]):
+            return True
+
+        index += size
+
+    return False
+
+
+# 全て受信した結果は、受信し終えた返答を解析した結果と一致する
+def test_parity_with_final_analysis() -> None:
+    rnd = random.Random(0)
+
+    for content in make_contents(1, 2000):
+        analysis = SourceCodeAnalysis(content)
+        validator = StreamValidator(MATCHER, ["THREE"], abort_on=[])
+        feed(validator, content, rnd)
+
+        assert validator.import_modules == analysis.import_modules, content
+        assert validator.get_ng_words() == analysis.check_ng_words(MATCHER), content
+        assert validator.urls == analysis.urls, content
+
+
+# 受信を打ち切った時点の違反は、全て受信した場合の違反に含まれ、打ち切った返答の違反にも含まれる
+def test_abort_verdict_is_certain() -> None:
+    rnd = random.Random(0)
+    count_aborted = 0
+
+    for content in make_contents(2, 2000):
+        analysis = SourceCodeAnalysis(content)
+        validator = StreamValidator(MATCHER, ["THREE"])
+
+        if not feed(validator, content, rnd):
+            continue
+
+        count_aborted += 1
+        disallowed = set(validator.get_disallowed_modules())
+        ng_words = set(validator.get_ng_words())
+        truncated = SourceCodeAnalysis(validator.get_content_truncated())
+
+        assert disallowed <= set(analysis.import_modules) - {"THREE"}, content
+        assert ng_words <= set(analysis.check_ng_words(MATCHER)), content
+        assert disallowed <= set(truncated.import_modules), content
+        assert ng_words <= set(truncated.check_ng_words(MATCHER)), content
+
+    assert count_aborted > 0
+
+
+# 受信を打ち切った返答は、テーブルに保存する際にabortedが付く
+def test_aborted_reply_is_marked(client, monkeypatch: pytest.MonkeyPatch) -> None:
+    content = "```javascript\nimport * as CANNON from 'cannon-es';\n" + "const a = 1;\n" * 50 + "```"
+
+    class StreamClient:
+        def create(self, api_key: str, **params) -> list[dict]:
+            return [
+                {"choices": [{"delta": {"content": content[index:index + 10]}}]}
+                for index in range(0, len(content), 10)
+            ]
+
+    monkeypatch.setattr(chat_gpt_module, "CLIENT", StreamClient())
+    client.get("/createTable")
+    chat_gpt = ChatGpt("sk-test")
+    chat_gpt.messages = [{"role": "user", "content": "cube"}]
+    chat_gpt.send_message(1.0, validator=StreamValidator(MATCHER, ["THREE"]))
+    is_aborted = chat_gpt.is_aborted
+    chat_gpt.messages.append({"role": "user", "content": "fix"})
+    chat_gpt.messages.append({"role": "assistant", "content": "```javascript\nconst a = 1;\n```"})
+
+    assert is_aborted
+    assert content.startswith(chat_gpt.messages[1]["content"][:-3])
+    assert len(chat_gpt.messages[1]["content"]) < len(content)
+
+    TableMessage.insert_records("a", chat_gpt.get_messages_marked())
+
+    assert [record["aborted"] for record in TableMessage.select_records("a")] == [
+        None, True, None, None
+    ]
+    assert "aborted" not in chat_gpt.messages[1]
@@ -0,0 +1,110 @@
+from models.table_message import TableMessage, UserIdIndex
+from models.table_counter import TableCounter
+
+
+# インデックスを追加する前の形式のテーブルを作成し、レコードを登録する
+def create_legacy_table(records: list[tuple[int, str, str]]) -> None:
+    client = TableMessage._get_connection().connection.client
+    client.create_table(
+        TableName=TableMessage.Meta.table_name,
+        AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "N"}],
+        KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+        ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    )
+
+    for id, user_id, content in records:
+        client.put_item(TableName=TableMessage.Meta.table_name, Item={
+            "id": {"N": str(id)},
+            "user_id": {"S": user_id},
+            "role": {"S": "user"},
+            "content": {"S": content},
+            "created_at": {"S": "2023-03-20T00:00:00.000000+0000"}
+        })
+
+
+# user_idで検索した結果が、そのuser_idのレコードのみをidの昇順で含む
+def test_select_records_by_user_id(client) -> None:
+    client.get("/createTable")
+
+    for user_id, content in [("a", "a1"), ("b", "b1"), ("a", "a2"), ("c", "c1"), ("a", "a3")]:
+        TableMessage.insert_record(user_id, "user", content)
+
+    records = client.get("/selectRecords?userId=a").get_json()["records"]
+
+    assert [record["content"] for record in records] == ["a1", "a2", "a3"]
+    assert {record["user_id"] for record in records} == {"a"}
+    assert [record["id"] for record in records] == sorted(record["id"] for record in records)
+    assert client.get("/selectRecords?userId=z").get_json()["records"] == []
+
+
+# 既存のテーブルを移行すると、インデックスが追加され、カウンターが既存のレコードに合わせて初期化される
+def test_update_table_migrates_legacy_table(client) -> None:
+    create_legacy_table([(1, "a", "a1"), (2, "b", "b1"), (5, "a", "a2")])
+
+    response = client.get("/updateTable")
+    indexes = TableMessage._get_connection().describe_table().get("GlobalSecondaryIndexes", [])
+
+    assert response.status_code == 200
+    assert [index["IndexName"] for index in indexes] == [UserIdIndex.Meta.index_name]
+    assert TableCounter.get_value("message_id") == 5
+    assert TableMessage.count_user_id() == 2
+
+    # 既存のレコードがインデックスから検索でき、追加したレコードのidは既存のレコードと重複しない
+    TableMessage.insert_record("a", "user", "a3")
+    records = TableMessage.select_records("a")
+
+    assert [(record["id"], record["content"]) for record in records] == [
+        (1, "a1"), (5, "a2"), (6, "a3")
+    ]
+    assert [record["content"] for record in TableMessage.select_records("b")] == ["b1"]
+
+
+# 既存のテーブルがある環境で/createTableを先に呼んでも、移行後に追加したレコードが既存のレコードを上書きしない
+def test_create_table_then_update_table_keeps_existing_ids(client) -> None:
+    create_legacy_table([(1, "a", "a1"), (2, "b", "b1"), (3, "a", "a2")])
+
+    assert client.get("/createTable").status_code == 200
+    assert not TableCounter.exists()
+    assert client.get("/updateTable").status_code == 200
+
+    TableMessage.insert_record("a", "user", "a3")
+
+    assert [(record["id"], record["content"]) for record in TableMessage.select_records("a")] == [
+        (1, "a1"), (3, "a2"), (4, "a3")
+    ]
+    assert TableCounter.get_value("message_id") == 4
+
+
+# /createTableを先に呼んだ場合も、移行時にuser_idの件数を数え直す
+def test_create_table_then_update_table_counts_user_ids(client) -> None:
+    create_legacy_table([(1, "a", "a1"), (2, "b", "b1"), (3, "a", "a2")])
+
+    client.get("/createTable")
+    client.get("/updateTable")
+
+    assert TableMessage.count_user_id() == 2
+    assert client.get("/countUserId").get_json()["count"] == 2
+
+
+# 移行を繰り返しても、idのカウンターは戻らない
+def test_update_table_does_not_lower_counter(client) -> None:
+    create_legacy_table([(1, "a", "a1"), (2, "b", "b1")])
+    client.get("/updateTable")
+    TableMessage.insert_record("a", "user", "a2")
+    TableCounter.set_value("message_id", 10)
+
+    assert client.get("/updateTable").status_code == 200
+    assert TableCounter.get_value("message_id") == 10
+
+
+# インデックスが既に存在する場合は、移行しても何もしない
+def test_update_table_is_idempotent(client) -> None:
+    client.get("/createTable")
+
+    assert TableMessage.update_table() is False
+    assert client.get("/updateTable").status_code == 200
+
+
+# テーブルが存在しない場合は、移行せずにエラーを返す
+def test_update_table_without_table(client) -> None:
+    assert client.get("/updateTable").status_code == 404